@@ -0,0 +1,115 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from helpers.cache import cached_by_files
+from helpers.data_store import load_transactions, store_mtime, transactions_source_path, transactions_source_files
+from helpers.streaming import should_stream, load_streaming_statistics
+from helpers.cardholders import load_cardholder_order, load_transaction_codes
+from helpers.windows import transaction_rows
+
+AGGREGATES_BASE_PATH = './Data/cluster_calculation/aggregates/'
+
+# Amounts summed per cardholder; the cardholder comes from its code (load_transaction_codes)
+AGGREGATE_SOURCE_COLUMNS = ['transaction_amount', 'cashback_amount']
+AGGREGATE_COLUMNS = [
+    'cardholder_id', 'Total_Transaction_Value', 'Total_Cashback_Value', 'Transaction_Count',
+    'Avg_Transaction_Value', 'Avg_Cashback_Value',
+]
+
+
+def cardholder_aggregates_path(selected_cluster: int) -> str:
+    """Path of the materialized per-cardholder aggregates for the selected cluster."""
+    return f'{AGGREGATES_BASE_PATH}cardholder_aggregates_cluster_{selected_cluster}.parquet'
+
+
+def build_cardholder_aggregates(df: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate transactions into per-cardholder totals, counts and averages."""
+    grouped = df.groupby('cardholder_id').agg(
+        Total_Transaction_Value=('transaction_amount', 'sum'),
+        Total_Cashback_Value=('cashback_amount', 'sum'),
+        Transaction_Count=('transaction_amount', 'count')
+    ).reset_index()
+
+    grouped['Avg_Transaction_Value'] = grouped['Total_Transaction_Value'] / grouped['Transaction_Count']
+    grouped['Avg_Cashback_Value'] = grouped['Total_Cashback_Value'] / grouped['Transaction_Count']
+    return grouped
+
+
+def build_coded_aggregates(ranks: np.ndarray, df: pd.DataFrame, sorted_ids: np.ndarray) -> pd.DataFrame:
+    """build_cardholder_aggregates over cardholder ranks (see CardholderOrder): bincounts instead of a string-keyed groupby.
+
+    sorted_ids maps ranks back to ids; as ranks follow id order, rows come out sorted by cardholder_id like the groupby's.
+    """
+    size = len(sorted_ids)
+    count = np.bincount(ranks, minlength=size)
+    present = np.flatnonzero(count)
+    # astype: bincount returns int64 zeros, even with float weights, when a slice has no rows
+    total = np.bincount(ranks, weights=df['transaction_amount'].to_numpy(dtype=np.float64), minlength=size)[present].astype(np.float64)
+    cashback = np.bincount(ranks, weights=df['cashback_amount'].to_numpy(dtype=np.float64), minlength=size)[present].astype(np.float64)
+    count = count[present]
+    return pd.DataFrame({
+        'cardholder_id': sorted_ids[present],
+        'Total_Transaction_Value': total,
+        'Total_Cashback_Value': cashback,
+        'Transaction_Count': count,
+        'Avg_Transaction_Value': total / count,
+        'Avg_Cashback_Value': cashback / count,
+    })
+
+
+def coded_slice_aggregates(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> pd.DataFrame:
+    """Aggregates of the cluster's transactions at merchant_id and/or in the last window_days days (default: all), from their cardholder codes."""
+    rows = transaction_rows(selected_cluster, merchant_id, window_days)
+    codes = load_transaction_codes(selected_cluster)
+    order = load_cardholder_order()  # After the codes, which may intern new ids
+    return build_coded_aggregates(order.rank[codes[rows]], load_transactions(selected_cluster, columns=AGGREGATE_SOURCE_COLUMNS).take(rows),
+                                  order.sorted_ids)
+
+
+def materialize_cardholder_aggregates(selected_cluster: int) -> pd.DataFrame:
+    """Rebuild the cluster's aggregates from its transactions, or the state ingestion keeps, and write them to disk."""
+    from helpers.ingest import has_fresh_state  # ingest builds on this module
+    if should_stream(selected_cluster) or has_fresh_state(selected_cluster):
+        grouped = load_streaming_statistics(selected_cluster).aggregates[AGGREGATE_COLUMNS]
+    else:
+        grouped = coded_slice_aggregates(selected_cluster)
+    path = cardholder_aggregates_path(selected_cluster)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so concurrent sessions never read a half-written file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    grouped.to_parquet(tmp_path, engine='pyarrow', index=False)
+    os.replace(tmp_path, path)
+    return grouped
+
+
+@cached_by_files(lambda selected_cluster, merchant_id=None, window_days=None: transactions_source_files(selected_cluster))
+def load_cardholder_aggregates(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> pd.DataFrame:
+    """Load the cluster's per-cardholder aggregates, building them only when missing or stale.
+
+    With a merchant_id and/or window_days, only the cardholders' purchases at that merchant and/or
+    in the cluster's last window_days days count (see helpers.windows); each such slice is cached.
+    """
+    if merchant_id is not None or window_days is not None:
+        return coded_slice_aggregates(selected_cluster, merchant_id, window_days)
+    path = cardholder_aggregates_path(selected_cluster)
+    if os.path.exists(path) and os.path.getmtime(path) >= store_mtime(transactions_source_path(selected_cluster)):
+        return pd.read_parquet(path, engine='pyarrow')
+    return materialize_cardholder_aggregates(selected_cluster)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialize the per-cardholder aggregates for each cluster.")
+    parser.add_argument('--clusters', type=int, nargs='+', default=list(range(5)))
+    args = parser.parse_args()
+
+    for selected_cluster in args.clusters:
+        if not os.path.exists(transactions_source_path(selected_cluster)):
+            print(f"Cluster {selected_cluster}: no transactions found, skipping")
+            continue
+        grouped = materialize_cardholder_aggregates(selected_cluster)
+        print(f"Cluster {selected_cluster}: {len(grouped):,} cardholders -> {cardholder_aggregates_path(selected_cluster)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+import os
+import json
+import math
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from helpers.data_store import CLUSTER_NAMES
+from helpers.scenarios import load_cluster_summary, top_customers_profit
+from helpers.formulas import (
+    increased_revenue_target,
+    cashback_budget_targeting,
+    average_order_targeting,
+    transaction_duration_targeting,
+    deadline_targeting,
+)
+
+# One row per merchant request, in the order the requests were read
+RESULT_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('cluster', pa.int64()),
+    ('cluster_name', pa.string()),
+    ('strategy', pa.int64()),
+    ('revenue_target', pa.float64()),
+    ('required_days', pa.float64()),
+    ('achievable', pa.bool_()),
+    ('customers_to_target', pa.float64()),
+    ('cashback_budget', pa.float64()),
+    ('daily_revenue_per_customer', pa.float64()),
+    ('days_to_achieve_target', pa.float64()),
+    ('top_customers_profit', pa.float64()),
+    ('error', pa.string()),
+    ('latency_ms', pa.float64()),
+])
+
+
+# The pages stop with this when no cardholder bought twice, as strategies 3-6 need a transaction duration
+NO_REPEAT_PURCHASES = "No cardholder bought twice in this cluster, so there is no transaction duration to plan with."
+
+
+def finite_or_none(value):
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def cashback_budget_strategy(summary, revenue_target: float, with_days: bool) -> dict:
+    """Strategies 1, 5 and 6: budget and customers from floored cluster averages (5 and 6 add days)."""
+    avg_order, avg_cashback = math.floor(summary.avg_order), math.floor(summary.avg_cashback)
+    num_users = summary.cardholder_count
+    cashback_budget_needed, num_customers_to_target, potential_cashback_budget, max_possible_revenue = cashback_budget_targeting(
+        revenue_target, avg_order, avg_cashback, num_users)
+
+    if revenue_target < potential_cashback_budget:
+        return {'achievable': False, 'error': f"The revenue target must be at least {math.floor(potential_cashback_budget)} ¥ to cover the minimum cashback budget."}
+    if num_customers_to_target == num_users and revenue_target > max_possible_revenue:
+        return {'achievable': False, 'error': f"The revenue target exceeds the maximum possible revenue ({math.floor(max_possible_revenue)} ¥) for this cluster."}
+    if with_days and not summary.repeat_purchases:
+        return {'achievable': False, 'error': NO_REPEAT_PURCHASES}
+
+    result = {
+        'achievable': True,
+        'customers_to_target': math.ceil(num_customers_to_target),
+        'cashback_budget': math.floor(cashback_budget_needed),
+    }
+    if with_days:
+        _, daily_revenue_per_customer, _, days_to_achieve_target = transaction_duration_targeting(
+            revenue_target, avg_order, avg_cashback, summary.avg_transaction_duration)
+        result['daily_revenue_per_customer'] = finite_or_none(daily_revenue_per_customer)
+        result['days_to_achieve_target'] = finite_or_none(days_to_achieve_target)
+    return result
+
+
+def top_profit(summary, num_customers) -> float | None:
+    return finite_or_none(top_customers_profit([summary], np.zeros(1, dtype=np.int64), np.array([num_customers], dtype=np.float64))[0])
+
+
+def average_order_strategy(summary, revenue_target: float) -> dict:
+    """Strategy 2: customers and budget from floored averages, checked against the top cardholders."""
+    if summary.sum_avg_transaction < revenue_target:
+        return {'achievable': False, 'error': f"The maximum achievable revenue target in this cluster is {math.floor(summary.sum_avg_transaction):,} ¥."}
+    num_customers, cashback_budget, _, _ = average_order_targeting(revenue_target, summary.avg_order, summary.avg_cashback)
+    return {
+        'achievable': True,
+        'customers_to_target': finite_or_none(num_customers),
+        'cashback_budget': finite_or_none(cashback_budget),
+        'top_customers_profit': top_profit(summary, num_customers),
+    }
+
+
+def transaction_duration_strategy(summary, revenue_target: float) -> dict:
+    """Strategy 3: customers and days at the cluster's average transaction duration."""
+    if not summary.repeat_purchases:
+        return {'achievable': False, 'error': NO_REPEAT_PURCHASES}
+    if summary.max_potential_revenue < revenue_target:
+        return {'achievable': False, 'error': f"The maximum potential revenue from this cluster is {math.floor(summary.max_potential_revenue):,} ¥."}
+    num_customers, daily_revenue_per_customer, _, days_to_achieve_target = transaction_duration_targeting(
+        revenue_target, summary.avg_order, summary.avg_cashback, summary.avg_transaction_duration)
+    return {
+        'achievable': True,
+        'customers_to_target': finite_or_none(num_customers),
+        'daily_revenue_per_customer': finite_or_none(daily_revenue_per_customer),
+        'days_to_achieve_target': finite_or_none(days_to_achieve_target),
+        'top_customers_profit': top_profit(summary, num_customers),
+    }
+
+
+def deadline_strategy(summary, revenue_target: float, required_days: float) -> dict:
+    """Strategy 4: customers needed to reach the target within the merchant's deadline."""
+    if not summary.repeat_purchases:
+        return {'achievable': False, 'error': NO_REPEAT_PURCHASES}
+    if summary.max_potential_revenue < revenue_target:
+        return {'achievable': False, 'error': f"The maximum potential revenue from this cluster is {math.floor(summary.max_potential_revenue):,} ¥."}
+    daily_revenue_per_customer, max_within_days, num_customers, _, days_to_achieve_target = deadline_targeting(
+        revenue_target, summary.avg_order, summary.avg_cashback, summary.avg_transaction_duration,
+        required_days, summary.cardholder_count)
+    if max_within_days < revenue_target:
+        return {'achievable': False, 'error': f"The maximum possible revenue within {required_days:.0f} days is {math.floor(max_within_days):,} ¥."}
+    return {
+        'achievable': True,
+        'customers_to_target': finite_or_none(num_customers),
+        'daily_revenue_per_customer': finite_or_none(daily_revenue_per_customer),
+        'days_to_achieve_target': finite_or_none(days_to_achieve_target),
+        'top_customers_profit': top_profit(summary, num_customers),
+    }
+
+
+def request_field(request: dict, name: str):
+    if request.get(name) is None:
+        raise ValueError(f"missing '{name}'")
+    return request[name]
+
+
+def evaluate_request(request: dict) -> dict:
+    """Run one merchant request through the formulas of the strategy it names.
+
+    A request has a cluster, a strategy (1-6), and either a revenue target or current sales plus a
+    percentage increase. Strategy 4 also needs days. Invalid requests and clusters without data
+    become error rows; any other exception is a bug and propagates.
+    """
+    started = time.perf_counter()
+    result = {name: None for name in RESULT_SCHEMA.names}
+    result['id'] = None if request.get('id') is None else str(request['id'])
+    try:
+        selected_cluster = int(request_field(request, 'cluster'))
+        strategy = int(request_field(request, 'strategy'))
+        if not 0 <= selected_cluster < len(CLUSTER_NAMES):
+            raise ValueError(f"unknown cluster {selected_cluster}")
+        if 'target' in request:
+            revenue_target = float(request_field(request, 'target'))
+        else:
+            revenue_target = float(increased_revenue_target(float(request_field(request, 'current_sales')),
+                                                            float(request_field(request, 'percentage_increase'))))
+        required_days = math.ceil(float(request['days'])) if request.get('days') is not None else None
+        result.update(cluster=selected_cluster, cluster_name=CLUSTER_NAMES[selected_cluster], strategy=strategy,
+                      revenue_target=revenue_target, required_days=required_days)
+
+        summary = load_cluster_summary(selected_cluster)
+        if strategy in (1, 5, 6):
+            result.update(cashback_budget_strategy(summary, revenue_target, with_days=strategy != 1))
+        elif strategy == 2:
+            result.update(average_order_strategy(summary, revenue_target))
+        elif strategy == 3:
+            result.update(transaction_duration_strategy(summary, revenue_target))
+        elif strategy == 4:
+            if required_days is None:
+                raise ValueError("strategy 4 needs 'days'")
+            result.update(deadline_strategy(summary, revenue_target, required_days))
+        else:
+            raise ValueError(f"unknown strategy {strategy}")
+    except (FileNotFoundError, ValueError) as e:
+        result['achievable'] = False
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['latency_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def evaluate_chunk(requests: list) -> list:
+    return [evaluate_request(request) for request in requests]
+
+
+def read_request_chunks(path: str, chunk_size: int):
+    """Yield lists of parsed requests from a JSONL file without reading it all at once."""
+    chunk = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            chunk.append(json.loads(line))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+class ResultWriter:
+    """Stream result rows to a JSONL or Parquet file, chosen by the file extension."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.parquet = path.endswith('.parquet')
+        self.writer = pq.ParquetWriter(path, RESULT_SCHEMA) if self.parquet else open(path, 'w')
+
+    def write(self, rows: list):
+        if self.parquet:
+            self.writer.write_table(pa.Table.from_pylist(rows, schema=RESULT_SCHEMA))
+        else:
+            self.writer.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+    def close(self):
+        self.writer.close()
+
+
+def run_batch(input_path: str, output_path: str, workers: int | None = None, chunk_size: int = 256) -> dict:
+    """Evaluate every request in input_path across a process pool and stream the results to output_path."""
+    started = time.perf_counter()
+    latencies = []
+    errors = 0
+    writer = ResultWriter(output_path)
+
+    def drain(future):
+        nonlocal errors
+        rows = future.result()
+        writer.write(rows)
+        latencies.extend(row['latency_ms'] for row in rows)
+        errors += sum(row['error'] is not None for row in rows)
+
+    workers = workers or os.cpu_count() or 1
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of chunks in flight so huge request files stream through
+            in_flight = deque()
+            max_in_flight = 2 * workers
+            for chunk in read_request_chunks(input_path, chunk_size):
+                in_flight.append(executor.submit(evaluate_chunk, chunk))
+                if len(in_flight) >= max_in_flight:
+                    drain(in_flight.popleft())
+            while in_flight:
+                drain(in_flight.popleft())
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    latency = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'elapsed_s': elapsed,
+        'throughput_per_s': len(latencies) / elapsed if elapsed > 0 else float('nan'),
+        'latency_p50_ms': float(np.percentile(latency, 50)),
+        'latency_p95_ms': float(np.percentile(latency, 95)),
+        'latency_p99_ms': float(np.percentile(latency, 99)),
+        'latency_max_ms': float(latency.max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run merchant planning requests (JSONL) through the strategy formulas without Streamlit.")
+    parser.add_argument('input', help="JSONL file with one request per line, e.g. {\"cluster\": 2, \"target\": 120000, \"days\": 10, \"strategy\": 4}")
+    parser.add_argument('output', help="Results file; .parquet writes Parquet, anything else writes JSONL")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: number of CPUs)")
+    parser.add_argument('--chunk-size', type=int, default=256, help="Requests sent to a worker at a time")
+    args = parser.parse_args()
+
+    stats = run_batch(args.input, args.output, args.workers, args.chunk_size)
+    print(f"Requests:   {stats['requests']:,} ({stats['errors']:,} with errors)")
+    print(f"Elapsed:    {stats['elapsed_s']:.2f} s")
+    print(f"Throughput: {stats['throughput_per_s']:,.0f} requests/s")
+    print(f"Latency:    p50 {stats['latency_p50_ms']:.3f} ms, p95 {stats['latency_p95_ms']:.3f} ms, "
+          f"p99 {stats['latency_p99_ms']:.3f} ms, max {stats['latency_max_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
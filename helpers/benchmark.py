@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import importlib
+import subprocess
+import numpy as np
+import pandas as pd
+from helpers.cache import clear_caches as clear_data_caches
+from helpers.data_store import (
+    TRANSACTION_COLUMNS,
+    TRANSACTION_DTYPES,
+    full_dataset_csv_path,
+    rfm_csv_path,
+    load_rfm,
+)
+from helpers.aggregates import build_cardholder_aggregates, cardholder_aggregates_path, load_cardholder_aggregates
+from helpers.intervals import build_interval_stats, load_interval_stats
+from helpers.synthetic import generate_cluster_dataset
+from helpers.ranking import build_ranked_customers, build_net_value_index, load_ranked_customers, top_customers, select_for_revenue_target
+from helpers.optimizer import build_cashback_pool, load_cashback_pool, allocate_budget
+from helpers.timing import timed
+
+BENCHMARK_WORKDIR = './Data/benchmark/'
+
+# Page inputs used for every run, so timings are comparable across sizes and commits
+CURRENT_SALES = 100_000
+PERCENTAGE_INCREASE = 20
+REQUIRED_DAYS = 10
+TOP_N_FRACTION = 0.1
+CASHBACK_BUDGET = 10_000
+
+
+def prepare_dataset(root: str, selected_cluster: int, rows: int) -> str:
+    """Write a synthetic rows-long transactions CSV and matching RFM table for the cluster under root."""
+    shutil.rmtree(root, ignore_errors=True)
+    generate_cluster_dataset(selected_cluster, rows, root)
+    return root
+
+
+def benchmark_stages(selected_cluster: int) -> dict:
+    """Time each processing stage the strategy pages share, on the cluster's files in the working directory."""
+    timings = {}
+    dtypes = {col: TRANSACTION_DTYPES[col] for col in TRANSACTION_COLUMNS if col in TRANSACTION_DTYPES}
+    df = timed(timings, 'load', pd.read_csv, full_dataset_csv_path(selected_cluster), usecols=TRANSACTION_COLUMNS, dtype=dtypes)
+    df['transaction_date'] = timed(timings, 'date_parse', pd.to_datetime, df['transaction_date'], format='%Y-%m-%d %H:%M:%S')
+    rfm = timed(timings, 'load_rfm', pd.read_csv, rfm_csv_path(selected_cluster))
+
+    aggregates = timed(timings, 'groupby', build_cardholder_aggregates, df)
+    timed(timings, 'intervals', build_interval_stats, df['cardholder_id'].to_numpy(), df['transaction_date'].to_numpy())
+    ranked = timed(timings, 'sort', build_ranked_customers, rfm)
+    index = timed(timings, 'sort_net_value', build_net_value_index, aggregates)
+
+    num_customers = max(1, math.ceil(len(rfm) * TOP_N_FRACTION))
+    top = timed(timings, 'top_n', top_customers, ranked, num_customers)
+    timed(timings, 'exact_selection', select_for_revenue_target, index, CURRENT_SALES)
+    pool = timed(timings, 'cashback_pool', build_cashback_pool, {selected_cluster: aggregates})
+    timed(timings, 'budget_allocation', allocate_budget, pool, CASHBACK_BUDGET)
+    timed(timings, 'csv_export', top.to_csv, index=False)
+    return timings
+
+
+def run_strat1(selected_cluster: int):
+    strat1 = importlib.import_module('strat1')
+    strat1.get_man_values(selected_cluster)
+    ranked = load_ranked_customers(selected_cluster)
+    top_customers(ranked, math.ceil(len(ranked.customers) * TOP_N_FRACTION)).to_csv(index=False)
+
+
+def run_strat2(selected_cluster: int):
+    importlib.import_module('strat2').compute_metrics(load_cardholder_aggregates(selected_cluster), CURRENT_SALES, PERCENTAGE_INCREASE)
+
+
+def run_strat3(selected_cluster: int):
+    importlib.import_module('strat3').compute_metrics(
+        load_cardholder_aggregates(selected_cluster), load_interval_stats(selected_cluster), CURRENT_SALES, PERCENTAGE_INCREASE)
+
+
+def run_strat4(selected_cluster: int):
+    importlib.import_module('strat4').compute_metrics(
+        load_cardholder_aggregates(selected_cluster), load_interval_stats(selected_cluster), CURRENT_SALES, PERCENTAGE_INCREASE, REQUIRED_DAYS)
+
+
+def run_days_strategy(module_name: str, selected_cluster: int):
+    """Strategies 5 and 6: cluster statistics, cashback budget with days, and the top customers export."""
+    import streamlit as st
+    page = importlib.import_module(module_name)
+    st.session_state.selected_cluster = selected_cluster
+    page.load_data(selected_cluster)
+    stats = page.get_cluster_statistics(selected_cluster)
+    result = page.calculate_cashback_budget_and_customers(
+        math.floor(CURRENT_SALES * (1 + PERCENTAGE_INCREASE / 100)), stats['avg_order'], stats['avg_cashback'], stats['cardholder_count'])
+    ranked = load_ranked_customers(selected_cluster)
+    if result[0] is not None:
+        top_customers(ranked, math.ceil(result[1])).to_csv(index=False)
+
+
+def run_strat7(selected_cluster: int):
+    allocate_budget(load_cashback_pool([selected_cluster]), CASHBACK_BUDGET)
+
+
+STRATEGY_RUNS = {
+    'strat1': run_strat1,
+    'strat2': run_strat2,
+    'strat3': run_strat3,
+    'strat4': run_strat4,
+    'strat5': lambda selected_cluster: run_days_strategy('strat5', selected_cluster),
+    'strat6': lambda selected_cluster: run_days_strategy('strat6', selected_cluster),
+    'strat7': run_strat7,
+}
+
+
+def clear_caches(selected_cluster: int):
+    """Forget every cached load and materialized aggregate so the next run starts cold."""
+    clear_data_caches()
+    path = cardholder_aggregates_path(selected_cluster)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def benchmark_strategies(selected_cluster: int) -> dict:
+    """Time every strategy module end to end, cold (nothing cached) and warm (second run)."""
+    timings = {}
+    for name in STRATEGY_RUNS:
+        importlib.import_module(name)  # Keep import time out of the cold runs
+    for name, run in STRATEGY_RUNS.items():
+        clear_caches(selected_cluster)
+        cold, warm = {}, {}
+        timed(cold, name, run, selected_cluster)
+        timed(warm, name, run, selected_cluster)
+        timings[name] = {'cold_s': cold[name], 'warm_s': warm[name]}
+    return timings
+
+
+def benchmark_size(selected_cluster: int, rows: int | None, workdir: str) -> dict:
+    """Run the stage and strategy benchmarks on the shipped data (rows=None) or a synthetic dataset."""
+    started = time.perf_counter()
+    root = '.' if rows is None else prepare_dataset(os.path.join(workdir, str(rows)), selected_cluster, rows)
+    prepare_s = time.perf_counter() - started
+
+    cwd = os.getcwd()
+    # Every loader uses paths relative to the repo root, so run from the dataset's root
+    os.chdir(root)
+    try:
+        transactions = sum(1 for _ in open(full_dataset_csv_path(selected_cluster))) - 1
+        result = {
+            'size': 'shipped' if rows is None else rows,
+            'transactions': transactions,
+            'cardholders': len(load_rfm(selected_cluster)),
+            'prepare_s': prepare_s,
+            'stages': benchmark_stages(selected_cluster),
+            'strategies': benchmark_strategies(selected_cluster),
+        }
+    finally:
+        clear_data_caches()
+        os.chdir(cwd)
+    return result
+
+
+def environment() -> dict:
+    """What the numbers were measured on, so runs can be compared across commits and machines."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': pd.Timestamp.now(tz='UTC').isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(baseline: dict, current: dict):
+    """Print per-stage and per-strategy speedups of current over baseline for the sizes both ran."""
+    baseline_runs = {run['size']: run for run in baseline['runs']}
+    for run in current['runs']:
+        before = baseline_runs.get(run['size'])
+        if before is None:
+            continue
+        print(f"Size {run['size']} vs {(baseline['environment']['commit'] or 'baseline')[:10]}:")
+        for stage, seconds in run['stages'].items():
+            if stage in before['stages']:
+                print(f"  {stage:<16} {before['stages'][stage]:9.4f} s -> {seconds:9.4f} s  ({before['stages'][stage] / seconds:5.2f}x)")
+        for name, times in run['strategies'].items():
+            if name in before['strategies']:
+                old = before['strategies'][name]['cold_s']
+                print(f"  {name + ' cold':<16} {old:9.4f} s -> {times['cold_s']:9.4f} s  ({old / times['cold_s']:5.2f}x)")
+
+
+def parse_size(value: str) -> int | None:
+    return None if value == 'shipped' else int(float(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each processing stage and every strategy module at several dataset sizes.")
+    parser.add_argument('--sizes', nargs='+', default=['shipped', '100000', '1000000'],
+                        help="'shipped' for the files in Data/, or a number of synthetic transactions (e.g. 1e7 5e7)")
+    parser.add_argument('--cluster', type=int, default=2, help="Cluster whose shipped data is benchmarked and scaled up")
+    parser.add_argument('--workdir', default=BENCHMARK_WORKDIR, help="Where synthetic datasets are written")
+    parser.add_argument('--output', default='benchmark.json', help="JSON results file")
+    parser.add_argument('--baseline', help="Earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir)
+    results = {'environment': environment(), 'cluster': args.cluster, 'runs': []}
+    for size in args.sizes:
+        rows = parse_size(size)
+        print(f"Benchmarking {size} ...", file=sys.stderr)
+        run = benchmark_size(args.cluster, rows, workdir)
+        results['runs'].append(run)
+        print(f"  {run['transactions']:,} transactions, {run['cardholders']:,} cardholders", file=sys.stderr)
+        for stage, seconds in run['stages'].items():
+            print(f"  {stage:<16} {seconds:9.4f} s", file=sys.stderr)
+        for name, times in run['strategies'].items():
+            print(f"  {name:<16} {times['cold_s']:9.4f} s cold, {times['warm_s']:9.4f} s warm", file=sys.stderr)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import os
+import hashlib
+import inspect
+import threading
+import functools
+from collections import OrderedDict, namedtuple
+import numpy as np
+import pandas as pd
+
+# Number of parsed frames kept in memory across all sessions and pages, and their total size
+DATA_CACHE_MAXSIZE = 32
+DATA_CACHE_MAXBYTES = 2 << 30
+# Results for one merchant and/or date window of a cluster: many, small, and kept apart so
+# switching slices never evicts whole-cluster frames and vice versa
+SLICE_CACHE_MAXSIZE = 256
+SLICE_CACHE_MAXBYTES = 512 << 20
+SLICE_ARGUMENTS = ('merchant_id', 'window_days')
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize', 'nbytes'])
+
+
+def file_signature(path: str) -> tuple:
+    """Cheap change marker for a file: modification time and size."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def file_content_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hash a file's contents in chunks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def value_nbytes(value) -> int:
+    """Approximate memory held by a cached value: frames, arrays, bytes and tuples of them."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(value_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(value_nbytes(item) for item in value.values())
+    return 0
+
+
+class FileCache:
+    """Process-wide LRU cache whose entries are invalidated when their source files change.
+
+    A changed mtime or size triggers a content hash; the entry is only rebuilt when the
+    hash differs too, so touching a file without editing it keeps the cached value.
+    Each version of a file, i.e. each (path, mtime, size), is hashed at most once however
+    many entries depend on it, and no file is read or stat'ed while the cache lock is held.
+    """
+
+    def __init__(self, maxsize: int = DATA_CACHE_MAXSIZE, maxbytes: int = DATA_CACHE_MAXBYTES):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._hashes = {}  # path -> (signature, content hash) of the latest version hashed
+        self._hash_locks = {}
+        self._hits = 0
+        self._misses = 0
+
+    def _content_hash(self, path: str, signature: tuple) -> str:
+        """file_content_hash(path) for the version with this signature, computed once and shared."""
+        with self._lock:
+            known = self._hashes.get(path)
+            if known is not None and known[0] == signature:
+                return known[1]
+            hash_lock = self._hash_locks.setdefault(path, threading.Lock())
+        # Other sessions needing the same file wait for this hash instead of reading it again
+        with hash_lock:
+            with self._lock:
+                known = self._hashes.get(path)
+            if known is not None and known[0] == signature:
+                return known[1]
+            content_hash = file_content_hash(path)
+            # A file rewritten while it was read is hashed again next time
+            if file_signature(path) == signature:
+                with self._lock:
+                    self._hashes[path] = (signature, content_hash)
+            return content_hash
+
+    def _current_files(self, files: dict, paths: list) -> dict | None:
+        """files with updated signatures if every source still has the same contents, else None."""
+        if set(files) != set(paths):
+            return None
+        current = {}
+        for path, (signature, content_hash) in files.items():
+            if not os.path.exists(path):
+                return None
+            now = file_signature(path)
+            if now != signature and self._content_hash(path, now) != content_hash:
+                return None
+            current[path] = (now, content_hash)
+        return current
+
+    def _lookup(self, key, paths: list):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        files = self._current_files(entry[0], paths)
+        if files is None:
+            return False, None
+        with self._lock:
+            # Skip the update if the entry was replaced or evicted meanwhile; its value is still current
+            if self._entries.get(key) is entry:
+                self._entries[key] = (files, entry[1], entry[2])
+                self._entries.move_to_end(key)
+            self._hits += 1
+        return True, entry[1]
+
+    def get_or_load(self, key, paths: list, loader):
+        """Return the cached value for key, calling loader() if it is missing or stale."""
+        found, value = self._lookup(key, paths)
+        if found:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Only one session builds a given entry; the others wait and reuse it
+        with key_lock:
+            found, value = self._lookup(key, paths)
+            if found:
+                return value
+            signatures = {path: file_signature(path) for path in paths}
+            files = {path: (signature, self._content_hash(path, signature)) for path, signature in signatures.items()}
+            value = loader()
+            nbytes = value_nbytes(value)
+            with self._lock:
+                self._misses += 1
+                replaced = self._entries.pop(key, None)
+                if replaced is not None:
+                    self._nbytes -= replaced[2]
+                self._entries[key] = (files, value, nbytes)
+                self._nbytes += nbytes
+                # The newest entry stays even if it alone exceeds maxbytes
+                while len(self._entries) > 1 and (len(self._entries) > self.maxsize or self._nbytes > self.maxbytes):
+                    evicted, (_, _, evicted_nbytes) = self._entries.popitem(last=False)
+                    self._nbytes -= evicted_nbytes
+                    self._key_locks.pop(evicted, None)
+            return value
+
+    def cache_info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self.maxsize, len(self._entries), self._nbytes)
+
+    def cache_clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self._key_locks.clear()
+            self._hashes.clear()
+            self._hash_locks.clear()
+            self._hits = 0
+            self._misses = 0
+
+
+DATA_CACHE = FileCache()
+SLICE_CACHE = FileCache(SLICE_CACHE_MAXSIZE, SLICE_CACHE_MAXBYTES)
+
+
+def clear_caches():
+    DATA_CACHE.cache_clear()
+    SLICE_CACHE.cache_clear()
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def cached_by_files(paths_for):
+    """Cache a loader, keyed by its arguments and the files paths_for(*args) returns.
+
+    Calls for one merchant or date window (any SLICE_ARGUMENTS set) go to SLICE_CACHE, the rest to DATA_CACHE.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Keyed by the bound arguments, so f(1), f(1, None) and f(1, merchant_id=None) share an entry
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (func.__module__, func.__qualname__, _freeze(tuple(bound.arguments.items())))
+            sliced = any(bound.arguments.get(name) is not None for name in SLICE_ARGUMENTS)
+            cache = SLICE_CACHE if sliced else DATA_CACHE
+            return cache.get_or_load(key, paths_for(*args, **kwargs), lambda: func(*args, **kwargs))
+        wrapper.cache_info = DATA_CACHE.cache_info
+        wrapper.cache_clear = clear_caches
+        return wrapper
+    return decorator
@@ -0,0 +1,145 @@
+import os
+import argparse
+from collections import namedtuple
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from helpers.cache import cached_by_files
+from helpers.compact import binary_to_uuid
+from helpers.data_store import load_rfm, load_transactions, rfm_csv_path, transactions_source_path, transactions_source_files
+
+# One global dictionary of cardholder ids; an id's row number is its dense int32 code in every cluster and file
+CARDHOLDER_INDEX_PATH = './Data/cluster_calculation/aggregates/cardholder_index.parquet'
+NO_CARDHOLDER = -1
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl; lock a byte of the lock file with msvcrt instead
+    fcntl = None
+    import msvcrt
+
+# The dictionary in cardholder_id order: rank[code] is the position of code's id in sorted_ids,
+# so ranks compare like the ids themselves and sorted_ids[rank] maps them back.
+CardholderOrder = namedtuple('CardholderOrder', ['sorted_ids', 'rank'])
+
+
+@contextmanager
+def _index_lock():
+    """Serialize updates to the dictionary across processes, so two writers never hand out the same code."""
+    os.makedirs(os.path.dirname(CARDHOLDER_INDEX_PATH), exist_ok=True)
+    with open(f'{CARDHOLDER_INDEX_PATH}.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_cardholder_index() -> pd.Index:
+    """The dictionary as stored, uncached; empty when it has not been built."""
+    if not os.path.exists(CARDHOLDER_INDEX_PATH):
+        return pd.Index([], dtype=object)
+    return pd.Index(pd.read_parquet(CARDHOLDER_INDEX_PATH, engine='pyarrow')['cardholder_id'].to_numpy(dtype=object))
+
+
+def intern_cardholders(cardholder_ids) -> pd.Index:
+    """Append unseen ids to the dictionary (sorted among themselves); existing codes never change."""
+    with _index_lock():
+        index = read_cardholder_index()
+        unseen = pd.Index(pd.unique(np.asarray(cardholder_ids, dtype=object))).difference(index)
+        if len(unseen):
+            index = index.append(unseen)
+            tmp_path = f'{CARDHOLDER_INDEX_PATH}.{os.getpid()}.tmp'
+            pd.DataFrame({'cardholder_id': index.to_numpy()}).to_parquet(tmp_path, engine='pyarrow', index=False)
+            os.replace(tmp_path, CARDHOLDER_INDEX_PATH)
+        return index
+
+
+def id_dictionary(cardholder_ids: pd.Series) -> tuple:
+    """Distinct ids of a cardholder_id column and each row's position among them.
+
+    Compacted columns (load_transactions(compact=True)) are categoricals, which already are such a
+    dictionary, or 16-byte binary UUIDs, which are decoded back to the text the dictionary holds.
+    """
+    if isinstance(cardholder_ids.dtype, pd.CategoricalDtype):
+        return cardholder_ids.cat.categories.to_numpy(dtype=object), cardholder_ids.cat.codes.to_numpy()
+    if isinstance(cardholder_ids.dtype, pd.ArrowDtype):
+        cardholder_ids = binary_to_uuid(cardholder_ids)
+    positions, uniques = pd.factorize(cardholder_ids.to_numpy(dtype=object))
+    return np.asarray(uniques, dtype=object), positions
+
+
+def build_cardholder_index(clusters: list = range(5)) -> pd.Index:
+    """Intern every cardholder in the clusters' RFM tables and transactions."""
+    ids = []
+    for selected_cluster in clusters:
+        if os.path.exists(rfm_csv_path(selected_cluster)):
+            ids.append(load_rfm(selected_cluster)['cardholder_id'].to_numpy(dtype=object))
+        if os.path.exists(transactions_source_path(selected_cluster)):
+            ids.append(id_dictionary(load_transactions(selected_cluster, columns=['cardholder_id'], compact=True)['cardholder_id'])[0])
+    return intern_cardholders(np.concatenate(ids) if ids else [])
+
+
+def ensure_cardholder_index() -> str:
+    """Build the dictionary if it does not exist yet and return its path, for loaders keyed on it."""
+    if not os.path.exists(CARDHOLDER_INDEX_PATH):
+        build_cardholder_index()
+    return CARDHOLDER_INDEX_PATH
+
+
+@cached_by_files(lambda: [ensure_cardholder_index()])
+def load_cardholder_index() -> pd.Index:
+    """The cardholder dictionary, loaded once per version of the file."""
+    return read_cardholder_index()
+
+
+def encode_cardholders(cardholder_ids) -> np.ndarray:
+    """Dense int32 codes of cardholder ids, interning any the dictionary has not seen."""
+    cardholder_ids = np.asarray(cardholder_ids, dtype=object)
+    codes = load_cardholder_index().get_indexer(cardholder_ids)
+    if (codes == NO_CARDHOLDER).any():
+        codes = intern_cardholders(cardholder_ids).get_indexer(cardholder_ids)
+    return codes.astype(np.int32)
+
+
+@cached_by_files(lambda: [ensure_cardholder_index()])
+def load_cardholder_order() -> CardholderOrder:
+    """The dictionary sorted by cardholder_id, loaded once per version of the file.
+
+    Load it after the codes it ranks: encoding may intern new ids, which only ever appends.
+    """
+    cardholder_ids = load_cardholder_index().to_numpy()
+    order = np.argsort(cardholder_ids, kind='stable')
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    return CardholderOrder(cardholder_ids[order], rank)
+
+
+@cached_by_files(lambda selected_cluster: [*transactions_source_files(selected_cluster), ensure_cardholder_index()])
+def load_transaction_codes(selected_cluster: int) -> np.ndarray:
+    """Code of the cardholder of every transaction in the selected cluster, in file order.
+
+    Only the distinct ids are looked up; rows take their code from the compacted column's dictionary.
+    """
+    uniques, positions = id_dictionary(load_transactions(selected_cluster, columns=['cardholder_id'], compact=True)['cardholder_id'])
+    return encode_cardholders(uniques)[positions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or extend the global cardholder id dictionary.")
+    parser.add_argument('--clusters', type=int, nargs='+', default=list(range(5)))
+    args = parser.parse_args()
+
+    before = len(read_cardholder_index())
+    index = build_cardholder_index(args.clusters)
+    print(f"{len(index):,} cardholders ({len(index) - before:,} new) in {CARDHOLDER_INDEX_PATH}")
+
+
+if __name__ == "__main__":
+    main()
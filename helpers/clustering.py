@@ -0,0 +1,202 @@
+import os
+import json
+import argparse
+import itertools
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from helpers.data_store import read_rfm_table, rfm_csv_path
+
+RFM_FEATURES = ['Recency', 'Frequency', 'Monetary']
+
+CLUSTER_MODEL_PATH = './Data/cluster_calculation/cluster_model.json'
+CLUSTER_COUNT = 5  # One per name in compute_metrics.CLUSTER_NAMES
+
+MINIBATCH_SIZE = 4096
+MINIBATCH_PASSES = 3
+MINIBATCH_TOLERANCE = 1e-4  # Stop once no centroid moves further than this, in standardized units
+FEATURE_CHUNK_ROWS = 1_000_000
+
+# Cluster centres in raw RFM units, and the per-feature scale distances are measured in
+ClusterModel = namedtuple('ClusterModel', ['centroids', 'scale'])
+
+
+def fit_reference_model(rfm_tables: list) -> ClusterModel:
+    """Centroids of existing per-cluster RFM tables, with distances scaled by each feature's spread.
+
+    This reproduces the standardized k-means the shipped clusters were built with.
+    """
+    features = np.concatenate([table[RFM_FEATURES].to_numpy(dtype=np.float64) for table in rfm_tables])
+    centroids = np.array([table[RFM_FEATURES].to_numpy(dtype=np.float64).mean(axis=0) for table in rfm_tables])
+    return ClusterModel(centroids, features.std(axis=0))
+
+
+def load_reference_model(root: str = '.', clusters: int = CLUSTER_COUNT) -> ClusterModel:
+    """The model behind the RFM tables currently under root."""
+    return fit_reference_model([read_rfm_table(os.path.join(root, rfm_csv_path(selected_cluster))) for selected_cluster in range(clusters)])
+
+
+def save_model(model: ClusterModel, root: str = '.', **details):
+    path = os.path.join(root, CLUSTER_MODEL_PATH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'features': RFM_FEATURES, 'centroids': model.centroids.tolist(), 'scale': model.scale.tolist(), **details}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def current_model(root: str = '.') -> ClusterModel:
+    """The last saved model, or the one implied by the RFM tables when none has been saved yet."""
+    path = os.path.join(root, CLUSTER_MODEL_PATH)
+    if not os.path.exists(path):
+        return load_reference_model(root)
+    with open(path) as f:
+        saved = json.load(f)
+    return ClusterModel(np.array(saved['centroids']), np.array(saved['scale']))
+
+
+def nearest_centroids(features: np.ndarray, model: ClusterModel) -> np.ndarray:
+    """Index of the nearest centroid for each row of raw RFM features.
+
+    Distances are expanded into a matrix product, which the BLAS runs across all cores.
+    """
+    scaled = features / model.scale
+    centroids = model.centroids / model.scale
+    distances = (centroids ** 2).sum(axis=1) - 2 * scaled @ centroids.T
+    return distances.argmin(axis=1)
+
+
+def assign_clusters(rfm: pd.DataFrame, model: ClusterModel) -> np.ndarray:
+    """Cluster of every cardholder in an RFM table."""
+    return nearest_centroids(rfm[RFM_FEATURES].to_numpy(dtype=np.float64), model)
+
+
+def feature_statistics(chunks, previous: ClusterModel):
+    """Standard deviation of each feature and cardholders per previous cluster, accumulated chunk by chunk."""
+    count, total, total_squares = 0, np.zeros(len(RFM_FEATURES)), np.zeros(len(RFM_FEATURES))
+    sizes = np.zeros(len(previous.centroids))
+    for features in chunks:
+        count += len(features)
+        total += features.sum(axis=0)
+        total_squares += (features ** 2).sum(axis=0)
+        sizes += np.bincount(nearest_centroids(features, previous), minlength=len(sizes))
+    mean = total / max(count, 1)
+    return np.sqrt(np.maximum(total_squares / max(count, 1) - mean ** 2, 0)) + np.finfo(np.float64).eps, sizes
+
+
+def stable_order(previous: ClusterModel, centroids: np.ndarray) -> list:
+    """The order of the new centroids that keeps each cluster id on its nearest previous centroid."""
+    scaled_previous, scaled_new = previous.centroids / previous.scale, centroids / previous.scale
+    cost = ((scaled_previous[:, None, :] - scaled_new[None, :, :]) ** 2).sum(axis=2)
+    ids = range(len(centroids))
+    if len(centroids) <= 8:
+        return list(min(itertools.permutations(ids), key=lambda order: cost[list(ids), list(order)].sum()))
+    # Greedy matching for larger k, cheapest pairs first
+    order, taken = [None] * len(centroids), set()
+    for old, new in zip(*np.unravel_index(np.argsort(cost, axis=None), cost.shape)):
+        if order[old] is None and new not in taken:
+            order[old] = int(new)
+            taken.add(new)
+    return order
+
+
+def minibatch_kmeans(chunks_factory, previous: ClusterModel, batch_size: int = MINIBATCH_SIZE, passes: int = MINIBATCH_PASSES,
+                     tolerance: float = MINIBATCH_TOLERANCE, seed: int = 0) -> ClusterModel:
+    """Re-fit the clusters with mini-batch k-means, starting from the previous centroids.
+
+    chunks_factory() returns a fresh iterator of raw RFM feature arrays, so the table is streamed
+    and only one chunk is held at a time. Each centroid moves towards its mini-batch members with
+    a step of 1 / (points it has absorbed so far), counting its previous cluster's members as
+    already absorbed so a warm start is not thrown away by the first batches. The result is
+    reordered so cluster ids keep pointing at the nearest previous centroid, which keeps
+    CLUSTER_NAMES valid.
+    """
+    rng = np.random.default_rng(seed)
+    scale, absorbed = feature_statistics(chunks_factory(), previous)
+    model = ClusterModel(previous.centroids.astype(np.float64).copy(), scale)
+    clusters = len(model.centroids)
+    for _ in range(passes):
+        before = model.centroids.copy()
+        for features in chunks_factory():
+            shuffled = features[rng.permutation(len(features))]
+            for start in range(0, len(shuffled), batch_size):
+                batch = shuffled[start:start + batch_size]
+                labels = nearest_centroids(batch, model)
+                counts = np.bincount(labels, minlength=clusters)
+                sums = np.column_stack([np.bincount(labels, weights=batch[:, i], minlength=clusters) for i in range(batch.shape[1])])
+                absorbed += counts
+                moved = counts > 0
+                step = counts[moved] / absorbed[moved]
+                model.centroids[moved] += step[:, None] * (sums[moved] / counts[moved][:, None] - model.centroids[moved])
+        if np.abs((model.centroids - before) / model.scale).max() < tolerance:
+            break
+    return ClusterModel(model.centroids[stable_order(previous, model.centroids)], model.scale)
+
+
+def iter_rfm_features(paths: list, chunk_rows: int = FEATURE_CHUNK_ROWS):
+    """Raw RFM feature arrays from RFM CSVs, about chunk_rows rows at a time.
+
+    Every chunk takes rows from all files, since each per-cluster file alone would feed
+    mini-batches from a single cluster.
+    """
+    readers = [pd.read_csv(path, usecols=RFM_FEATURES, chunksize=max(chunk_rows // len(paths), 1)) for path in paths]
+    try:
+        while readers:
+            parts = []
+            for reader in list(readers):
+                part = next(reader, None)
+                if part is None:
+                    readers.remove(reader)
+                    reader.close()
+                else:
+                    parts.append(part[RFM_FEATURES].to_numpy(dtype=np.float64))
+            if parts:
+                yield np.concatenate(parts)
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+def iter_frame_features(rfm: pd.DataFrame, chunk_rows: int = FEATURE_CHUNK_ROWS):
+    """Raw RFM feature arrays from an in-memory table, chunk_rows rows at a time."""
+    for start in range(0, len(rfm), chunk_rows):
+        yield rfm[RFM_FEATURES].iloc[start:start + chunk_rows].to_numpy(dtype=np.float64)
+
+
+def label_changes(paths: list, previous: ClusterModel, model: ClusterModel, chunk_rows: int = FEATURE_CHUNK_ROWS) -> np.ndarray:
+    """Cardholders per (previous cluster, new cluster) pair."""
+    clusters = len(model.centroids)
+    changes = np.zeros((clusters, clusters), dtype=np.int64)
+    for features in iter_rfm_features(paths, chunk_rows):
+        pairs = nearest_centroids(features, previous) * clusters + nearest_centroids(features, model)
+        changes += np.bincount(pairs, minlength=clusters * clusters).reshape(clusters, clusters)
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-cluster the RFM tables with warm-started mini-batch k-means and save the model.")
+    parser.add_argument('--root', default='.', help="Directory holding the ./Data layout")
+    parser.add_argument('--batch-size', type=int, default=MINIBATCH_SIZE)
+    parser.add_argument('--passes', type=int, default=MINIBATCH_PASSES)
+    parser.add_argument('--chunk-rows', type=int, default=FEATURE_CHUNK_ROWS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dry-run', action='store_true', help="Report the new clusters without saving the model")
+    args = parser.parse_args()
+
+    previous = current_model(args.root)
+    paths = [os.path.join(args.root, rfm_csv_path(selected_cluster)) for selected_cluster in range(len(previous.centroids))]
+    model = minibatch_kmeans(lambda: iter_rfm_features(paths, args.chunk_rows), previous, args.batch_size, args.passes, seed=args.seed)
+    changes = label_changes(paths, previous, model, args.chunk_rows)
+
+    for selected_cluster, name in enumerate(CLUSTER_NAMES):
+        old, new = previous.centroids[selected_cluster], model.centroids[selected_cluster]
+        print(f"{selected_cluster} {name:<28} R/F/M {old[0]:6.1f} {old[1]:6.1f} {old[2]:9.1f} -> {new[0]:6.1f} {new[1]:6.1f} {new[2]:9.1f}"
+              f"  {changes[selected_cluster].sum():>9,} -> {changes[:, selected_cluster].sum():>9,} cardholders")
+    print(f"{changes.sum() - np.trace(changes):,} of {changes.sum():,} cardholders change cluster")
+    if not args.dry_run:
+        save_model(model, args.root, cardholders=int(changes.sum()), fitted_at=pd.Timestamp.now(tz='UTC').isoformat())
+        print(f"Saved {os.path.normpath(os.path.join(args.root, CLUSTER_MODEL_PATH))}; rebuild the cluster files with python -m helpers.rfm_pipeline")
+
+
+if __name__ == "__main__":
+    main()
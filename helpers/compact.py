@@ -0,0 +1,110 @@
+import re
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from helpers.data_store import available_clusters, load_transactions
+
+UUID_PATTERN = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+DATE_PATTERN = r'^\d{4}-\d{2}-\d{2}'
+CATEGORY_MAX_UNIQUE_SHARE = 0.5  # Strings repeat enough to be worth a dictionary below this share of distinct values
+
+# Value of each ASCII hex digit, for decoding UUID text without a Python-level loop
+_HEX_VALUES = np.zeros(256, dtype=np.uint8)
+_HEX_VALUES[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(10)
+_HEX_VALUES[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+_HEX_VALUES[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+_UUID_HEX_POSITIONS = np.array([i for i in range(36) if i not in (8, 13, 18, 23)])
+
+
+def is_uuid_column(values: pd.Series) -> bool:
+    sample = values.dropna().head(100)
+    return len(sample) > 0 and values.notna().all() and all(isinstance(value, str) and UUID_PATTERN.match(value) for value in sample)
+
+
+def uuid_to_binary(values: pd.Series) -> pd.Series:
+    """Canonical UUID strings as 16-byte binary values."""
+    text = np.frombuffer(values.to_numpy(dtype='S36').tobytes(), dtype=np.uint8).reshape(len(values), 36)
+    digits = _HEX_VALUES[text[:, _UUID_HEX_POSITIONS]]
+    raw = (digits[:, 0::2] << 4) | digits[:, 1::2]
+    array = pa.FixedSizeBinaryArray.from_buffers(pa.binary(16), len(values), [None, pa.py_buffer(raw.tobytes())])
+    return pd.Series(pd.arrays.ArrowExtensionArray(array), index=values.index, name=values.name)
+
+
+def binary_to_uuid(values: pd.Series) -> pd.Series:
+    """16-byte binary UUIDs back to their canonical lowercase strings."""
+    raw = np.frombuffer(pa.array(values.array).buffers()[1], dtype=np.uint8, count=16 * len(values)).reshape(len(values), 16)
+    hex_digits = np.frombuffer(raw.tobytes().hex().encode(), dtype=np.uint8).reshape(len(values), 32)
+    text = np.full((len(values), 36), ord('-'), dtype=np.uint8)
+    text[:, _UUID_HEX_POSITIONS] = hex_digits
+    return pd.Series(text.view('S36').ravel().astype(str), index=values.index, name=values.name, dtype=object)
+
+
+def compact_column(values: pd.Series) -> pd.Series:
+    """The smallest lossless representation of one column."""
+    if pd.api.types.is_float_dtype(values):
+        whole = values.notna().all() and bool((values % 1 == 0).all())
+        if not whole:
+            return values
+        # Whole-yen amounts (and whole-number RFM fields) become int32, or int64 when they do not fit;
+        # nothing narrower, so arithmetic on amounts cannot overflow
+        fits_int32 = len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max)
+        return values.astype(np.int32 if fits_int32 else np.int64)
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_numeric(values, downcast='integer')
+    if values.dtype == object:
+        if is_uuid_column(values):
+            return uuid_to_binary(values)
+        # Ids and names fail the date pattern on the first rows, so only date columns are matched in full
+        looks_like_dates = values.head(100).str.match(DATE_PATTERN).all() and values.str.match(DATE_PATTERN).all()
+        parsed = pd.to_datetime(values, errors='coerce', format='ISO8601') if looks_like_dates else None
+        if parsed is not None and parsed.notna().all():
+            return parsed
+        if values.nunique() <= CATEGORY_MAX_UNIQUE_SHARE * len(values):
+            return values.astype('category')
+    return values
+
+
+def compact_frame(df: pd.DataFrame, columns: list | None = None) -> pd.DataFrame:
+    """A copy of df with repeated strings as categoricals, UUIDs as 16-byte binary, date strings as
+    datetime64, whole-number floats as int32/int64 and integers downcast, restricted to columns if given.
+    """
+    compacted = df.copy(deep=False)
+    for column in columns or df.columns:
+        compacted[column] = compact_column(df[column])
+    return compacted
+
+
+def compaction_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """Bytes held by each column before and after compaction."""
+    bytes_before = before.memory_usage(deep=True, index=False)
+    bytes_after = after.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'dtype_after': after.dtypes.astype(str),
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+    })
+    report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+    report['ratio'] = report['bytes_before'] / report['bytes_after']
+    report.loc['total'] = ['', '', bytes_before.sum(), bytes_after.sum(), bytes_before.sum() - bytes_after.sum(), bytes_before.sum() / bytes_after.sum()]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report how many bytes compact encoding saves on each cluster's transactions.")
+    parser.add_argument('--clusters', type=int, nargs='+', help="Clusters to measure (default: all with transactions)")
+    args = parser.parse_args()
+
+    with pd.option_context('display.width', 160, 'display.max_columns', None):
+        for selected_cluster in args.clusters or available_clusters():
+            before = load_transactions(selected_cluster)
+            report = compaction_report(before, compact_frame(before))
+            report['ratio'] = report['ratio'].map('{:.1f}x'.format)
+            print(f"Cluster {selected_cluster}: {len(before):,} rows")
+            print(report.to_string())
+            print()
+
+
+if __name__ == "__main__":
+    main()
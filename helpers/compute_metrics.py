@@ -1,4 +1,5 @@
 import streamlit as st
+from helpers.data_store import CLUSTER_NAMES  # Defined without streamlit for the batch engines; kept here for the pages
 
 # Function to create a custom metric with border
 def custom_metric(label, value, delta= None):
@@ -33,11 +34,8 @@ def custom_metric(label, value, delta= None):
     </div>
     """
 
-    
-CLUSTER_NAMES = [
-    'Loyal High Spenders', 
-    'At-Risk Low Spenders', 
-    'Top VIPs', 
-    'New or Infrequent Shoppers', 
-    'Occasional Bargain Seekers'
-]
+
+
+# Strategies 1, 5 and 6 divide by the average cashback, which some merchants and windows never pay
+NO_CASHBACK_WARNING = ("The average cashback for this selection rounds to 0 ¥, so there is no cashback budget to plan with. "
+                       "Pick another merchant or date window.")
@@ -0,0 +1,439 @@
+import os
+import re
+import argparse
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+from helpers.cache import cached_by_files
+
+# Base paths for data files
+DATA_FILE_BASE_PATH = './Data/cluster_calculation/hashed/'
+PARQUET_BASE_PATH = './Data/cluster_calculation/parquet/'
+FEATHER_BASE_PATH = './Data/cluster_calculation/feather/'
+DATASET_BASE_PATH = './Data/cluster_calculation/dataset/'
+TRANSACTIONS_DATASET_PATH = f'{DATASET_BASE_PATH}transactions/'
+RFM_DATASET_PATH = f'{DATASET_BASE_PATH}rfm/'
+
+# Both datasets are split into one directory per cluster, Cluster=N/, which is how filters on Cluster are pruned
+CLUSTER_PARTITIONING = ds.partitioning(pa.schema([('Cluster', pa.int64())]), flavor='hive')
+
+# The only columns the strategy pages compute with
+TRANSACTION_COLUMNS = ['cardholder_id', 'transaction_date', 'transaction_amount', 'cashback_amount']
+
+# Explicit dtypes for the 18-column "Full Dataset of Cluster N" files so nothing has to be inferred
+TRANSACTION_DTYPES = {
+    'cardholder_id': str,
+    'program_provider_id': 'int64',
+    'card_id': str,
+    'external_user_id': str,
+    'merchant_id': str,
+    'name': str,
+    'category': str,
+    'transaction_id': 'int64',
+    'authorized_amount': 'float64',
+    'transaction_amount': 'float64',
+    'authorized_amount_in_usd': 'float64',
+    'cashback_amount': 'float64',
+    'Recency': 'float64',
+    'Frequency': 'float64',
+    'Monetary': 'float64',
+    'Cluster': 'float64',
+}
+DATE_COLUMNS = ['transaction_date', 'created_at']
+
+PARTITION_ROW_GROUP_ROWS = 128_000
+
+# Name of a part appended to a store by helpers.ingest: a sequence number, so names sort in ingestion order, and the batch id
+PART_NAME = re.compile(r'part-(\d{5})-')
+
+# Display name of each cluster, by cluster number
+CLUSTER_NAMES = [
+    'Loyal High Spenders',
+    'At-Risk Low Spenders',
+    'Top VIPs',
+    'New or Infrequent Shoppers',
+    'Occasional Bargain Seekers',
+]
+
+# Recency in the shipped RFM tables counts days back from here
+RFM_REFERENCE_DATE = pd.Timestamp('2024-08-07')
+
+
+def rfm_csv_path(selected_cluster: int) -> str:
+    """Path of the RFM table for the selected cluster."""
+    return f'{DATA_FILE_BASE_PATH}rfm_cluster_{selected_cluster}.csv'
+
+
+def full_dataset_csv_path(selected_cluster: int) -> str:
+    """Path of the raw CSV transactions for the selected cluster."""
+    return f'{DATA_FILE_BASE_PATH}Full Dataset of Cluster {selected_cluster}.csv'
+
+
+def full_dataset_parquet_path(selected_cluster: int) -> str:
+    """Path of the typed Parquet transactions for the selected cluster."""
+    return f'{PARQUET_BASE_PATH}Full Dataset of Cluster {selected_cluster}.parquet'
+
+
+def full_dataset_feather_path(selected_cluster: int) -> str:
+    """Path of the uncompressed Arrow IPC (Feather v2) transactions for the selected cluster."""
+    return f'{FEATHER_BASE_PATH}Full Dataset of Cluster {selected_cluster}.feather'
+
+
+def dataset_partition_path(dataset_path: str, selected_cluster: int) -> str:
+    """Path of the single Parquet file holding the selected cluster's partition of a dataset."""
+    return f'{dataset_path}Cluster={selected_cluster}/part-0.parquet'
+
+
+def parts_directory(path: str) -> str:
+    """Directory holding the parts ingested into a store since the file itself was written.
+
+    A dataset partition keeps them beside it, where dataset scans pick them up; any other file in <name>.parts/.
+    """
+    if path.startswith(DATASET_BASE_PATH):
+        return os.path.dirname(path)
+    return f'{os.path.splitext(path)[0]}.parts'
+
+
+def part_paths(path: str) -> list:
+    """The parts ingested into a store, oldest first."""
+    directory = parts_directory(path)
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if PART_NAME.match(name)]
+
+
+def store_files(path: str) -> list:
+    """A store file followed by its parts; together they hold the store's rows in order."""
+    return [path, *part_paths(path)]
+
+
+def store_mtime(path: str) -> float:
+    """When the store or any of its parts was last written."""
+    return max(os.path.getmtime(file) for file in store_files(path))
+
+
+def next_part_path(path: str, batch_id: str, extension: str | None = None) -> str:
+    """Where the part holding a batch goes, numbered after the store's existing parts (in the store's format by default)."""
+    numbers = [int(PART_NAME.match(os.path.basename(part)).group(1)) for part in part_paths(path)]
+    extension = extension or os.path.splitext(path)[1]
+    return os.path.join(parts_directory(path), f'part-{max(numbers, default=0) + 1:05d}-{batch_id}{extension}')
+
+
+def hidden_tmp_path(path: str) -> str:
+    """A temporary name beside path that dataset scans and part listings skip."""
+    return os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{os.getpid()}.tmp')
+
+
+def remove_parts(path: str):
+    """Delete a store's parts, before the store is rewritten with their rows."""
+    for part in part_paths(path):
+        os.remove(part)
+
+
+def write_part(frame: pd.DataFrame, path: str, part_path: str) -> str:
+    """Write rows as a part of the store at path, with the store's own schema so readers can concatenate them."""
+    if path.endswith('.feather'):
+        schema = pa.ipc.open_file(pa.memory_map(path, 'r')).schema
+    else:
+        schema = pq.read_schema(path)
+    table = pa.Table.from_pandas(frame.reindex(columns=schema.names), schema=schema, preserve_index=False)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    tmp_path = hidden_tmp_path(part_path)
+    if path.endswith('.feather'):
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+    else:
+        pq.write_table(table, tmp_path, compression='zstd', row_group_size=PARTITION_ROW_GROUP_ROWS)
+    os.replace(tmp_path, part_path)
+    return part_path
+
+
+def read_transactions_csv(path: str, columns: list | None = None) -> pd.DataFrame:
+    """Read a transactions CSV with explicit dtypes and parsed dates."""
+    usecols = columns
+    dtypes = {col: dtype for col, dtype in TRANSACTION_DTYPES.items() if columns is None or col in columns}
+    dates = [col for col in DATE_COLUMNS if columns is None or col in columns]
+    df = pd.read_csv(path, usecols=usecols, dtype=dtypes, parse_dates=dates)
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+def convert_full_dataset(selected_cluster: int, compression: str = 'zstd') -> str:
+    """Convert the cluster's CSV transactions into a compressed Parquet file."""
+    df = read_transactions_csv(full_dataset_csv_path(selected_cluster))
+    path = full_dataset_parquet_path(selected_cluster)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = hidden_tmp_path(path)
+    df.to_parquet(tmp_path, engine='pyarrow', compression=compression, index=False)
+    # The parts' rows are in the CSV too; until the rename the store is older than the CSV, so nothing reads it
+    remove_parts(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def convert_full_dataset_feather(selected_cluster: int) -> str:
+    """Convert the cluster's transactions into an uncompressed Feather v2 file that can be memory-mapped."""
+    df = read_transactions_csv(full_dataset_csv_path(selected_cluster))
+    path = full_dataset_feather_path(selected_cluster)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Compressed buffers would have to be decoded into private memory, so keep them raw.
+    # Write then rename so sessions that have the old file mapped keep a consistent view.
+    tmp_path = hidden_tmp_path(path)
+    feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), tmp_path, compression='uncompressed')
+    remove_parts(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_partition(table: pa.Table, dataset_path: str, selected_cluster: int, compression: str = 'zstd') -> str:
+    """Replace one cluster's partition of a dataset; Cluster itself lives in the directory name."""
+    path = dataset_partition_path(dataset_path, selected_cluster)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = hidden_tmp_path(path)
+    if 'Cluster' in table.column_names:
+        table = table.drop_columns(['Cluster'])
+    # Row groups carry min/max statistics, so date filters can skip most of a partition too
+    pq.write_table(table, tmp_path, compression=compression, row_group_size=PARTITION_ROW_GROUP_ROWS)
+    remove_parts(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def convert_cluster_dataset(selected_cluster: int, compression: str = 'zstd') -> list:
+    """Write the cluster's transactions and RFM table, whichever exist, into the cluster-partitioned datasets."""
+    paths = []
+    if os.path.exists(full_dataset_csv_path(selected_cluster)):
+        transactions = pa.Table.from_pandas(read_transactions_csv(full_dataset_csv_path(selected_cluster)), preserve_index=False)
+        paths.append(write_partition(transactions, TRANSACTIONS_DATASET_PATH, selected_cluster, compression))
+    if os.path.exists(rfm_csv_path(selected_cluster)):
+        rfm = pa.Table.from_pandas(pd.read_csv(rfm_csv_path(selected_cluster)), preserve_index=False)
+        paths.append(write_partition(rfm, RFM_DATASET_PATH, selected_cluster, compression))
+    return paths
+
+
+def is_fresh(path: str, selected_cluster: int, source_path: str | None = None) -> bool:
+    """Whether a converted copy exists and, counting its parts, is not older than its source (the cluster's CSV by default)."""
+    if not os.path.exists(path):
+        return False
+    csv_path = source_path or full_dataset_csv_path(selected_cluster)
+    if not os.path.exists(csv_path):
+        return True
+    return store_mtime(path) >= os.path.getmtime(csv_path)
+
+
+def has_fresh_parquet(selected_cluster: int) -> bool:
+    """Whether the Parquet store exists and is not older than its source CSV."""
+    return is_fresh(full_dataset_parquet_path(selected_cluster), selected_cluster)
+
+
+def has_fresh_feather(selected_cluster: int) -> bool:
+    """Whether the Feather store exists and is not older than its source CSV."""
+    return is_fresh(full_dataset_feather_path(selected_cluster), selected_cluster)
+
+
+def has_fresh_dataset(selected_cluster: int) -> bool:
+    """Whether the cluster's partition of the transactions dataset exists and is not older than its source CSV."""
+    return is_fresh(dataset_partition_path(TRANSACTIONS_DATASET_PATH, selected_cluster), selected_cluster)
+
+
+def transactions_source_path(selected_cluster: int) -> str:
+    """Path of the file load_transactions reads: Feather, then the partitioned dataset, then Parquet, then the CSV."""
+    if has_fresh_feather(selected_cluster):
+        return full_dataset_feather_path(selected_cluster)
+    if has_fresh_dataset(selected_cluster):
+        return dataset_partition_path(TRANSACTIONS_DATASET_PATH, selected_cluster)
+    if has_fresh_parquet(selected_cluster):
+        return full_dataset_parquet_path(selected_cluster)
+    return full_dataset_csv_path(selected_cluster)
+
+
+def transactions_source_files(selected_cluster: int) -> list:
+    """transactions_source_path and the parts ingested into it, which readers key their caches on."""
+    return store_files(transactions_source_path(selected_cluster))
+
+
+def open_feather_table(path: str) -> pa.Table:
+    """Memory-map a Feather v2 file; column buffers stay in the OS page cache, shared by every process."""
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def rfm_source_path(selected_cluster: int) -> str:
+    """Path of the file load_rfm reads: the cluster's RFM partition when up to date, else the CSV."""
+    partition_path = dataset_partition_path(RFM_DATASET_PATH, selected_cluster)
+    if is_fresh(partition_path, selected_cluster, rfm_csv_path(selected_cluster)):
+        return partition_path
+    return rfm_csv_path(selected_cluster)
+
+
+def rfm_source_files(selected_cluster: int) -> list:
+    """rfm_source_path and the parts ingested into the cluster's RFM table since it was written."""
+    return [rfm_source_path(selected_cluster), *part_paths(rfm_csv_path(selected_cluster))]
+
+
+def apply_rfm_parts(rfm: pd.DataFrame, parts: list) -> pd.DataFrame:
+    """An RFM table with the batches helpers.ingest appended to it since it was written folded in.
+
+    Each part holds the batch counts and sums of its cardholders and their last purchase, with the
+    reference days before and after the batch in its metadata. Recency shifts for everyone by how
+    far the reference day moved; the parts' cardholders count back from their last purchase.
+    """
+    if not parts:
+        return rfm
+    first, last = pq.read_schema(parts[0]).metadata, pq.read_schema(parts[-1]).metadata
+    reference = pd.Timestamp(last[b'reference_date'].decode())
+    batches = pd.concat([pd.read_parquet(part, engine='pyarrow') for part in parts], ignore_index=True)
+    batches = batches.groupby('cardholder_id', sort=False).agg(
+        Frequency=('Frequency', 'sum'), Monetary=('Monetary', 'sum'), Last_Transaction_Date=('Last_Transaction_Date', 'max'))
+
+    rfm = rfm.set_index('cardholder_id')
+    rfm['Recency'] += (reference - pd.Timestamp(first[b'previous_reference'].decode())).days
+    new_ids = batches.index[~batches.index.isin(rfm.index)]
+    rfm = pd.concat([rfm, pd.DataFrame({'Recency': 0, 'Frequency': 0, 'Monetary': 0.0}, index=new_ids)])
+    rfm.loc[batches.index, 'Frequency'] += batches['Frequency']
+    rfm.loc[batches.index, 'Monetary'] += batches['Monetary']
+    rfm.loc[batches.index, 'Recency'] = (reference - batches['Last_Transaction_Date'].dt.normalize()).dt.days
+    return rfm.rename_axis('cardholder_id').reset_index()
+
+
+def read_rfm_table(path: str) -> pd.DataFrame:
+    """Read an RFM CSV together with the parts ingested into it."""
+    return apply_rfm_parts(pd.read_csv(path), part_paths(path))
+
+
+def cluster_filter(clusters: list | None, extra: ds.Expression | None = None) -> ds.Expression | None:
+    """A dataset filter on Cluster (pruned to whole directories) combined with any extra predicate."""
+    expression = None if clusters is None else ds.field('Cluster').isin(list(clusters))
+    if extra is not None:
+        expression = extra if expression is None else expression & extra
+    return expression
+
+
+def scan_transactions(clusters: list | None = None, columns: list | None = None, filter: ds.Expression | None = None) -> pa.Table:
+    """Query the transactions dataset, reading only the requested clusters' partitions and columns.
+
+    filter is any further pyarrow.dataset predicate, such as a date range, which Parquet row-group
+    statistics are checked against before anything is decoded.
+    """
+    dataset = ds.dataset(TRANSACTIONS_DATASET_PATH, format='parquet', partitioning=CLUSTER_PARTITIONING)
+    return dataset.to_table(columns=columns, filter=cluster_filter(clusters, filter))
+
+
+def scan_rfm(clusters: list | None = None, columns: list | None = None) -> pa.Table:
+    """Query the RFM dataset, reading only the requested clusters' partitions and columns."""
+    dataset = ds.dataset(RFM_DATASET_PATH, format='parquet', partitioning=CLUSTER_PARTITIONING)
+    return dataset.to_table(columns=columns, filter=cluster_filter(clusters))
+
+
+def available_clusters() -> list:
+    """Clusters that have transactions in either the Parquet store or the CSVs."""
+    return [selected_cluster for selected_cluster in range(5) if os.path.exists(transactions_source_path(selected_cluster))]
+
+
+@cached_by_files(lambda selected_cluster, columns=None, compact=False: transactions_source_files(selected_cluster))
+def load_transactions(selected_cluster: int, columns: list | None = None, compact: bool = False) -> pd.DataFrame:
+    """Load the selected cluster's transactions, reading only the requested columns.
+
+    Reads from the Feather or Parquet store when one is up to date and falls back to the CSV otherwise.
+    From Feather, numeric and date columns are zero-copy views of the memory-mapped file.
+    With compact, columns are re-encoded to their smallest lossless types (see helpers.compact),
+    which trades the zero-copy views for a several times smaller private copy.
+    The result is shared through DATA_CACHE, so callers must not modify it in place.
+    """
+    df = read_transactions(selected_cluster, columns)
+    if compact:
+        from helpers.compact import compact_frame  # compact's report CLI builds on this module
+        return compact_frame(df)
+    return df
+
+
+def read_transactions(selected_cluster: int, columns: list | None = None) -> pd.DataFrame:
+    """Read the selected cluster's transactions from its current source and any parts ingested into it, uncached."""
+    path = transactions_source_path(selected_cluster)
+    parts = part_paths(path)
+    if path.endswith('.feather'):
+        table = pa.concat_tables([open_feather_table(file) for file in [path, *parts]])
+        return (table if columns is None else table.select(columns)).to_pandas(split_blocks=True)
+    if path.startswith(TRANSACTIONS_DATASET_PATH):
+        df = scan_transactions([selected_cluster], columns).to_pandas()
+        if 'Cluster' in df.columns:
+            df['Cluster'] = df['Cluster'].astype('float64')  # As in the CSVs
+        return df
+    if path.endswith('.parquet'):
+        if parts:
+            return pa.concat_tables([pq.read_table(file, columns=columns) for file in [path, *parts]]).to_pandas()
+        return pd.read_parquet(path, engine='pyarrow', columns=columns)
+    return read_transactions_csv(path, columns)
+
+
+def iter_transactions(selected_cluster: int, columns: list | None = None, chunk_rows: int = 1_000_000):
+    """Yield the selected cluster's transactions in file order, chunk_rows rows at a time."""
+    path = transactions_source_path(selected_cluster)
+    if path.endswith('.feather'):
+        for file in store_files(path):
+            table = open_feather_table(file)
+            for batch in (table if columns is None else table.select(columns)).to_batches(max_chunksize=chunk_rows):
+                yield batch.to_pandas(split_blocks=True)
+        return
+    if path.startswith(TRANSACTIONS_DATASET_PATH):
+        dataset = ds.dataset(TRANSACTIONS_DATASET_PATH, format='parquet', partitioning=CLUSTER_PARTITIONING)
+        for batch in dataset.to_batches(columns=columns, filter=cluster_filter([selected_cluster]), batch_size=chunk_rows):
+            chunk = batch.to_pandas()
+            if 'Cluster' in chunk.columns:
+                chunk['Cluster'] = chunk['Cluster'].astype('float64')
+            yield chunk
+        return
+    if path.endswith('.parquet'):
+        for file in store_files(path):
+            for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_rows, columns=columns):
+                yield batch.to_pandas()
+        return
+    dtypes = {col: dtype for col, dtype in TRANSACTION_DTYPES.items() if columns is None or col in columns}
+    dates = [col for col in DATE_COLUMNS if columns is None or col in columns]
+    with pd.read_csv(path, usecols=columns, dtype=dtypes, parse_dates=dates, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            yield chunk if columns is None else chunk[columns]
+
+
+@cached_by_files(lambda selected_cluster, merchant_id=None, window_days=None:
+                 rfm_source_files(selected_cluster) if merchant_id is None and window_days is None else transactions_source_files(selected_cluster))
+def load_rfm(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> pd.DataFrame:
+    """Load the RFM table for the selected cluster, from its dataset partition when that is up to date.
+
+    With a merchant_id and/or window_days, the table is computed from the cluster's purchases at
+    that merchant and/or in its last window_days days instead.
+    """
+    if merchant_id is not None or window_days is not None:
+        from helpers.windows import load_slice_rfm  # windows builds on this module
+        return load_slice_rfm(selected_cluster, merchant_id, window_days)
+    path = rfm_source_path(selected_cluster)
+    if path.startswith(RFM_DATASET_PATH):
+        rfm = scan_rfm([selected_cluster], ['cardholder_id', 'Recency', 'Frequency', 'Monetary']).to_pandas()
+        return apply_rfm_parts(rfm, part_paths(rfm_csv_path(selected_cluster)))
+    return read_rfm_table(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the 'Full Dataset of Cluster N' CSVs into Parquet, memory-mappable Feather, or the cluster-partitioned dataset.")
+    parser.add_argument('--clusters', type=int, nargs='+', default=list(range(5)))
+    parser.add_argument('--format', choices=['parquet', 'feather', 'dataset'], default='parquet')
+    parser.add_argument('--compression', default='zstd', help="Parquet compression (Feather is always written uncompressed)")
+    args = parser.parse_args()
+
+    for selected_cluster in args.clusters:
+        if args.format == 'dataset':
+            print(f"Cluster {selected_cluster}: wrote {', '.join(convert_cluster_dataset(selected_cluster, args.compression)) or 'nothing'}")
+            continue
+        if not os.path.exists(full_dataset_csv_path(selected_cluster)):
+            print(f"Cluster {selected_cluster}: no CSV found, skipping")
+            continue
+        if args.format == 'feather':
+            path = convert_full_dataset_feather(selected_cluster)
+        else:
+            path = convert_full_dataset(selected_cluster, args.compression)
+        print(f"Cluster {selected_cluster}: wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
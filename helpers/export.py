@@ -0,0 +1,121 @@
+import io
+import gzip
+import argparse
+from collections import namedtuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from helpers.cache import cached_by_files
+from helpers.data_store import load_rfm, rfm_source_files, transactions_source_files
+from helpers.ranking import load_ranked_customers, top_customers
+
+ExportFormat = namedtuple('ExportFormat', ['label', 'extension', 'mime'])
+
+EXPORT_FORMATS = {
+    'csv': ExportFormat('CSV', '.csv', 'text/csv'),
+    'csv.gz': ExportFormat('gzip CSV', '.csv.gz', 'application/gzip'),
+    'parquet': ExportFormat('Parquet', '.parquet', 'application/vnd.apache.parquet'),
+}
+EXPORT_CHUNK_ROWS = 100_000
+
+# Where the exported rows come from: the RFM table in file order, or the customers ranked by Monetary
+EXPORT_SOURCES = ('rfm', 'ranked')
+
+
+def export_frame(selected_cluster: int, num_customers: int, source: str = 'ranked', merchant_id: str | None = None,
+                 window_days: int | None = None) -> pd.DataFrame:
+    """The first num_customers customers of the selected cluster (or one of its merchants or date windows), as shown in the previews."""
+    if source == 'rfm':
+        return load_rfm(selected_cluster, merchant_id, window_days).head(max(int(num_customers), 0)).reset_index(drop=True)
+    return top_customers(load_ranked_customers(selected_cluster, merchant_id, window_days), num_customers)
+
+
+def write_export(frame: pd.DataFrame, export_format: str, f, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Serialize frame to the binary file f chunk_rows rows at a time, so no full text copy is ever held.
+
+    CSVs keep the index column the previews show; Parquet gets one row group per chunk.
+    """
+    if export_format == 'parquet':
+        schema = pa.Schema.from_pandas(frame, preserve_index=False)
+        with pq.ParquetWriter(f, schema, compression='zstd') as writer:
+            for start in range(0, max(len(frame), 1), chunk_rows):
+                writer.write_table(pa.Table.from_pandas(frame.iloc[start:start + chunk_rows], schema=schema, preserve_index=False))
+        return
+    # mtime=0 keeps the gzip bytes identical for identical data
+    out = gzip.GzipFile(fileobj=f, mode='wb', mtime=0) if export_format == 'csv.gz' else f
+    try:
+        for start in range(0, max(len(frame), 1), chunk_rows):
+            out.write(frame.iloc[start:start + chunk_rows].to_csv(index=True, header=start == 0).encode('utf-8'))
+    finally:
+        if out is not f:
+            out.close()
+
+
+def export_source_paths(selected_cluster: int, num_customers: int, export_format: str = 'csv', source: str = 'ranked',
+                        merchant_id: str | None = None, window_days: int | None = None) -> list:
+    if source == 'rfm':
+        sliced = merchant_id is not None or window_days is not None
+        return transactions_source_files(selected_cluster) if sliced else rfm_source_files(selected_cluster)
+    return [*rfm_source_files(selected_cluster), *transactions_source_files(selected_cluster)]
+
+
+@cached_by_files(export_source_paths)
+def export_customers(selected_cluster: int, num_customers: int, export_format: str = 'csv', source: str = 'ranked',
+                     merchant_id: str | None = None, window_days: int | None = None) -> bytes:
+    """The top customers serialized in export_format, built once per (cluster, N, format) and data version."""
+    buffer = io.BytesIO()
+    write_export(export_frame(selected_cluster, num_customers, source, merchant_id, window_days), export_format, buffer)
+    return buffer.getvalue()
+
+
+def download_customers(label: str, selected_cluster: int, num_customers: int, file_stem: str, key: str, source: str = 'ranked',
+                       merchant_id: str | None = None, window_days: int | None = None):
+    """A format picker and a download button whose file is only serialized once the user asks for it.
+
+    Reruns that keep the cluster, N and format reuse the cached bytes; changing any of them
+    swaps the download back to a "Prepare" button instead of re-serializing on every slider move.
+    """
+    import streamlit as st  # Only the pages need it; the CLI below does not
+
+    export_format = st.selectbox("Export format", list(EXPORT_FORMATS), format_func=lambda name: EXPORT_FORMATS[name].label, key=f"{key}_format")
+    details = EXPORT_FORMATS[export_format]
+    request = (selected_cluster, int(num_customers), export_format, source, merchant_id, window_days)
+    prepared_key = f"{key}_prepared"
+    if st.session_state.get(prepared_key) != request:
+        # Recorded in the click callback, so the rerun it triggers already shows the download
+        st.button(f"Prepare {label} as {details.label}", key=f"{key}_prepare",
+                  on_click=st.session_state.__setitem__, args=(prepared_key, request))
+        return
+    if merchant_id is not None:
+        file_stem = f'{file_stem}_merchant_{merchant_id}'
+    if window_days is not None:
+        file_stem = f'{file_stem}_last_{window_days}_days'
+    st.download_button(
+        label=f"{label} as {details.label}",
+        data=export_customers(*request),
+        file_name=f'{file_stem}{details.extension}',
+        mime=details.mime,
+        key=key
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a cluster's top customers to a file.")
+    parser.add_argument('output', help="File to write")
+    parser.add_argument('--cluster', type=int, required=True)
+    parser.add_argument('--customers', type=int, required=True, help="Number of top customers")
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--source', choices=EXPORT_SOURCES, default='ranked')
+    parser.add_argument('--merchant', help="Only this merchant's customers (see python -m helpers.merchants)")
+    parser.add_argument('--window-days', type=int, help="Only the cluster's last N days of transactions")
+    parser.add_argument('--chunk-rows', type=int, default=EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    frame = export_frame(args.cluster, args.customers, args.source, args.merchant, args.window_days)
+    with open(args.output, 'wb') as f:
+        write_export(frame, args.format, f, args.chunk_rows)
+    print(f"Wrote {len(frame):,} customers of cluster {args.cluster} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import numpy as np
+
+# Strategy formulas shared by the pages and the batch engines. They only use NumPy
+# elementwise operations, so they accept plain numbers as well as broadcastable arrays.
+# Divisions by zero yield inf/nan instead of raising, so infeasible grid cells do not abort a batch.
+
+
+def increased_revenue_target(current_sales, percentage_increase):
+    """Current sales increased by the percentage, floored to whole yen."""
+    return np.floor(current_sales * (1 + percentage_increase / 100))
+
+
+def average_order_targeting(revenue_target, avg_order, avg_cashback):
+    """Strategy 2: customers, cashback budget, achieved target and profit from floored cluster averages."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_order_rounded = np.floor(avg_order)
+        avg_cashback_rounded = np.floor(avg_cashback)
+        no_of_customers_to_target = np.ceil(revenue_target / (avg_order_rounded - avg_cashback_rounded))
+        cashback_budget = no_of_customers_to_target * avg_cashback_rounded
+        target_achieve = no_of_customers_to_target * avg_order_rounded
+        profit = target_achieve - cashback_budget
+    return no_of_customers_to_target, cashback_budget, target_achieve, profit
+
+
+def transaction_duration_targeting(revenue_target, avg_order, avg_cashback, avg_transaction_duration):
+    """Strategy 3: customers and days needed at the cluster's average purchase interval."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        no_of_customers_to_target = np.ceil(revenue_target / (avg_order - avg_cashback))
+        daily_revenue_per_customer = np.floor((avg_order - avg_cashback) / avg_transaction_duration)
+        total_daily_revenue = np.floor(no_of_customers_to_target * daily_revenue_per_customer)
+        days_to_achieve_target = np.ceil(revenue_target / total_daily_revenue)
+    return no_of_customers_to_target, daily_revenue_per_customer, total_daily_revenue, days_to_achieve_target
+
+
+def deadline_targeting(revenue_target, avg_order, avg_cashback, avg_transaction_duration, required_days, cardholder_count):
+    """Strategy 4: customers needed to reach the target within required_days."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_revenue_per_customer = np.floor((avg_order - avg_cashback) / avg_transaction_duration)
+        max_possible_revenue_within_days = np.floor(daily_revenue_per_customer * required_days * cardholder_count)
+        no_of_customers_to_target = np.ceil(revenue_target / (daily_revenue_per_customer * required_days))
+        total_daily_revenue = np.floor(no_of_customers_to_target * daily_revenue_per_customer)
+        days_to_achieve_target = np.ceil(revenue_target / total_daily_revenue)
+    return daily_revenue_per_customer, max_possible_revenue_within_days, no_of_customers_to_target, total_daily_revenue, days_to_achieve_target
+
+
+def whole_numbers(*values):
+    """Turn scalar formula results into ints for display; non-finite results stay floats."""
+    return tuple(int(value) if np.isfinite(value) else float(value) for value in values)
+
+
+def cashback_budget_targeting(revenue_target, avg_order, avg_cashback, num_users):
+    """Strategies 1, 5 and 6: customers and cashback budget from the cluster's average order and cashback.
+
+    Also returns the cluster's minimum cashback budget and maximum possible revenue for the feasibility checks.
+    """
+    potential_cashback_budget = avg_cashback * num_users
+    max_possible_revenue = avg_order * num_users
+    with np.errstate(divide='ignore', invalid='ignore'):
+        num_customers_to_target = np.minimum(revenue_target / avg_order, num_users)
+    cashback_budget_needed = num_customers_to_target * avg_cashback
+    return cashback_budget_needed, num_customers_to_target, potential_cashback_budget, max_possible_revenue
@@ -0,0 +1,360 @@
+import os
+import json
+import argparse
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from helpers.cache import file_content_hash
+from helpers.data_store import (
+    RFM_REFERENCE_DATE,
+    RFM_DATASET_PATH,
+    TRANSACTION_COLUMNS,
+    TRANSACTIONS_DATASET_PATH,
+    available_clusters,
+    full_dataset_csv_path,
+    full_dataset_parquet_path,
+    full_dataset_feather_path,
+    dataset_partition_path,
+    rfm_csv_path,
+    read_transactions_csv,
+    read_rfm_table,
+    transactions_source_path,
+    iter_transactions,
+    is_fresh,
+    store_files,
+    store_mtime,
+    part_paths,
+    next_part_path,
+    hidden_tmp_path,
+    remove_parts,
+    write_part,
+    convert_full_dataset,
+    convert_full_dataset_feather,
+    write_partition,
+)
+from helpers.aggregates import AGGREGATES_BASE_PATH
+from helpers.streaming import CardholderAccumulators, stream_statistics
+
+INGEST_LOG_PATH = './Data/cluster_calculation/ingest_log.jsonl'
+
+
+def cardholder_state_path(selected_cluster: int) -> str:
+    """Path of the per-cardholder accumulator state that incremental ingestion resumes from."""
+    return f'{AGGREGATES_BASE_PATH}cardholder_state_cluster_{selected_cluster}.parquet'
+
+
+def read_ingest_log() -> list:
+    """Every entry of the batch log, oldest first."""
+    if not os.path.exists(INGEST_LOG_PATH):
+        return []
+    with open(INGEST_LOG_PATH) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_ingest_log(entry: dict):
+    os.makedirs(os.path.dirname(INGEST_LOG_PATH), exist_ok=True)
+    with open(INGEST_LOG_PATH, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def reference_date(selected_cluster: int, log: list) -> pd.Timestamp:
+    """The day Recency currently counts back from for the cluster."""
+    for entry in reversed(log):
+        if entry['status'] == 'applied' and str(selected_cluster) in entry['reference_dates']:
+            return pd.Timestamp(entry['reference_dates'][str(selected_cluster)])
+    return RFM_REFERENCE_DATE
+
+
+def write_atomically(frame: pd.DataFrame, path: str, fold_parts: bool = False):
+    """Write a Parquet or CSV file through a temporary file so readers never see half of it.
+
+    With fold_parts, the frame already holds the rows of the file's parts, which are deleted just before the rename.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = hidden_tmp_path(path)
+    if path.endswith('.parquet'):
+        frame.to_parquet(tmp_path, engine='pyarrow', index=False)
+    else:
+        frame.to_csv(tmp_path, index=False)
+    if fold_parts:
+        remove_parts(path)
+    os.replace(tmp_path, path)
+
+
+def has_fresh_state(selected_cluster: int) -> bool:
+    """Whether the saved state, counting its parts, is at least as new as the cluster's transactions and their parts."""
+    path, source_path = cardholder_state_path(selected_cluster), transactions_source_path(selected_cluster)
+    return os.path.exists(path) and os.path.exists(source_path) and store_mtime(path) >= store_mtime(source_path)
+
+
+def read_state(selected_cluster: int, cardholder_ids=None) -> pd.DataFrame:
+    """The saved state of the given cardholders (default: all), sorted by cardholder_id.
+
+    Each part holds the whole rows of the cardholders one batch touched, which replace older ones.
+    """
+    filters = None if cardholder_ids is None else [('cardholder_id', 'in', list(cardholder_ids))]
+    frames = [pd.read_parquet(path, engine='pyarrow', filters=filters) for path in store_files(cardholder_state_path(selected_cluster))]
+    if len(frames) == 1:
+        return frames[0]
+    state = pd.concat(frames, ignore_index=True).drop_duplicates('cardholder_id', keep='last')
+    return state.sort_values('cardholder_id', kind='stable', ignore_index=True)
+
+
+def load_fresh_state(selected_cluster: int) -> pd.DataFrame | None:
+    """The saved accumulator state, or None when it is missing or older than the cluster's transactions."""
+    return read_state(selected_cluster) if has_fresh_state(selected_cluster) else None
+
+
+def load_state(selected_cluster: int) -> CardholderAccumulators:
+    """Accumulators for the cluster's history so far, rebuilt from the transactions once if no fresh state exists."""
+    state = load_fresh_state(selected_cluster)
+    if state is None:
+        if not os.path.exists(transactions_source_path(selected_cluster)):
+            return CardholderAccumulators()
+        state = stream_statistics(selected_cluster).aggregates
+    return CardholderAccumulators.from_aggregates(state)
+
+
+def fresh_stores(selected_cluster: int) -> list:
+    """The converted copies of the cluster's CSV that readers currently use instead of it."""
+    paths = [full_dataset_feather_path(selected_cluster), dataset_partition_path(TRANSACTIONS_DATASET_PATH, selected_cluster),
+             full_dataset_parquet_path(selected_cluster)]
+    return [path for path in paths if is_fresh(path, selected_cluster)]
+
+
+def newest_write(path: str) -> int:
+    """When a store or any of its parts was last written, in nanoseconds, as logged before a batch."""
+    return max(os.stat(file).st_mtime_ns for file in store_files(path))
+
+
+def plan_parts(selected_cluster: int, batch_id: str) -> dict:
+    """Where apply_batch puts the batch: a part per store in use, for the state when it is up to date, and for the RFM table."""
+    state_path = cardholder_state_path(selected_cluster)
+    return {
+        'stores': {path: next_part_path(path, batch_id) for path in fresh_stores(selected_cluster)},
+        'state': next_part_path(state_path, batch_id) if has_fresh_state(selected_cluster) else None,
+        'rfm': next_part_path(rfm_csv_path(selected_cluster), batch_id, '.parquet'),
+    }
+
+
+def append_to_history(selected_cluster: int, batch: pd.DataFrame):
+    """Append the batch to the cluster's transactions CSV in the file's own column order."""
+    path = full_dataset_csv_path(selected_cluster)
+    if not os.path.exists(path):
+        batch.to_csv(path, index=False)
+        return
+    columns = pd.read_csv(path, nrows=0).columns
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    batch.reindex(columns=columns).to_csv(path, mode='a', header=False, index=False)
+
+
+def write_rfm_part(batch: pd.DataFrame, state: pd.DataFrame, part_path: str, old_reference: pd.Timestamp, new_reference: pd.Timestamp):
+    """Write the batch's purchase counts and sums per cardholder, with their last purchase, for apply_rfm_parts to fold in."""
+    partial = batch.groupby('cardholder_id').agg(Frequency=('transaction_amount', 'count'), Monetary=('transaction_amount', 'sum'))
+    partial['Last_Transaction_Date'] = state.set_index('cardholder_id')['Last_Transaction_Date'].reindex(partial.index)
+    table = pa.Table.from_pandas(partial.reset_index(), preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b'previous_reference': old_reference.isoformat(),
+                                           b'reference_date': new_reference.isoformat()})
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    tmp_path = hidden_tmp_path(part_path)
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, part_path)
+
+
+def apply_batch(selected_cluster: int, batch: pd.DataFrame, parts: dict, old_reference: pd.Timestamp, new_reference: pd.Timestamp):
+    """Append one cluster's share of a batch, writing only the batch and its cardholders' rows.
+
+    The CSV grows by the batch and each store in use gets it as a part; the state and RFM table get
+    a part for the batch's cardholders. The history is read again only when a row is older than its
+    cardholder's last purchase, and then only that cardholder's dates are kept to recompute the gaps.
+    Without a fresh state, the history is streamed once and the state saved whole.
+    """
+    cardholder_ids = pd.unique(batch['cardholder_id'])
+    if parts['state'] is not None:
+        accumulators = CardholderAccumulators.from_aggregates(read_state(selected_cluster, cardholder_ids))
+    else:
+        accumulators = load_state(selected_cluster)
+    rfm_path = rfm_csv_path(selected_cluster)
+    if not os.path.exists(rfm_path):
+        write_atomically(pd.DataFrame(columns=['cardholder_id', 'Recency', 'Frequency', 'Monetary']), rfm_path)
+
+    append_to_history(selected_cluster, batch)
+    # Before the state is written, so it stays at least as new as the store it is checked against
+    for path, part_path in parts['stores'].items():
+        write_part(batch, path, part_path)
+    accumulators.update(batch[TRANSACTION_COLUMNS])
+    accumulators.resolve_unordered(iter_transactions(selected_cluster, ['cardholder_id', 'transaction_date']))
+    state = accumulators.result().aggregates
+
+    state_path = cardholder_state_path(selected_cluster)
+    if parts['state'] is not None:
+        write_part(state, state_path, parts['state'])
+    else:
+        write_atomically(state, state_path, fold_parts=True)
+    write_rfm_part(batch, state, parts['rfm'], old_reference, new_reference)
+
+
+def read_batch(path: str) -> pd.DataFrame:
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, engine='pyarrow')
+    return read_transactions_csv(path)
+
+
+def roll_back(started: dict):
+    """Undo a batch whose ingestion was interrupted, using what was logged before it began.
+
+    The CSVs are truncated and the batch's parts deleted. Stores and state that were up to date
+    before the batch, and that nothing else has rewritten since, are touched so they stay newer than
+    the truncated CSV; anything rewritten whole is left older than it and gets rebuilt.
+    """
+    for selected_cluster, size in started['csv_sizes'].items():
+        path = full_dataset_csv_path(int(selected_cluster))
+        if size is None:
+            if os.path.exists(path):
+                os.remove(path)
+        elif os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+    for part_path in started.get('parts', []):
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    for path in started.get('created', []):
+        if os.path.exists(path) and not part_paths(path):
+            os.remove(path)
+    # The stores first, then the state, which has to be at least as new as them
+    for path, written in started.get('fresh', {}).items():
+        if os.path.exists(path) and newest_write(path) == written:
+            os.utime(path)
+
+
+def roll_back_interrupted(log: list) -> list:
+    """Roll back the last batch if its ingestion never finished, so later batches never build on half of one."""
+    if not log or log[-1]['status'] != 'started':
+        return log
+    roll_back(log[-1])
+    entry = {'batch_id': log[-1]['batch_id'], 'status': 'rolled_back', 'source': log[-1]['source']}
+    append_ingest_log(entry)
+    return [*log, entry]
+
+
+def ingest_batch(path: str, default_cluster: int | None = None) -> dict:
+    """Ingest a batch of transactions once; ingesting the same file again is a no-op.
+
+    Rows go to the cluster in their Cluster column (or default_cluster). Every table of a touched
+    cluster grows by a part holding the batch or its cardholders' rows, so the cost is the batch's,
+    except for cardholders with rows older than their last purchase (see apply_batch).
+    python -m helpers.ingest --compact folds the parts back into their tables.
+    """
+    batch_id = file_content_hash(path)
+    log = roll_back_interrupted(read_ingest_log())
+    if any(entry['batch_id'] == batch_id and entry['status'] == 'applied' for entry in log):
+        return {'batch_id': batch_id, 'status': 'skipped'}
+
+    batch = read_batch(path)
+    if 'Cluster' not in batch.columns:
+        batch['Cluster'] = float('nan')
+    if default_cluster is not None:
+        batch['Cluster'] = batch['Cluster'].fillna(default_cluster)
+    if batch['Cluster'].isna().any():
+        raise ValueError(f"{path}: rows without a Cluster; pass a default cluster (--cluster)")
+    clusters = sorted(int(cluster) for cluster in batch['Cluster'].unique())
+
+    csv_sizes, parts, fresh, created = {}, {}, {}, []
+    for selected_cluster in clusters:
+        csv_path = full_dataset_csv_path(selected_cluster)
+        csv_sizes[str(selected_cluster)] = os.path.getsize(csv_path) if os.path.exists(csv_path) else None
+        parts[str(selected_cluster)] = plan_parts(selected_cluster, batch_id)
+        fresh.update({store: newest_write(store) for store in parts[str(selected_cluster)]['stores']})
+        if not os.path.exists(rfm_csv_path(selected_cluster)):
+            created.append(rfm_csv_path(selected_cluster))
+    for selected_cluster in clusters:
+        if parts[str(selected_cluster)]['state'] is not None:
+            fresh[cardholder_state_path(selected_cluster)] = newest_write(cardholder_state_path(selected_cluster))
+    planned = [part_path for plan in parts.values() for part_path in [*plan['stores'].values(), plan['state'], plan['rfm']] if part_path]
+    append_ingest_log({'batch_id': batch_id, 'status': 'started', 'source': path, 'csv_sizes': csv_sizes,
+                       'parts': planned, 'fresh': fresh, 'created': created})
+
+    reference_dates = {}
+    for selected_cluster in clusters:
+        rows = batch[batch['Cluster'] == selected_cluster]
+        old_reference = reference_date(selected_cluster, log)
+        new_reference = max(old_reference, rows['transaction_date'].max().normalize() + pd.Timedelta(days=1))
+        apply_batch(selected_cluster, rows, parts[str(selected_cluster)], old_reference, new_reference)
+        reference_dates[str(selected_cluster)] = new_reference.isoformat()
+
+    entry = {
+        'batch_id': batch_id, 'status': 'applied', 'source': path, 'rows': len(batch),
+        'reference_dates': reference_dates, 'applied_at': pd.Timestamp.now(tz='UTC').isoformat(),
+    }
+    append_ingest_log(entry)
+    return entry
+
+
+def compact(selected_cluster: int) -> list:
+    """Fold the parts ingested into the cluster's stores, state and RFM table back into them; a pass over the history.
+
+    Returns the files rewritten.
+    """
+    roll_back_interrupted(read_ingest_log())
+    state_path = cardholder_state_path(selected_cluster)
+    state_in_use = has_fresh_state(selected_cluster)
+    rewritten = []
+    feather_path = full_dataset_feather_path(selected_cluster)
+    if is_fresh(feather_path, selected_cluster) and part_paths(feather_path):
+        rewritten.append(convert_full_dataset_feather(selected_cluster))
+    partition_path = dataset_partition_path(TRANSACTIONS_DATASET_PATH, selected_cluster)
+    if is_fresh(partition_path, selected_cluster) and part_paths(partition_path):
+        transactions = pa.Table.from_pandas(read_transactions_csv(full_dataset_csv_path(selected_cluster)), preserve_index=False)
+        rewritten.append(write_partition(transactions, TRANSACTIONS_DATASET_PATH, selected_cluster))
+    parquet_path = full_dataset_parquet_path(selected_cluster)
+    if is_fresh(parquet_path, selected_cluster) and part_paths(parquet_path):
+        rewritten.append(convert_full_dataset(selected_cluster))
+
+    # After the stores, so the state stays at least as new as them
+    if state_in_use and part_paths(state_path):
+        write_atomically(read_state(selected_cluster), state_path, fold_parts=True)
+        rewritten.append(state_path)
+    elif state_in_use and rewritten:
+        os.utime(state_path)
+    rfm_path = rfm_csv_path(selected_cluster)
+    if part_paths(rfm_path):
+        rfm_partition_path = dataset_partition_path(RFM_DATASET_PATH, selected_cluster)
+        partition_in_use = is_fresh(rfm_partition_path, selected_cluster, rfm_path)
+        write_atomically(read_rfm_table(rfm_path), rfm_path, fold_parts=True)
+        rewritten.append(rfm_path)
+        if partition_in_use:
+            rewritten.append(write_partition(pa.Table.from_pandas(pd.read_csv(rfm_path), preserve_index=False), RFM_DATASET_PATH, selected_cluster))
+    return rewritten
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append batches of transactions and update aggregates and RFM incrementally.")
+    parser.add_argument('batches', nargs='*', help="CSV or Parquet files in the 'Full Dataset of Cluster N' schema")
+    parser.add_argument('--cluster', type=int, help="Cluster for rows without a Cluster value")
+    parser.add_argument('--compact', action='store_true', help="Afterwards, fold the ingested parts back into each cluster's tables")
+    parser.add_argument('--log', action='store_true', help="Print the batch log")
+    args = parser.parse_args()
+
+    for path in args.batches:
+        entry = ingest_batch(path, args.cluster)
+        if entry['status'] == 'skipped':
+            print(f"{path}: already ingested ({entry['batch_id']}), skipping")
+        else:
+            print(f"{path}: {entry['rows']:,} rows into clusters {', '.join(entry['reference_dates'])}")
+    if args.compact:
+        for selected_cluster in available_clusters():
+            rewritten = compact(selected_cluster)
+            print(f"Cluster {selected_cluster}: {'rewrote ' + ', '.join(rewritten) if rewritten else 'nothing to compact'}")
+    if args.log:
+        for entry in read_ingest_log():
+            print(json.dumps(entry))
+
+
+if __name__ == "__main__":
+    main()
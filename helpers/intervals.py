@@ -0,0 +1,94 @@
+import math
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from helpers.cache import cached_by_files
+from helpers.data_store import load_transactions, transactions_source_files
+from helpers.cardholders import load_cardholder_order, load_transaction_codes
+from helpers.windows import transaction_rows
+
+NANOSECONDS_PER_DAY = 86_400 * 10**9
+
+# Per-cardholder inter-purchase statistics, aligned with the sorted cardholder ids.
+# Cardholders with a single transaction have a gap_count of 0 and NaN mean/median.
+IntervalStats = namedtuple('IntervalStats', ['cardholder_ids', 'mean_gap_days', 'median_gap_days', 'gap_count'])
+
+
+def segment_medians(values: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Median of each contiguous, already-sorted segment of values."""
+    medians = np.full(len(counts), np.nan)
+    has_values = counts > 0
+    lower = starts[has_values] + (counts[has_values] - 1) // 2
+    upper = starts[has_values] + counts[has_values] // 2
+    medians[has_values] = (values[lower] + values[upper]) / 2
+    return medians
+
+
+def build_interval_stats(cardholder_ids, transaction_dates, presorted: bool = False) -> IntervalStats:
+    """Compute per-cardholder inter-purchase statistics with NumPy segment operations.
+
+    Pass presorted=True when the rows are already ordered by cardholder and date to skip the sort.
+    """
+    codes, uniques = pd.factorize(np.asarray(cardholder_ids), sort=True)
+    return interval_stats_of_codes(codes, np.asarray(uniques), transaction_dates, presorted)
+
+
+def build_coded_interval_stats(ranks: np.ndarray, transaction_dates, sorted_ids: np.ndarray) -> IntervalStats:
+    """build_interval_stats over cardholder ranks (see CardholderOrder), so no string id is hashed or compared."""
+    present, codes = np.unique(ranks, return_inverse=True)
+    return interval_stats_of_codes(codes, sorted_ids[present], transaction_dates)
+
+
+def interval_stats_of_codes(codes: np.ndarray, uniques: np.ndarray, transaction_dates, presorted: bool = False) -> IntervalStats:
+    """Interval statistics of dense codes 0..len(uniques)-1 whose order is the cardholder_id order of uniques."""
+    dates = np.asarray(transaction_dates, dtype='datetime64[ns]').view('int64')
+
+    if not presorted:
+        order = np.lexsort((dates, codes))
+        codes, dates = codes[order], dates[order]
+
+    # Gaps between consecutive purchases of the same cardholder, in whole days like .dt.days
+    same_cardholder = codes[1:] == codes[:-1]
+    gap_codes = codes[1:][same_cardholder]
+    gap_days = (np.diff(dates)[same_cardholder] // NANOSECONDS_PER_DAY).astype(np.float64)
+
+    gap_count = np.bincount(gap_codes, minlength=len(uniques))
+    gap_sum = np.bincount(gap_codes, weights=gap_days, minlength=len(uniques))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_gap_days = np.where(gap_count > 0, gap_sum / gap_count, np.nan)
+
+    # Gaps are already grouped by cardholder; sort within each group for the medians
+    gap_days = gap_days[np.lexsort((gap_days, gap_codes))]
+    starts = np.cumsum(gap_count) - gap_count
+    median_gap_days = segment_medians(gap_days, starts, gap_count)
+
+    return IntervalStats(uniques, mean_gap_days, median_gap_days, gap_count.astype(np.int32))
+
+
+@cached_by_files(lambda selected_cluster, merchant_id=None, window_days=None: transactions_source_files(selected_cluster))
+def load_interval_stats(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> IntervalStats:
+    """Inter-purchase statistics for the selected cluster, computed once per data file.
+
+    Clusters too large to load whole get streamed statistics, which carry no medians.
+    With a merchant_id and/or window_days, only the gaps between purchases at that merchant
+    and/or in the cluster's last window_days days count.
+    """
+    if merchant_id is None and window_days is None:
+        from helpers.streaming import should_stream, load_streaming_statistics  # streaming builds on this module
+        if should_stream(selected_cluster):
+            return load_streaming_statistics(selected_cluster).intervals
+    rows = transaction_rows(selected_cluster, merchant_id, window_days)
+    codes = load_transaction_codes(selected_cluster)
+    order = load_cardholder_order()  # After the codes, which may intern new ids
+    dates = load_transactions(selected_cluster, columns=['transaction_date'])['transaction_date'].to_numpy()
+    return build_coded_interval_stats(order.rank[codes[rows]], dates[rows], order.sorted_ids)
+
+
+def has_repeat_purchases(stats: IntervalStats) -> bool:
+    """Whether any cardholder bought twice, i.e. whether there is a transaction duration at all."""
+    return bool(np.any(stats.gap_count > 0))
+
+
+def average_transaction_duration(stats: IntervalStats) -> int:
+    """Cluster-wide average of the per-cardholder mean gap, rounded up to whole days."""
+    return math.ceil(np.nanmean(stats.mean_gap_days))
@@ -0,0 +1,125 @@
+import os
+import time
+import argparse
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from helpers.cache import cached_by_files
+from helpers.data_store import available_clusters, load_transactions, transactions_source_path, transactions_source_files
+
+MERCHANT_COLUMNS = ['merchant_id', 'name', 'transaction_date']
+ALL_MERCHANTS = "All merchants"  # Picker option that keeps the whole cluster
+
+# A cluster's transaction rows grouped by merchant: merchants sorted by id, and the row numbers of
+# merchant i's transactions, oldest first, at order[offsets[i]:offsets[i + 1]], with their dates
+# (int64 nanoseconds) at the same positions of dates.
+MerchantIndex = namedtuple('MerchantIndex', ['merchants', 'order', 'offsets', 'dates'])
+
+
+def normalize_merchant_id(merchant_id: str) -> str:
+    """One id for values the source repeats, e.g. '289,289' is merchant '289'."""
+    ids = list(dict.fromkeys(part.strip() for part in str(merchant_id).split(',')))
+    return ids[0] if len(ids) == 1 else ','.join(ids)
+
+
+def build_merchant_index(merchant_ids, names, transaction_dates) -> MerchantIndex:
+    """Group transaction rows by merchant, and by date within a merchant, with one sort and no per-merchant masks.
+
+    Categorical merchant_ids (load_transactions(compact=True)) reuse their dictionary instead of being factorized.
+    """
+    merchant_ids = pd.Series(merchant_ids)
+    if isinstance(merchant_ids.dtype, pd.CategoricalDtype):
+        merchant_ids = merchant_ids.cat.remove_unused_categories()
+        raw_codes, raw_ids = merchant_ids.cat.codes.to_numpy(), merchant_ids.cat.categories
+    else:
+        raw_codes, raw_ids = pd.factorize(merchant_ids.to_numpy(dtype=object))
+    codes, uniques = pd.factorize(np.array([normalize_merchant_id(merchant_id) for merchant_id in raw_ids], dtype=object), sort=True)
+    codes = codes[raw_codes]
+    dates = np.asarray(transaction_dates, dtype='datetime64[ns]').view('int64')
+    order = np.lexsort((dates, codes))
+    counts = np.bincount(codes, minlength=len(uniques))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    merchants = pd.DataFrame({
+        'merchant_id': np.asarray(uniques),
+        'name': pd.Series(names).take(order[offsets[:-1]]).to_numpy(dtype=object),
+        'Transactions': counts,
+    })
+    return MerchantIndex(merchants, order, offsets, dates[order])
+
+
+@cached_by_files(transactions_source_files)
+def load_merchant_index(selected_cluster: int) -> MerchantIndex:
+    """Merchant index of the selected cluster, built once per data file."""
+    df = load_transactions(selected_cluster, columns=MERCHANT_COLUMNS, compact=True)
+    return build_merchant_index(df['merchant_id'], df['name'], df['transaction_date'].to_numpy())
+
+
+def merchant_rows(index: MerchantIndex, merchant_id: str, since: np.int64 | None = None) -> np.ndarray:
+    """Row numbers of a merchant's transactions, optionally only those at or after since (int64 nanoseconds).
+
+    Both bounds are binary searches, so the result is a slice of the index.
+    """
+    merchant_ids = index.merchants['merchant_id'].to_numpy()
+    position = int(np.searchsorted(merchant_ids, merchant_id))
+    if position == len(merchant_ids) or merchant_ids[position] != merchant_id:
+        raise KeyError(f"No transactions for merchant {merchant_id!r}")
+    start, end = index.offsets[position], index.offsets[position + 1]
+    if since is not None:
+        start += int(np.searchsorted(index.dates[start:end], since, side='left'))
+    return index.order[start:end]
+
+
+def load_merchant_transactions(selected_cluster: int, merchant_id: str, columns: list | None = None) -> pd.DataFrame:
+    """The selected cluster's transactions at one merchant, oldest first."""
+    rows = merchant_rows(load_merchant_index(selected_cluster), merchant_id)
+    return load_transactions(selected_cluster, columns).take(rows).reset_index(drop=True)
+
+
+def merchant_labels(clusters: list) -> dict:
+    """Display label of every merchant trading in any of the clusters, by merchant id."""
+    indexed = [selected_cluster for selected_cluster in clusters if os.path.exists(transactions_source_path(selected_cluster))]
+    if not indexed:
+        return {}
+    merchants = pd.concat([load_merchant_index(selected_cluster).merchants for selected_cluster in indexed])
+    merchants = merchants.drop_duplicates('merchant_id').sort_values('merchant_id')
+    return dict(zip(merchants['merchant_id'], merchants['name'] + ' (' + merchants['merchant_id'] + ')'))
+
+
+def has_merchant(selected_cluster: int, merchant_id: str) -> bool:
+    """Whether the merchant trades in the cluster; False for clusters without a transactions file."""
+    if not os.path.exists(transactions_source_path(selected_cluster)):
+        return False
+    return merchant_id in set(load_merchant_index(selected_cluster).merchants['merchant_id'])
+
+
+def select_merchant(clusters: list, key: str = "merchant_id", container=None) -> str | None:
+    """A merchant picker over the clusters' merchants; None keeps the whole cluster."""
+    import streamlit as st  # Only the pages need it
+
+    labels = merchant_labels(clusters)
+    # A merchant picked for another cluster may not trade in these
+    if st.session_state.get(key) not in labels:
+        st.session_state[key] = ALL_MERCHANTS
+    merchant_id = (container or st).selectbox("Merchant", [ALL_MERCHANTS, *labels], format_func=lambda option: labels.get(option, option), key=key)
+    return None if merchant_id == ALL_MERCHANTS else merchant_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List each cluster's merchants and time a per-merchant slice.")
+    parser.add_argument('--clusters', type=int, nargs='+', help="Clusters to index (default: all with transactions)")
+    args = parser.parse_args()
+
+    for selected_cluster in args.clusters or available_clusters():
+        started = time.perf_counter()
+        index = load_merchant_index(selected_cluster)
+        built = time.perf_counter()
+        print(f"Cluster {selected_cluster}: {len(index.merchants):,} merchants over {len(index.order):,} transactions, indexed in {built - started:.3f} s")
+        for merchant in index.merchants.itertuples(index=False):
+            started = time.perf_counter()
+            rows = load_merchant_transactions(selected_cluster, merchant.merchant_id, ['cardholder_id'])
+            print(f"  {merchant.merchant_id:>8} {merchant.name:<24} {merchant.Transactions:>10,} transactions "
+                  f"{rows['cardholder_id'].nunique():>8,} cardholders  {time.perf_counter() - started:.4f} s")
+
+
+if __name__ == "__main__":
+    main()
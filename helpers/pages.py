@@ -0,0 +1,60 @@
+import sys
+import time
+import logging
+import argparse
+import importlib
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# Sidebar label -> page module. Modules are imported the first time their page is selected,
+# so a fresh app replica only pays for the page it actually renders.
+PAGES = {
+    "Strategy  1": "strat1",  # "strat1_test" for the test variant
+    "Strategy 2": "strat2",  # "strat2_test" for the test variant
+    "Strategy 3": "strat3",
+    "Strategy 4": "strat4",
+    "Strategy 5": "strat5",
+    "Strategy 6": "strat6",
+    "Strategy 7": "strat7",
+}
+
+# Seconds each page module took to import in this process
+PAGE_IMPORT_SECONDS = {}
+
+
+def load_page(label: str):
+    """The page module for a sidebar label, imported on first use."""
+    module_name = PAGES[label]
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    PAGE_IMPORT_SECONDS[module_name] = time.perf_counter() - started
+    logger.info("Imported %s in %.3f s", module_name, PAGE_IMPORT_SECONDS[module_name])
+    return module
+
+
+def cold_import_seconds(statement: str, setup: str = "") -> float:
+    """Time statement in a fresh interpreter, after running setup there untimed."""
+    code = f"import time\n{setup}\nstarted = time.perf_counter()\n{statement}\nprint(time.perf_counter() - started)"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app startup and the cold import cost of each strategy page.")
+    parser.add_argument('--repeat', type=int, default=3, help="Fresh interpreters per measurement; the fastest is reported")
+    args = parser.parse_args()
+
+    def best(statement, setup=""):
+        return min(cold_import_seconds(statement, setup) for _ in range(args.repeat))
+
+    print(f"{'streamlit':<22} {best('import streamlit'):.3f} s")
+    print(f"{'app startup':<22} {best('import helpers.pages', 'import streamlit'):.3f} s after streamlit")
+    for label, module_name in PAGES.items():
+        print(f"{label + ' (' + module_name + ')':<22} {best(f'import {module_name}', 'import streamlit'):.3f} s after streamlit")
+
+
+if __name__ == "__main__":
+    main()
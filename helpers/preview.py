@@ -0,0 +1,50 @@
+import math
+import numpy as np
+import pandas as pd
+
+PREVIEW_PAGE_ROWS = 50
+RANK_ORDER = "Rank"  # Sort option that keeps the frame's own order
+
+
+def page_count(total_rows: int, page_rows: int = PREVIEW_PAGE_ROWS) -> int:
+    return max(math.ceil(total_rows / page_rows), 1)
+
+
+def preview_page(frame: pd.DataFrame, sort_by: str | None = None, ascending: bool = False,
+                 page: int = 0, page_rows: int = PREVIEW_PAGE_ROWS) -> pd.DataFrame:
+    """One page of frame, optionally sorted by a column; rows keep their index, i.e. their rank.
+
+    Only the page's positions are taken from the frame, so the slice handed to the browser is
+    page_rows rows whatever the size of the frame.
+    """
+    start = min(page, page_count(len(frame), page_rows) - 1) * page_rows
+    if sort_by is None or sort_by == RANK_ORDER:
+        return frame.iloc[start:start + page_rows]
+    # Ranking with method='first' breaks ties by position, so equal values stay in rank order either way
+    order = np.argsort(frame[sort_by].rank(method='first', ascending=ascending).to_numpy(), kind='stable')
+    return frame.iloc[order[start:start + page_rows]]
+
+
+def paginated_dataframe(frame: pd.DataFrame, key: str, page_rows: int = PREVIEW_PAGE_ROWS):
+    """A sortable preview that sends one page of frame to the browser per interaction instead of all of it."""
+    import streamlit as st  # Keeps the slicing above importable without the app
+
+    pages = page_count(len(frame), page_rows)
+    page_key = f"{key}_page"
+    # The widget reads its page from session_state only, so it is set once here and never through value=;
+    # the frame may have shrunk since the last rerun (a smaller N), so stay on its last page
+    st.session_state.setdefault(page_key, 1)
+    if st.session_state[page_key] > pages:
+        st.session_state[page_key] = pages
+
+    sort_col, order_col, page_col = st.columns([2, 1, 1])
+    with sort_col:
+        sort_by = st.selectbox("Sort by", [RANK_ORDER, *frame.columns], key=f"{key}_sort")
+    with order_col:
+        ascending = st.toggle("Ascending", key=f"{key}_ascending", disabled=sort_by == RANK_ORDER)
+    with page_col:
+        page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, step=1, key=page_key)
+
+    st.dataframe(preview_page(frame, sort_by, ascending, page - 1, page_rows))
+    start = (page - 1) * page_rows
+    st.caption(f"Rows {min(start + 1, len(frame)):,}–{min(start + page_rows, len(frame)):,} of {len(frame):,}")
@@ -0,0 +1,79 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from helpers.cache import cached_by_files
+from helpers.data_store import load_rfm, rfm_source_files, transactions_source_files
+from helpers.aggregates import load_cardholder_aggregates
+
+# A cluster's RFM rows sorted once by Monetary (highest first), so "top N" is a slice, not another sort.
+# The pages size budgets and revenue from the cluster averages (helpers.formulas), not from these rows.
+RankedCustomers = namedtuple('RankedCustomers', ['customers'])
+
+
+def build_ranked_customers(rfm: pd.DataFrame) -> RankedCustomers:
+    """Rank the RFM rows by Monetary."""
+    return RankedCustomers(rfm.sort_values('Monetary', ascending=False).reset_index(drop=True))
+
+
+@cached_by_files(lambda selected_cluster, merchant_id=None, window_days=None: [*rfm_source_files(selected_cluster), *transactions_source_files(selected_cluster)])
+def load_ranked_customers(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> RankedCustomers:
+    """Ranked customers of the selected cluster, or of its purchases at one merchant and/or in a date window, built once per data file."""
+    return build_ranked_customers(load_rfm(selected_cluster, merchant_id, window_days))
+
+
+def top_customers(ranked: RankedCustomers, num_customers: int) -> pd.DataFrame:
+    """The num_customers highest-Monetary customers."""
+    return ranked.customers.iloc[:max(int(num_customers), 0)]
+
+
+# Cardholders with a positive net value (avg transaction minus avg cashback), highest first,
+# with running totals so the smallest set reaching a revenue target is one binary search away.
+NetValueIndex = namedtuple('NetValueIndex', ['cardholders', 'cumulative_net_value', 'cumulative_cashback'])
+
+TargetSelection = namedtuple('TargetSelection', ['num_customers', 'cardholders', 'net_value', 'cashback_budget'])
+
+
+def build_net_value_index(aggregates: pd.DataFrame) -> NetValueIndex:
+    """Rank cardholders by net value and precompute the net value and cashback prefix sums."""
+    net_value = aggregates['Avg_Transaction_Value'] - aggregates['Avg_Cashback_Value']
+    cardholders = (
+        aggregates[['cardholder_id', 'Avg_Transaction_Value', 'Avg_Cashback_Value']]
+        .assign(Net_Value=net_value)
+        .loc[net_value > 0]
+        .sort_values('Net_Value', ascending=False, kind='stable')
+        .reset_index(drop=True)
+    )
+    return NetValueIndex(
+        cardholders,
+        np.cumsum(cardholders['Net_Value'].to_numpy(dtype=np.float64)),
+        np.cumsum(cardholders['Avg_Cashback_Value'].to_numpy(dtype=np.float64)),
+    )
+
+
+@cached_by_files(lambda selected_cluster, merchant_id=None, window_days=None: transactions_source_files(selected_cluster))
+def load_net_value_index(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> NetValueIndex:
+    """Net value index of the selected cluster, or of its purchases at one merchant and/or in a date window, built once per data file."""
+    return build_net_value_index(load_cardholder_aggregates(selected_cluster, merchant_id, window_days))
+
+
+def max_net_value(index: NetValueIndex) -> float:
+    """Net value of every positive-value cardholder in the index together."""
+    return float(index.cumulative_net_value[-1]) if len(index.cumulative_net_value) else 0.0
+
+
+def select_for_revenue_target(index: NetValueIndex, revenue_target: float) -> TargetSelection | None:
+    """Smallest set of cardholders whose summed net value meets revenue_target, or None if it is unreachable.
+
+    Taking the highest net values first makes the prefix of the index the minimal set, found in O(log n).
+    """
+    if revenue_target <= 0:
+        return TargetSelection(0, index.cardholders.iloc[:0], 0.0, 0.0)
+    num_customers = int(np.searchsorted(index.cumulative_net_value, revenue_target, side='left')) + 1
+    if num_customers > len(index.cumulative_net_value):
+        return None
+    return TargetSelection(
+        num_customers,
+        index.cardholders.iloc[:num_customers],
+        float(index.cumulative_net_value[num_customers - 1]),
+        float(index.cumulative_cashback[num_customers - 1]),
+    )
@@ -0,0 +1,276 @@
+import io
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+from helpers.data_store import RFM_REFERENCE_DATE, TRANSACTION_DTYPES, DATE_COLUMNS, full_dataset_csv_path, rfm_csv_path, remove_parts
+from helpers.synthetic import FULL_DATASET_SCHEMA, RFM_SCHEMA
+from helpers.timing import timed
+from helpers.clustering import RFM_FEATURES, ClusterModel, assign_clusters, current_model, iter_frame_features, minibatch_kmeans, save_model
+
+# The raw transaction columns; RFM and Cluster are appended by the pipeline
+RAW_COLUMNS = [name for name in FULL_DATASET_SCHEMA.names if name not in RFM_FEATURES + ['Cluster']]
+
+PIPELINE_CHUNK_ROWS = 1_000_000
+TASK_BYTES = 256 << 20  # CSV bytes per worker task
+
+# The labelled RFM table (indexed by cardholder_id) and seconds spent in each stage
+PipelineResult = namedtuple('PipelineResult', ['rfm', 'timings'])
+
+# One worker's share of the input: a CSV byte range, or a list of Parquet row groups
+InputTask = namedtuple('InputTask', ['path', 'start', 'end', 'row_groups'])
+
+
+def plan_tasks(paths: list, task_bytes: int = TASK_BYTES, task_rows: int = PIPELINE_CHUNK_ROWS) -> list:
+    """Split the inputs into independent tasks: CSVs by byte range, Parquet files by row group."""
+    tasks = []
+    for path in paths:
+        if path.endswith('.parquet'):
+            metadata = pq.ParquetFile(path).metadata
+            group, rows = [], 0
+            for row_group in range(metadata.num_row_groups):
+                group.append(row_group)
+                rows += metadata.row_group(row_group).num_rows
+                if rows >= task_rows:
+                    tasks.append(InputTask(path, None, None, group))
+                    group, rows = [], 0
+            if group:
+                tasks.append(InputTask(path, None, None, group))
+        else:
+            size = os.path.getsize(path)
+            tasks.extend(InputTask(path, start, min(start + task_bytes, size), None) for start in range(0, size, task_bytes))
+    return tasks
+
+
+def read_csv_range(path: str, start: int, end: int) -> bytes:
+    """The header plus every line whose first byte falls in [start, end)."""
+    with open(path, 'rb') as f:
+        header = f.readline()
+        if start <= len(header):
+            f.seek(len(header))
+        else:
+            f.seek(start - 1)
+            f.readline()  # Finish the line the previous range owns
+        position = f.tell()
+        data = f.read(max(end - position, 0)) if position < end else b''
+        if data and not data.endswith(b'\n'):
+            data += f.readline()
+    return header + data
+
+
+def iter_task_chunks(task: InputTask, chunk_rows: int = PIPELINE_CHUNK_ROWS):
+    """Yield the task's transactions in file order, chunk_rows at a time, with the raw columns typed."""
+    if task.row_groups is not None:
+        for batch in pq.ParquetFile(task.path).iter_batches(batch_size=chunk_rows, row_groups=task.row_groups, columns=RAW_COLUMNS):
+            yield batch.to_pandas()
+        return
+    dtypes = {col: dtype for col, dtype in TRANSACTION_DTYPES.items() if col in RAW_COLUMNS}
+    data = io.BytesIO(read_csv_range(task.path, task.start, task.end))
+    with pd.read_csv(data, usecols=RAW_COLUMNS, dtype=dtypes, parse_dates=DATE_COLUMNS, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            yield chunk[RAW_COLUMNS]
+
+
+def partial_rfm(transactions: pd.DataFrame) -> pd.DataFrame:
+    """Last purchase, count and spend per cardholder in one groupby."""
+    return transactions.groupby('cardholder_id').agg(
+        Last_Transaction_Date=('transaction_date', 'max'),
+        Frequency=('transaction_amount', 'count'),
+        Monetary=('transaction_amount', 'sum'),
+    )
+
+
+def coded_partial_rfm(ranks: np.ndarray, transactions: pd.DataFrame, sorted_ids: np.ndarray) -> pd.DataFrame:
+    """partial_rfm over cardholder ranks (see helpers.cardholders.CardholderOrder): bincounts instead of a groupby."""
+    size = len(sorted_ids)
+    frequency = np.bincount(ranks, minlength=size)
+    monetary = np.bincount(ranks, weights=transactions['transaction_amount'].to_numpy(dtype=np.float64), minlength=size)
+    last = np.full(size, np.iinfo(np.int64).min)
+    np.maximum.at(last, ranks, transactions['transaction_date'].to_numpy(dtype='datetime64[ns]').view('int64'))
+    present = np.flatnonzero(frequency)
+    return pd.DataFrame({
+        'Last_Transaction_Date': last[present].view('datetime64[ns]'),
+        'Frequency': frequency[present],
+        'Monetary': monetary[present],
+    }, index=pd.Index(sorted_ids[present], name='cardholder_id'))
+
+
+def task_partial_rfm(task: InputTask, chunk_rows: int = PIPELINE_CHUNK_ROWS) -> pd.DataFrame:
+    return combine_partials([partial_rfm(chunk) for chunk in iter_task_chunks(task, chunk_rows)])
+
+
+def combine_partials(partials: list) -> pd.DataFrame:
+    """Merge per-chunk partial RFM frames; cardholders seen in several chunks are combined."""
+    combined = pd.concat(partials)
+    if combined.index.is_unique:
+        return combined.sort_index()
+    return combined.groupby(level=0).agg(Last_Transaction_Date=('Last_Transaction_Date', 'max'),
+                                         Frequency=('Frequency', 'sum'), Monetary=('Monetary', 'sum'))
+
+
+def finish_rfm(partial: pd.DataFrame, reference_date: pd.Timestamp | None = None) -> pd.DataFrame:
+    """The RFM table: days since the last purchase's day, transaction count and total spend.
+
+    Recency counts back from reference_date, by default the day after the newest transaction.
+    """
+    if reference_date is None:
+        reference_date = partial['Last_Transaction_Date'].max().normalize() + pd.Timedelta(days=1)
+    return pd.DataFrame({
+        'cardholder_id': partial.index.to_numpy(),
+        'Recency': (reference_date - partial['Last_Transaction_Date'].dt.normalize()).dt.days.to_numpy(),
+        'Frequency': partial['Frequency'].to_numpy(dtype=np.int64),
+        'Monetary': partial['Monetary'].to_numpy(dtype=np.float64),
+    })
+
+
+def compute_rfm(transactions: pd.DataFrame, reference_date: pd.Timestamp | None = None) -> pd.DataFrame:
+    """RFM per cardholder of an in-memory transactions frame."""
+    return finish_rfm(partial_rfm(transactions), reference_date)
+
+
+_labelled_rfm = None
+
+
+def _set_labelled_rfm(labelled_rfm: pd.DataFrame):
+    global _labelled_rfm
+    _labelled_rfm = labelled_rfm
+
+
+def task_write_parts(task: InputTask, task_index: int, part_dir: str, clusters: int, chunk_rows: int = PIPELINE_CHUNK_ROWS) -> list:
+    """Append RFM and Cluster to the task's rows and write them to one header-less CSV part per cluster."""
+    rfm = _labelled_rfm
+    options = pv.WriteOptions(include_header=False, quoting_style='needed')
+    writers = {}
+    rows = [0] * clusters
+    try:
+        for chunk in iter_task_chunks(task, chunk_rows):
+            codes = rfm.index.get_indexer(chunk['cardholder_id'])
+            for column in RFM_FEATURES + ['Cluster']:
+                chunk[column] = rfm[column].to_numpy(dtype=np.float64)[codes]
+            labels = rfm['Cluster'].to_numpy()[codes]
+            order = np.argsort(labels, kind='stable')
+            bounds = np.searchsorted(labels[order], np.arange(clusters + 1))
+            table = pa.Table.from_pandas(chunk, schema=FULL_DATASET_SCHEMA, preserve_index=False).take(pa.array(order))
+            for selected_cluster in range(clusters):
+                start, end = bounds[selected_cluster], bounds[selected_cluster + 1]
+                if start == end:
+                    continue
+                if selected_cluster not in writers:
+                    part_path = os.path.join(part_dir, f'{selected_cluster}-{task_index:06d}.csv')
+                    writers[selected_cluster] = pv.CSVWriter(part_path, FULL_DATASET_SCHEMA, write_options=options)
+                writers[selected_cluster].write_table(table.slice(start, end - start))
+                rows[selected_cluster] += int(end - start)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return rows
+
+
+def assemble_partitions(part_dir: str, tasks: int, clusters: int, root: str = '.'):
+    """Concatenate each cluster's parts, in input order, behind one header into its transactions CSV."""
+    header = io.BytesIO()
+    pv.write_csv(FULL_DATASET_SCHEMA.empty_table(), header)
+    for selected_cluster in range(clusters):
+        path = os.path.join(root, full_dataset_csv_path(selected_cluster))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(header.getvalue())
+            for task_index in range(tasks):
+                part_path = os.path.join(part_dir, f'{selected_cluster}-{task_index:06d}.csv')
+                if os.path.exists(part_path):
+                    with open(part_path, 'rb') as part:
+                        shutil.copyfileobj(part, out, 16 << 20)
+        os.replace(tmp_path, path)
+
+
+def write_rfm_tables(labelled_rfm: pd.DataFrame, clusters: int, root: str = '.'):
+    """One rfm_cluster_N.csv per cluster, split from the labelled table in a single sort."""
+    labels = labelled_rfm['Cluster'].to_numpy()
+    order = np.argsort(labels, kind='stable')
+    bounds = np.searchsorted(labels[order], np.arange(clusters + 1))
+    table = pa.Table.from_pandas(labelled_rfm.reset_index()[RFM_SCHEMA.names], schema=RFM_SCHEMA, preserve_index=False).take(pa.array(order))
+    for selected_cluster in range(clusters):
+        path = os.path.join(root, rfm_csv_path(selected_cluster))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        start, end = bounds[selected_cluster], bounds[selected_cluster + 1]
+        pv.write_csv(table.slice(start, end - start), tmp_path, write_options=pv.WriteOptions(quoting_style='needed'))
+        remove_parts(path)  # Batches ingested into the old table are in the transactions it was rebuilt from
+        os.replace(tmp_path, path)
+
+
+def run_pipeline(paths: list, root: str = '.', model: ClusterModel | None = None, reference_date: pd.Timestamp | None = None,
+                 workers: int | None = None, chunk_rows: int = PIPELINE_CHUNK_ROWS, recluster: bool = False) -> PipelineResult:
+    """Build RFM from raw transactions, assign clusters and write every per-cluster RFM and transactions file under root.
+
+    The input is split into tasks that run across a process pool when there is more than one, and read
+    twice: once for per-cardholder partial RFM, once to write each task's rows into per-cluster parts,
+    which are then concatenated in input order. With recluster, the centroids are re-fitted to the new
+    RFM table (warm-started, ids kept stable) and saved before cardholders are assigned.
+    """
+    timings = {}
+    model = model or timed(timings, 'load_model', current_model, root)
+    clusters = len(model.centroids)
+    tasks = timed(timings, 'plan', plan_tasks, paths)
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    chunk_rows_per_task = [chunk_rows] * len(tasks)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            partials = timed(timings, 'partial_rfm', lambda: list(executor.map(task_partial_rfm, tasks, chunk_rows_per_task)))
+    else:
+        partials = timed(timings, 'partial_rfm', lambda: [task_partial_rfm(task, chunk_rows) for task in tasks])
+    rfm = timed(timings, 'combine_rfm', lambda: finish_rfm(combine_partials(partials), reference_date))
+    if recluster:
+        model = timed(timings, 'recluster', minibatch_kmeans, lambda: iter_frame_features(rfm), model)
+        save_model(model, root, cardholders=len(rfm), fitted_at=pd.Timestamp.now(tz='UTC').isoformat())
+    labels = timed(timings, 'assign_clusters', assign_clusters, rfm, model)
+    labelled_rfm = rfm.assign(Cluster=labels).set_index('cardholder_id')
+    timed(timings, 'write_rfm', write_rfm_tables, labelled_rfm, clusters, root)
+
+    data_dir = os.path.join(root, os.path.dirname(full_dataset_csv_path(0)))
+    with tempfile.TemporaryDirectory(dir=data_dir) as part_dir:
+        part_args = (tasks, range(len(tasks)), [part_dir] * len(tasks), [clusters] * len(tasks), chunk_rows_per_task)
+        if workers > 1:
+            # Each worker receives the labelled RFM table once, not once per task
+            with ProcessPoolExecutor(max_workers=workers, initializer=_set_labelled_rfm, initargs=(labelled_rfm,)) as executor:
+                timed(timings, 'write_parts', lambda: list(executor.map(task_write_parts, *part_args)))
+        else:
+            _set_labelled_rfm(labelled_rfm)
+            timed(timings, 'write_parts', lambda: list(map(task_write_parts, *part_args)))
+        timed(timings, 'assemble', assemble_partitions, part_dir, len(tasks), clusters, root)
+
+    return PipelineResult(labelled_rfm, timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build RFM tables and per-cluster transaction files from raw transactions.")
+    parser.add_argument('inputs', nargs='+', help="Raw transaction CSV or Parquet files (extra RFM/Cluster columns are ignored)")
+    parser.add_argument('--root', default='.', help="Directory holding the ./Data layout to read the cluster model from and write to")
+    parser.add_argument('--reference-date', help=f"Day Recency counts back from (default: the day after the newest transaction; the shipped tables use {RFM_REFERENCE_DATE.date()})")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: all cores)")
+    parser.add_argument('--chunk-rows', type=int, default=PIPELINE_CHUNK_ROWS)
+    parser.add_argument('--recluster', action='store_true', help="Re-fit the cluster centroids to this data before assigning")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    result = run_pipeline(args.inputs, args.root, reference_date=args.reference_date and pd.Timestamp(args.reference_date),
+                          workers=args.workers, chunk_rows=args.chunk_rows, recluster=args.recluster)
+    cluster_sizes = result.rfm['Cluster'].value_counts().sort_index()
+    print(f"{len(result.rfm):,} cardholders; per cluster: {', '.join(f'{c}={n:,}' for c, n in cluster_sizes.items())}")
+    for stage, seconds in result.timings.items():
+        print(f"{stage:<16} {seconds:8.3f} s")
+    print(f"{'total':<16} {time.perf_counter() - started:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from helpers.cache import cached_by_files
+from helpers.data_store import CLUSTER_NAMES, available_clusters, transactions_source_files
+from helpers.aggregates import load_cardholder_aggregates
+from helpers.intervals import load_interval_stats, average_transaction_duration, has_repeat_purchases
+from helpers.formulas import (
+    increased_revenue_target,
+    average_order_targeting,
+    transaction_duration_targeting,
+    deadline_targeting,
+)
+
+# Everything the strategy 2-4 formulas need from a cluster, plus prefix sums over the
+# cardholders ranked by Avg_Transaction_Value for the "top N customers" checks.
+ClusterSummary = namedtuple('ClusterSummary', [
+    'avg_order', 'avg_cashback', 'cardholder_count', 'sum_avg_transaction', 'max_potential_revenue',
+    'avg_transaction_duration', 'top_transaction_prefix', 'top_cashback_prefix', 'repeat_purchases',
+])
+
+SCENARIO_COLUMNS = [
+    'cluster', 'cluster_name', 'strategy', 'current_sales', 'percentage_increase', 'required_days',
+    'revenue_target', 'achievable', 'customers_to_target', 'cashback_budget', 'daily_revenue_per_customer',
+    'days_to_achieve_target', 'meets_deadline', 'top_customers_profit',
+]
+
+
+def build_cluster_summary(grouped: pd.DataFrame, avg_transaction_duration: float, repeat_purchases: bool = True) -> ClusterSummary:
+    """Summarize a cluster's per-cardholder aggregates for the scenario formulas.
+
+    Without repeat_purchases there is no transaction duration, and avg_transaction_duration is nan.
+    """
+    top_customers = grouped.sort_values(by='Avg_Transaction_Value', ascending=False)
+    return ClusterSummary(
+        avg_order=grouped['Avg_Transaction_Value'].mean(),
+        avg_cashback=grouped['Avg_Cashback_Value'].mean(),
+        cardholder_count=len(grouped),
+        sum_avg_transaction=grouped['Avg_Transaction_Value'].sum(),
+        max_potential_revenue=np.floor(grouped['Total_Transaction_Value'].sum() - grouped['Total_Cashback_Value'].sum()),
+        avg_transaction_duration=avg_transaction_duration,
+        top_transaction_prefix=np.cumsum(top_customers['Avg_Transaction_Value'].to_numpy(dtype=np.float64)),
+        top_cashback_prefix=np.cumsum(top_customers['Avg_Cashback_Value'].to_numpy(dtype=np.float64)),
+        repeat_purchases=repeat_purchases,
+    )
+
+
+@cached_by_files(transactions_source_files)
+def load_cluster_summary(selected_cluster: int) -> ClusterSummary:
+    """Scenario summary of the selected cluster, built once per data file."""
+    intervals = load_interval_stats(selected_cluster)
+    repeat_purchases = has_repeat_purchases(intervals)
+    return build_cluster_summary(
+        load_cardholder_aggregates(selected_cluster),
+        average_transaction_duration(intervals) if repeat_purchases else float('nan'),
+        repeat_purchases,
+    )
+
+
+def top_customers_profit(summaries: list, cluster_position: np.ndarray, num_customers: np.ndarray) -> np.ndarray:
+    """Floored sum of avg transaction minus floored sum of avg cashback over each cluster's top N cardholders."""
+    lengths = np.array([len(summary.top_transaction_prefix) for summary in summaries])
+    offsets = np.cumsum(lengths) - lengths
+    transaction_prefix = np.concatenate([summary.top_transaction_prefix for summary in summaries])
+    cashback_prefix = np.concatenate([summary.top_cashback_prefix for summary in summaries])
+
+    valid = np.isfinite(num_customers) & (num_customers > 0)
+    taken = np.clip(np.where(valid, num_customers, 1), 1, lengths[cluster_position]).astype(np.int64)
+    position = offsets[cluster_position] + taken - 1
+    profit = np.floor(transaction_prefix[position]) - np.floor(cashback_prefix[position])
+    return np.where(valid, profit, np.where(num_customers == 0, 0.0, np.nan))
+
+
+def tidy_frame(strategy: int, columns: dict) -> pd.DataFrame:
+    """Flatten broadcast result arrays into one row per cluster and scenario."""
+    shape = np.broadcast_shapes(*(np.shape(values) for values in columns.values()))
+    frame = pd.DataFrame({name: np.broadcast_to(values, shape).ravel() for name, values in columns.items()})
+    frame.insert(2, 'strategy', strategy)
+    return frame
+
+
+def run_scenario_grid(current_sales, percentage_increases, required_days, clusters: list | None = None) -> pd.DataFrame:
+    """Evaluate every (current sales, percentage increase, deadline) combination against each cluster.
+
+    All clusters and scenarios go through the strategy 2-4 formulas in one broadcast pass over a
+    (cluster, current sales, percentage increase, deadline) grid. Strategies 2 and 3 have no deadline,
+    so their rows carry a NaN required_days. Cells a page would reject are marked not achievable.
+    """
+    clusters = available_clusters() if clusters is None else list(clusters)
+    summaries = [load_cluster_summary(selected_cluster) for selected_cluster in clusters]
+
+    def per_cluster(field):
+        return np.array([getattr(summary, field) for summary in summaries], dtype=np.float64).reshape(-1, 1, 1, 1)
+
+    cluster = np.array(clusters).reshape(-1, 1, 1, 1)
+    cluster_name = np.array([CLUSTER_NAMES[selected_cluster] for selected_cluster in clusters]).reshape(-1, 1, 1, 1)
+    cluster_position = np.arange(len(clusters)).reshape(-1, 1, 1, 1)
+    sales = np.asarray(current_sales, dtype=np.float64).reshape(1, -1, 1, 1)
+    increase = np.asarray(percentage_increases, dtype=np.float64).reshape(1, 1, -1, 1)
+    days = np.ceil(np.asarray(required_days, dtype=np.float64)).reshape(1, 1, 1, -1)
+
+    avg_order, avg_cashback = per_cluster('avg_order'), per_cluster('avg_cashback')
+    avg_transaction_duration = per_cluster('avg_transaction_duration')
+    max_potential_revenue = per_cluster('max_potential_revenue')
+    target = increased_revenue_target(sales, increase)
+    common = {
+        'cluster': cluster, 'cluster_name': cluster_name, 'current_sales': sales,
+        'percentage_increase': increase, 'revenue_target': target,
+    }
+
+    # Strategy 2: floored averages, achievable while the cluster's summed avg transaction covers the target
+    customers, cashback_budget, _, _ = average_order_targeting(target, avg_order, avg_cashback)
+    achievable = per_cluster('sum_avg_transaction') >= target
+    strategy2 = tidy_frame(2, {
+        **common, 'required_days': np.nan, 'achievable': achievable,
+        'customers_to_target': np.where(achievable, customers, np.nan),
+        'cashback_budget': np.where(achievable, cashback_budget, np.nan),
+        'daily_revenue_per_customer': np.nan, 'days_to_achieve_target': np.nan, 'meets_deadline': False,
+        'top_customers_profit': np.where(achievable, top_customers_profit(summaries, cluster_position, customers), np.nan),
+    })
+
+    # Strategy 3: the deadline is the cluster's own average transaction duration
+    customers, daily_revenue, _, days_needed = transaction_duration_targeting(target, avg_order, avg_cashback, avg_transaction_duration)
+    achievable = max_potential_revenue >= target
+    strategy3 = tidy_frame(3, {
+        **common, 'required_days': np.nan, 'achievable': achievable,
+        'customers_to_target': np.where(achievable, customers, np.nan), 'cashback_budget': np.nan,
+        'daily_revenue_per_customer': np.where(achievable, daily_revenue, np.nan),
+        'days_to_achieve_target': np.where(achievable, days_needed, np.nan),
+        'meets_deadline': achievable & (days_needed <= avg_transaction_duration),
+        'top_customers_profit': np.where(achievable, top_customers_profit(summaries, cluster_position, customers), np.nan),
+    })
+
+    # Strategy 4: the merchant's deadline
+    daily_revenue, max_within_days, customers, _, days_needed = deadline_targeting(
+        target, avg_order, avg_cashback, avg_transaction_duration, days, per_cluster('cardholder_count'))
+    achievable = (max_potential_revenue >= target) & (max_within_days >= target)
+    strategy4 = tidy_frame(4, {
+        **common, 'required_days': days, 'achievable': achievable,
+        'customers_to_target': np.where(achievable, customers, np.nan), 'cashback_budget': np.nan,
+        'daily_revenue_per_customer': np.where(achievable, daily_revenue, np.nan),
+        'days_to_achieve_target': np.where(achievable, days_needed, np.nan),
+        'meets_deadline': achievable & (days_needed <= days),
+        'top_customers_profit': np.where(achievable, top_customers_profit(summaries, cluster_position, customers), np.nan),
+    })
+
+    return pd.concat([strategy2, strategy3, strategy4], ignore_index=True)[SCENARIO_COLUMNS]
@@ -0,0 +1,276 @@
+import os
+import math
+import tempfile
+import argparse
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from helpers.cache import cached_by_files
+from helpers.data_store import iter_transactions, transactions_source_path, transactions_source_files, TRANSACTION_COLUMNS
+from helpers.intervals import IntervalStats, NANOSECONDS_PER_DAY
+
+# Source files larger than this are aggregated chunk by chunk instead of being loaded whole
+STREAMING_THRESHOLD_BYTES = 1 << 30
+STREAMING_CHUNK_ROWS = 1_000_000
+# Memory allowed for the (cardholder, date) pairs of cardholders whose rows arrive out of date order
+SPILL_MEMORY_BYTES = 256 << 20
+# Spill files open at once; larger spills are split again partition by partition
+MAX_SPILL_PARTITIONS = 256
+# (cardholder, date) pairs read back at a time when a spill partition is split again
+SPILL_BLOCK_PAIRS = 1 << 20
+
+NO_DATE = np.iinfo(np.int64).min
+
+# Per-cardholder aggregates (the build_cardholder_aggregates columns plus first/last dates and gap totals)
+# and the matching inter-purchase statistics. Streaming keeps gap sums, not every gap, so medians are NaN.
+StreamingStatistics = namedtuple('StreamingStatistics', ['aggregates', 'intervals'])
+
+
+class CardholderAccumulators:
+    """Running per-cardholder sums, counts, first/last dates and gap totals over transaction chunks.
+
+    Gaps are whole days between consecutive purchases, like build_interval_stats. They are exact for
+    a cardholder as long as each chunk's rows for it come after the previous chunks' rows (order within
+    a chunk does not matter). Cardholders that break this are flagged in `unordered` and resolved by
+    resolve_unordered.
+    """
+
+    def __init__(self):
+        self.cardholder_ids = pd.Index([], dtype=object)
+        self.total = np.zeros(0)
+        self.cashback = np.zeros(0)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.first = np.zeros(0, dtype=np.int64)
+        self.last = np.zeros(0, dtype=np.int64)
+        self.gap_sum = np.zeros(0)
+        self.gap_count = np.zeros(0, dtype=np.int64)
+        self.unordered = np.zeros(0, dtype=bool)
+
+    @classmethod
+    def from_aggregates(cls, aggregates: pd.DataFrame) -> 'CardholderAccumulators':
+        """Resume accumulating from a frame produced by result().aggregates."""
+        accumulators = cls()
+        accumulators.cardholder_ids = pd.Index(aggregates['cardholder_id'].to_numpy(dtype=object))
+        accumulators.total = aggregates['Total_Transaction_Value'].to_numpy(dtype=np.float64).copy()
+        accumulators.cashback = aggregates['Total_Cashback_Value'].to_numpy(dtype=np.float64).copy()
+        accumulators.count = aggregates['Transaction_Count'].to_numpy(dtype=np.int64).copy()
+        accumulators.first = aggregates['First_Transaction_Date'].to_numpy(dtype='datetime64[ns]').view('int64').copy()
+        accumulators.last = aggregates['Last_Transaction_Date'].to_numpy(dtype='datetime64[ns]').view('int64').copy()
+        accumulators.gap_sum = aggregates['Gap_Days_Sum'].to_numpy(dtype=np.float64).copy()
+        accumulators.gap_count = aggregates['Gap_Count'].to_numpy(dtype=np.int64).copy()
+        accumulators.unordered = np.zeros(len(aggregates), dtype=bool)
+        return accumulators
+
+    def _grow(self, size: int):
+        extra = size - len(self.total)
+        self.total = np.concatenate([self.total, np.zeros(extra)])
+        self.cashback = np.concatenate([self.cashback, np.zeros(extra)])
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.first = np.concatenate([self.first, np.full(extra, np.iinfo(np.int64).max)])
+        self.last = np.concatenate([self.last, np.full(extra, NO_DATE)])
+        self.gap_sum = np.concatenate([self.gap_sum, np.zeros(extra)])
+        self.gap_count = np.concatenate([self.gap_count, np.zeros(extra, dtype=np.int64)])
+        self.unordered = np.concatenate([self.unordered, np.zeros(extra, dtype=bool)])
+
+    def codes_for(self, cardholder_ids: np.ndarray, add: bool = True) -> np.ndarray:
+        """Dense codes of the given cardholder ids, registering unseen ids when add is True."""
+        codes = self.cardholder_ids.get_indexer(cardholder_ids)
+        new = codes < 0
+        if add and new.any():
+            self.cardholder_ids = self.cardholder_ids.append(pd.Index(pd.unique(cardholder_ids[new])))
+            self._grow(len(self.cardholder_ids))
+            codes[new] = self.cardholder_ids.get_indexer(cardholder_ids[new])
+        return codes
+
+    def update(self, chunk: pd.DataFrame):
+        """Fold one chunk of transactions into the accumulators."""
+        codes = self.codes_for(chunk['cardholder_id'].to_numpy(dtype=object))
+        dates = chunk['transaction_date'].to_numpy(dtype='datetime64[ns]').view('int64')
+        size = len(self.cardholder_ids)
+        self.total += np.bincount(codes, weights=chunk['transaction_amount'].to_numpy(dtype=np.float64), minlength=size)
+        self.cashback += np.bincount(codes, weights=chunk['cashback_amount'].to_numpy(dtype=np.float64), minlength=size)
+        self.count += np.bincount(codes, minlength=size)
+
+        order = np.lexsort((dates, codes))
+        codes, dates = codes[order], dates[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        ends = np.r_[starts[1:], len(codes)] - 1
+        present, chunk_first, chunk_last = codes[starts], dates[starts], dates[ends]
+
+        # Gaps inside the chunk
+        same_cardholder = codes[1:] == codes[:-1]
+        gap_codes = codes[1:][same_cardholder]
+        self.gap_sum += np.bincount(gap_codes, weights=(np.diff(dates)[same_cardholder] // NANOSECONDS_PER_DAY).astype(np.float64), minlength=size)
+        self.gap_count += np.bincount(gap_codes, minlength=size)
+
+        # The gap bridging the previous chunk's last purchase and this chunk's first
+        previous_last = self.last[present]
+        seen = previous_last != NO_DATE
+        in_order = seen & (chunk_first >= previous_last)
+        self.gap_sum[present[in_order]] += ((chunk_first[in_order] - previous_last[in_order]) // NANOSECONDS_PER_DAY).astype(np.float64)
+        self.gap_count[present[in_order]] += 1
+        self.unordered[present[seen & ~in_order]] = True
+
+        self.first[present] = np.minimum(self.first[present], chunk_first)
+        self.last[present] = np.maximum(previous_last, chunk_last)
+
+    def resolve_unordered(self, chunks, memory_bytes: int = SPILL_MEMORY_BYTES):
+        """Recompute the gaps of out-of-order cardholders exactly from a second pass over the chunks.
+
+        Their (code, date) pairs are spilled to at most MAX_SPILL_PARTITIONS hash partitions on disk,
+        sized so that one partition fits in memory_bytes, and each partition is then sorted and diffed
+        on its own. A partition that still does not fit is split again by the next digits of the code.
+        """
+        if not self.unordered.any():
+            return
+        rows = int(self.count[self.unordered].sum())
+        partitions = min(MAX_SPILL_PARTITIONS, max(1, math.ceil(rows * 16 / max(memory_bytes, 1))))
+        size = len(self.cardholder_ids)
+        gap_sum, gap_count = np.zeros(size), np.zeros(size, dtype=np.int64)
+
+        def unordered_pairs():
+            for chunk in chunks:
+                codes = self.codes_for(chunk['cardholder_id'].to_numpy(dtype=object), add=False)
+                dates = chunk['transaction_date'].to_numpy(dtype='datetime64[ns]').view('int64')
+                keep = codes >= 0  # The accumulators may hold only some of the chunks' cardholders (see helpers.ingest)
+                keep[keep] = self.unordered[codes[keep]]
+                yield np.column_stack([codes[keep], dates[keep]])
+
+        with tempfile.TemporaryDirectory() as spill_dir:
+            for path in spill_partitions(unordered_pairs(), spill_dir, partitions, 1):
+                add_partition_gaps(path, gap_sum, gap_count, memory_bytes, partitions)
+
+        self.gap_sum[self.unordered] = gap_sum[self.unordered]
+        self.gap_count[self.unordered] = gap_count[self.unordered]
+        self.unordered[:] = False
+
+    def result(self) -> StreamingStatistics:
+        """Aggregates and interval statistics sorted by cardholder_id, like the in-memory builders."""
+        order = np.argsort(self.cardholder_ids.to_numpy(), kind='stable')
+        cardholder_ids = self.cardholder_ids.to_numpy()[order]
+        count, gap_count, gap_sum = self.count[order], self.gap_count[order], self.gap_sum[order]
+        aggregates = pd.DataFrame({
+            'cardholder_id': cardholder_ids,
+            'Total_Transaction_Value': self.total[order],
+            'Total_Cashback_Value': self.cashback[order],
+            'Transaction_Count': count,
+            'Avg_Transaction_Value': self.total[order] / count,
+            'Avg_Cashback_Value': self.cashback[order] / count,
+            'First_Transaction_Date': self.first[order].view('datetime64[ns]'),
+            'Last_Transaction_Date': self.last[order].view('datetime64[ns]'),
+            'Gap_Days_Sum': gap_sum,
+            'Gap_Count': gap_count,
+        })
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_gap_days = np.where(gap_count > 0, gap_sum / gap_count, np.nan)
+        intervals = IntervalStats(cardholder_ids, mean_gap_days, np.full(len(cardholder_ids), np.nan), gap_count.astype(np.int32))
+        return StreamingStatistics(aggregates, intervals)
+
+
+def spill_partitions(pair_blocks, spill_dir: str, partitions: int, divisor: int) -> list:
+    """Write (code, date) pair blocks to one file per partition, chosen by (code // divisor) % partitions."""
+    paths = [os.path.join(spill_dir, f'{partition}.bin') for partition in range(partitions)]
+    files = [open(path, 'wb') for path in paths]
+    try:
+        for pairs in pair_blocks:
+            partition_of = pairs[:, 0] // divisor % partitions
+            order = np.argsort(partition_of, kind='stable')
+            bounds = np.searchsorted(partition_of[order], np.arange(partitions + 1))
+            for partition in np.flatnonzero(np.diff(bounds)):
+                pairs[order[bounds[partition]:bounds[partition + 1]]].tofile(files[partition])
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def read_spill_blocks(path: str):
+    """Yield a spill file's (code, date) pairs SPILL_BLOCK_PAIRS at a time."""
+    for offset in range(0, os.path.getsize(path), SPILL_BLOCK_PAIRS * 16):
+        yield np.fromfile(path, dtype=np.int64, count=SPILL_BLOCK_PAIRS * 2, offset=offset).reshape(-1, 2)
+
+
+def add_partition_gaps(path: str, gap_sum: np.ndarray, gap_count: np.ndarray, memory_bytes: int, divisor: int):
+    """Add the whole-day gaps of one spill partition's cardholders to gap_sum and gap_count.
+
+    The partition holds codes that agree modulo divisor. If it is larger than memory_bytes it is split
+    into MAX_SPILL_PARTITIONS by the next digits of the code, recursively; a single cardholder's pairs
+    cannot be split further and are sorted in memory whatever their size.
+    """
+    size = len(gap_sum)
+    if os.path.getsize(path) > memory_bytes and divisor < size:
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(path)) as spill_dir:
+            paths = spill_partitions(read_spill_blocks(path), spill_dir, MAX_SPILL_PARTITIONS, divisor)
+            os.remove(path)
+            for sub_path in paths:
+                add_partition_gaps(sub_path, gap_sum, gap_count, memory_bytes, divisor * MAX_SPILL_PARTITIONS)
+        return
+    pairs = np.fromfile(path, dtype=np.int64).reshape(-1, 2)
+    codes, dates = pairs[:, 0], pairs[:, 1]
+    order = np.lexsort((dates, codes))
+    codes, dates = codes[order], dates[order]
+    same_cardholder = codes[1:] == codes[:-1]
+    gap_codes = codes[1:][same_cardholder]
+    gap_sum += np.bincount(gap_codes, weights=(np.diff(dates)[same_cardholder] // NANOSECONDS_PER_DAY).astype(np.float64), minlength=size)
+    gap_count += np.bincount(gap_codes, minlength=size)
+
+
+def should_stream(selected_cluster: int) -> bool:
+    """Whether the cluster's source file and its ingested parts are too large to load whole."""
+    return sum(os.path.getsize(path) for path in transactions_source_files(selected_cluster)) > STREAMING_THRESHOLD_BYTES
+
+
+def stream_statistics(selected_cluster: int, chunk_rows: int = STREAMING_CHUNK_ROWS, memory_bytes: int = SPILL_MEMORY_BYTES) -> StreamingStatistics:
+    """Aggregate the selected cluster's transactions chunk by chunk with bounded peak memory."""
+    accumulators = CardholderAccumulators()
+    for chunk in iter_transactions(selected_cluster, TRANSACTION_COLUMNS, chunk_rows):
+        accumulators.update(chunk)
+    accumulators.resolve_unordered(iter_transactions(selected_cluster, TRANSACTION_COLUMNS, chunk_rows), memory_bytes)
+    return accumulators.result()
+
+
+@cached_by_files(transactions_source_files)
+def load_streaming_statistics(selected_cluster: int) -> StreamingStatistics:
+    """Streaming statistics of the selected cluster, computed once per data file.
+
+    Resumes from the state incremental ingestion saved when it is up to date instead of rescanning.
+    """
+    from helpers.ingest import load_fresh_state  # ingest builds on this module
+    state = load_fresh_state(selected_cluster)
+    if state is not None:
+        return CardholderAccumulators.from_aggregates(state).result()
+    return stream_statistics(selected_cluster)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate cluster transactions chunk by chunk and optionally check against the in-memory path.")
+    parser.add_argument('--clusters', type=int, nargs='+', default=list(range(5)))
+    parser.add_argument('--chunk-rows', type=int, default=STREAMING_CHUNK_ROWS)
+    parser.add_argument('--memory-mb', type=int, default=SPILL_MEMORY_BYTES >> 20, help="Memory for the out-of-order spill partitions")
+    parser.add_argument('--verify', action='store_true', help="Compare with build_cardholder_aggregates and build_interval_stats")
+    args = parser.parse_args()
+
+    for selected_cluster in args.clusters:
+        if not os.path.exists(transactions_source_path(selected_cluster)):
+            print(f"Cluster {selected_cluster}: no transactions found, skipping")
+            continue
+        stats = stream_statistics(selected_cluster, args.chunk_rows, args.memory_mb << 20)
+        aggregates = stats.aggregates
+        print(f"Cluster {selected_cluster}: {len(aggregates):,} cardholders, {aggregates['Transaction_Count'].sum():,} transactions, "
+              f"avg order {aggregates['Avg_Transaction_Value'].mean():.2f} ¥, avg duration {math.ceil(np.nanmean(stats.intervals.mean_gap_days))} days")
+
+        if args.verify:
+            from helpers.data_store import load_transactions
+            from helpers.aggregates import build_cardholder_aggregates
+            from helpers.intervals import build_interval_stats
+            df = load_transactions(selected_cluster, columns=TRANSACTION_COLUMNS)
+            expected = build_cardholder_aggregates(df)
+            expected_intervals = build_interval_stats(df['cardholder_id'].to_numpy(), df['transaction_date'].to_numpy())
+            pd.testing.assert_frame_equal(aggregates[expected.columns], expected)
+            np.testing.assert_array_equal(stats.intervals.cardholder_ids, expected_intervals.cardholder_ids)
+            np.testing.assert_array_equal(stats.intervals.mean_gap_days, expected_intervals.mean_gap_days)
+            print(f"Cluster {selected_cluster}: matches the in-memory aggregates and intervals")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import os
+import math
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+from helpers.data_store import RFM_REFERENCE_DATE, DATA_FILE_BASE_PATH, full_dataset_csv_path, full_dataset_parquet_path, full_dataset_feather_path, rfm_csv_path, remove_parts
+
+# Shape of the shipped data, measured on the "Full Dataset of Cluster N" files
+SYNTHETIC_START = pd.Timestamp('2024-06-19')
+CASHBACK_RATE = 0.15  # Cashback is the floor of 15% of the amount, or nothing for provider 0
+NO_CASHBACK_PROVIDER_SHARE = 0.054
+USD_PER_YEN = 0.00643
+SPEND_LOG_STD = 0.42  # Spread of a cardholder's amounts around their own average, in log space
+CREATED_AT_LAG_SECONDS = [2, 3, 3, 3, 4]
+TRANSACTION_ID_PREFIXES = [304, 384, 464, 584]
+
+# Transactions per UTC hour of day across the shipped clusters (lunch in Japan peaks at 03:00 UTC)
+HOUR_WEIGHTS = [1067, 1468, 3391, 5480, 3590, 2208, 1600, 1410, 1966, 2907, 2458, 1970,
+                1378, 751, 399, 199, 99, 79, 61, 55, 203, 538, 1122, 1162]
+
+# (merchant_id, name, transactions) across the shipped clusters; repeated ids are split payments
+MERCHANTS = [
+    ('289', 'Mcdonalds', 15851), ('287', 'Sukiya', 7067), ('286', 'Nakau', 4291),
+    ('285', 'Katsuya', 3346), ('284', 'Mosburger', 3238), ('288', 'Karayama', 1277),
+    ('282', '24FTest', 202), ('289,289', 'Mcdonalds', 125), ('287,287', 'Sukiya', 41),
+    ('285,285', 'Katsuya', 36), ('284,284', 'Mosburger', 28), ('288,288', 'Karayama', 22),
+    ('286,286', 'Nakau', 21), ('283', 'McDonalds(Tokyo)', 7), ('282,282', '24FTest', 3),
+    ('286,286,286', 'Nakau', 3), ('283,283', 'McDonalds(Tokyo)', 2), ('284,284,284', 'Mosburger', 1),
+]
+CATEGORY = 'Restaurants'
+
+FULL_DATASET_SCHEMA = pa.schema([
+    ('cardholder_id', pa.string()),
+    ('program_provider_id', pa.int64()),
+    ('card_id', pa.string()),
+    ('external_user_id', pa.string()),
+    ('merchant_id', pa.string()),
+    ('name', pa.string()),
+    ('category', pa.string()),
+    ('transaction_id', pa.int64()),
+    ('transaction_date', pa.timestamp('s')),
+    ('authorized_amount', pa.float64()),
+    ('transaction_amount', pa.float64()),
+    ('authorized_amount_in_usd', pa.float64()),
+    ('cashback_amount', pa.float64()),
+    ('created_at', pa.timestamp('s')),
+    ('Recency', pa.float64()),
+    ('Frequency', pa.float64()),
+    ('Monetary', pa.float64()),
+    ('Cluster', pa.float64()),
+])
+
+# Parquet and Feather keep nanosecond dates, like the stores data_store converts to
+PARQUET_SCHEMA = pa.schema([
+    field.with_type(pa.timestamp('ns')) if pa.types.is_timestamp(field.type) else field for field in FULL_DATASET_SCHEMA
+])
+
+RFM_SCHEMA = pa.schema([
+    ('cardholder_id', pa.string()),
+    ('Recency', pa.int64()),
+    ('Frequency', pa.int64()),
+    ('Monetary', pa.float64()),
+])
+
+
+def random_uuids(rng: np.random.Generator, count: int) -> pa.Array:
+    """count random lowercase UUID strings, built without a Python-level loop."""
+    hex_digits = np.frombuffer(rng.bytes(16 * count).hex().encode(), dtype=np.uint8).reshape(count, 32)
+    uuids = np.full((count, 36), ord('-'), dtype=np.uint8)
+    for start, end, offset in [(0, 8, 0), (8, 12, 1), (12, 16, 2), (16, 20, 3), (20, 32, 4)]:
+        uuids[:, start + offset:end + offset] = hex_digits[:, start:end]
+    return pa.array(uuids.view('S36').ravel()).cast(pa.string())
+
+
+def sample_cardholders(profile: pd.DataFrame, rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Draw cardholders from the cluster's RFM profile until their transactions add up to exactly rows."""
+    frequency = profile['Frequency'].to_numpy(dtype=np.int64)
+    sampled = np.empty(0, dtype=np.int64)
+    total = 0
+    while total < rows:
+        more = rng.integers(0, len(profile), size=math.ceil((rows - total) / max(frequency.mean(), 1) * 1.1) + 1)
+        sampled = np.concatenate([sampled, more])
+        total += frequency[more].sum()
+
+    counts = np.maximum(frequency[sampled], 1)
+    cumulative = np.cumsum(counts)
+    keep = int(np.searchsorted(cumulative, rows)) + 1
+    counts = counts[:keep]
+    counts[-1] -= cumulative[keep - 1] - rows  # Trim the last cardholder to land on rows exactly
+    chosen = profile.iloc[sampled[:keep]]
+    return pd.DataFrame({
+        'Recency': chosen['Recency'].to_numpy(dtype=np.int64),
+        'Frequency': counts,
+        'Avg_Spend': (chosen['Monetary'] / chosen['Frequency'].clip(lower=1)).to_numpy(dtype=np.float64),
+    })
+
+
+def generate_chunk(profile: pd.DataFrame, selected_cluster: int, first_cardholder: int, rows: int, rng: np.random.Generator):
+    """Generate rows transactions for a fresh block of cardholders, plus the block's RFM rows."""
+    cardholders = sample_cardholders(profile, rows, rng)
+    frequency = cardholders['Frequency'].to_numpy()
+    recency = cardholders['Recency'].to_numpy()
+    owner = np.repeat(np.arange(len(cardholders)), frequency)
+    is_last = np.zeros(rows, dtype=bool)
+    is_last[np.cumsum(frequency) - 1] = True
+
+    # The last purchase falls on the Recency day; earlier ones are spread uniformly over the window
+    # before it, which gives the short, right-skewed inter-purchase gaps seen in the real data.
+    window_days = (RFM_REFERENCE_DATE - SYNTHETIC_START).days
+    last_day = np.clip(window_days - recency, 0, window_days)[owner]
+    day = np.where(is_last, last_day, np.floor(rng.random(rows) * (last_day + 1)))
+    hour = rng.choice(24, size=rows, p=np.array(HOUR_WEIGHTS) / sum(HOUR_WEIGHTS))
+    seconds = (day * 86_400 + hour * 3_600 + rng.integers(0, 3_600, size=rows)).astype(np.int64)
+    transaction_date = np.datetime64(SYNTHETIC_START, 's') + seconds.astype('timedelta64[s]')
+    created_at = transaction_date + rng.choice(CREATED_AT_LAG_SECONDS, size=rows).astype('timedelta64[s]')
+
+    avg_spend = cardholders['Avg_Spend'].to_numpy()[owner]
+    amount = np.maximum(np.round(rng.lognormal(np.log(avg_spend) - SPEND_LOG_STD**2 / 2, SPEND_LOG_STD) / 10) * 10, 10)
+    provider = np.where(rng.random(rows) < NO_CASHBACK_PROVIDER_SHARE, 0, 17)
+    cashback = np.where(provider == 17, np.floor(amount * CASHBACK_RATE), 0.0)
+    monetary = np.bincount(owner, weights=amount, minlength=len(cardholders))
+
+    merchant = rng.choice(len(MERCHANTS), size=rows, p=np.array([m[2] for m in MERCHANTS]) / sum(m[2] for m in MERCHANTS))
+    cardholder_ids = pc.binary_join_element_wise(
+        pa.array(np.arange(first_cardholder, first_cardholder + len(cardholders))).cast(pa.string()), str(selected_cluster), '_')
+    card_ids = random_uuids(rng, len(cardholders))
+    external_user_ids = pc.binary_join_element_wise(
+        'VOXJAPAN', pa.array(1_718_700_000_000 + rng.integers(0, 150_000_000, size=len(cardholders))).cast(pa.string()), '')
+    transaction_id = rng.choice(TRANSACTION_ID_PREFIXES, size=rows) * 10**12 + rng.integers(0, 10**12, size=rows)
+
+    # Real files are not ordered by cardholder or date
+    order = rng.permutation(rows)
+    owner_order = pa.array(owner[order])
+    columns = {
+        'cardholder_id': cardholder_ids.take(owner_order),
+        'program_provider_id': provider[order],
+        'card_id': card_ids.take(owner_order),
+        'external_user_id': external_user_ids.take(owner_order),
+        'merchant_id': pa.array([m[0] for m in MERCHANTS]).take(pa.array(merchant[order])),
+        'name': pa.array([m[1] for m in MERCHANTS]).take(pa.array(merchant[order])),
+        'category': pa.repeat(CATEGORY, rows),
+        'transaction_id': transaction_id[order],
+        'transaction_date': transaction_date[order],
+        'authorized_amount': amount[order],
+        'transaction_amount': amount[order],
+        'authorized_amount_in_usd': np.round(amount[order] * USD_PER_YEN, 2),
+        'cashback_amount': cashback[order],
+        'created_at': created_at[order],
+        'Recency': recency[owner[order]].astype(np.float64),
+        'Frequency': frequency[owner[order]].astype(np.float64),
+        'Monetary': monetary[owner[order]],
+        'Cluster': np.full(rows, float(selected_cluster)),
+    }
+    transactions = pa.table(columns, schema=FULL_DATASET_SCHEMA)
+    rfm = pa.table({
+        'cardholder_id': cardholder_ids, 'Recency': recency, 'Frequency': frequency, 'Monetary': monetary,
+    }, schema=RFM_SCHEMA)
+    return transactions, rfm
+
+
+def load_profile(selected_cluster: int, profile_path: str | None = None) -> pd.DataFrame:
+    """The cluster's shipped RFM table, whose rows are resampled as synthetic cardholders."""
+    return pd.read_csv(profile_path or rfm_csv_path(selected_cluster), usecols=['Recency', 'Frequency', 'Monetary'])
+
+
+def generate_cluster_dataset(selected_cluster: int, rows: int, root: str = '.', file_format: str = 'csv',
+                             chunk_rows: int = 2_000_000, seed: int = 0, overwrite: bool = False) -> list:
+    """Write a synthetic "Full Dataset of Cluster N" file and a matching rfm_cluster_N.csv under root.
+
+    Cardholders are drawn from the cluster's shipped RFM table, so frequency, recency and spend follow
+    the real distributions. Rows are generated and written chunk by chunk, so memory stays flat.
+    """
+    profile = load_profile(selected_cluster)
+    data_paths = {'csv': full_dataset_csv_path, 'parquet': full_dataset_parquet_path, 'feather': full_dataset_feather_path}
+    data_path = os.path.normpath(os.path.join(root, data_paths[file_format](selected_cluster)))
+    rfm_path = os.path.normpath(os.path.join(root, rfm_csv_path(selected_cluster)))
+    for path in (data_path, rfm_path):
+        if os.path.exists(path) and not overwrite:
+            raise FileExistsError(f"{path} already exists; pass overwrite=True (--overwrite) to replace it")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        remove_parts(path)
+
+    rng = np.random.default_rng(seed)
+    csv_options = pv.WriteOptions(quoting_style='needed')
+    data_schema = FULL_DATASET_SCHEMA if file_format == 'csv' else PARQUET_SCHEMA
+    if file_format == 'parquet':
+        data_writer = pq.ParquetWriter(data_path, data_schema, compression='zstd')
+    elif file_format == 'feather':
+        data_writer = pa.ipc.new_file(data_path, data_schema)
+    else:
+        data_writer = pv.CSVWriter(data_path, data_schema, write_options=csv_options)
+    rfm_writer = pv.CSVWriter(rfm_path, RFM_SCHEMA, write_options=csv_options)
+
+    first_cardholder = 0
+    try:
+        for start in range(0, rows, chunk_rows):
+            transactions, rfm = generate_chunk(profile, selected_cluster, first_cardholder, min(chunk_rows, rows - start), rng)
+            data_writer.write_table(transactions.cast(data_schema))
+            rfm_writer.write_table(rfm)
+            first_cardholder += len(rfm)
+    finally:
+        data_writer.close()
+        rfm_writer.close()
+    return [data_path, rfm_path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic cluster datasets that follow the shipped data's schema and distributions.")
+    parser.add_argument('--clusters', type=int, nargs='+', default=[0, 3])
+    parser.add_argument('--rows', type=float, default=1e6, help="Transactions per cluster (e.g. 1e8)")
+    parser.add_argument('--root', default='.', help=f"Directory the {DATA_FILE_BASE_PATH} layout is created under")
+    parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], default='csv')
+    parser.add_argument('--chunk-rows', type=int, default=2_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--overwrite', action='store_true', help="Replace existing files, including the shipped RFM tables")
+    args = parser.parse_args()
+
+    for selected_cluster in args.clusters:
+        started = time.perf_counter()
+        paths = generate_cluster_dataset(selected_cluster, int(args.rows), args.root, args.format,
+                                         args.chunk_rows, args.seed + selected_cluster, args.overwrite)
+        print(f"Cluster {selected_cluster}: {int(args.rows):,} rows in {time.perf_counter() - started:.1f} s -> {', '.join(paths)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import time
+
+# Stage timer shared by the benchmark and the RFM pipeline, so their timings mean the same thing
+
+
+def timed(timings: dict, stage: str, fn, *args, **kwargs):
+    """Call fn and record its wall time in seconds under timings[stage]."""
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timings[stage] = time.perf_counter() - started
+    return result
@@ -0,0 +1,147 @@
+import os
+import time
+import argparse
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from helpers.cache import cached_by_files
+from helpers.data_store import available_clusters, load_transactions, transactions_source_path, transactions_source_files
+from helpers.cardholders import load_cardholder_order, load_transaction_codes
+from helpers.merchants import load_merchant_index, merchant_rows
+
+WINDOW_DAYS = [7, 30, 90, 365]  # Windows the pickers offer besides the whole history
+ALL_HISTORY = "All history"  # Picker option that keeps every transaction
+
+# A cluster's transaction rows sorted by transaction_date (ties in file order), with their dates as
+# int64 nanoseconds at the same positions, so any "since" window is the tail order[start:].
+DateIndex = namedtuple('DateIndex', ['order', 'dates'])
+
+
+def build_date_index(transaction_dates) -> DateIndex:
+    """Sort transaction rows by date once; windows are then binary searches, not masks."""
+    dates = np.asarray(transaction_dates, dtype='datetime64[ns]').view('int64')
+    order = np.argsort(dates, kind='stable')
+    return DateIndex(order, dates[order])
+
+
+@cached_by_files(transactions_source_files)
+def load_date_index(selected_cluster: int) -> DateIndex:
+    """Date index of the selected cluster, built once per data file."""
+    return build_date_index(load_transactions(selected_cluster, columns=['transaction_date'])['transaction_date'].to_numpy())
+
+
+def reference_day(selected_cluster: int) -> pd.Timestamp:
+    """The day after the cluster's newest transaction, which windows count back from."""
+    return pd.Timestamp(load_date_index(selected_cluster).dates[-1]).normalize() + pd.Timedelta(days=1)
+
+
+def rfm_table_reference_day(selected_cluster: int) -> pd.Timestamp:
+    """The day Recency counts back from in the cluster's RFM table (RFM_REFERENCE_DATE until a batch is ingested)."""
+    from helpers.ingest import read_ingest_log, reference_date  # ingest builds on the aggregates this module feeds
+    return reference_date(selected_cluster, read_ingest_log())
+
+
+def recency_reference_day(selected_cluster: int) -> pd.Timestamp:
+    """The day Recency of a merchant or window slice counts back from.
+
+    That is the RFM table's own reference day, so slices compare with the whole-cluster figures,
+    unless the cluster has transactions after it (the shipped tables predate their newest week);
+    then it is the day after the newest transaction, so Recency never goes negative.
+    """
+    return max(rfm_table_reference_day(selected_cluster), reference_day(selected_cluster))
+
+
+def recency_note(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> str | None:
+    """A caption for pages showing a slice's Recency when it counts from another day than the RFM table."""
+    if merchant_id is None and window_days is None:
+        return None
+    recency_day, table_day = recency_reference_day(selected_cluster), rfm_table_reference_day(selected_cluster)
+    if recency_day == table_day:
+        return None
+    return (f"Recency for this merchant or date window counts back from {recency_day.date()}, the day after the cluster's newest "
+            f"transaction; the whole-cluster RFM table counts from {table_day.date()}, so the two are {(recency_day - table_day).days} days apart.")
+
+
+def window_start(selected_cluster: int, window_days: int) -> np.int64:
+    """First instant (int64 nanoseconds) of the last window_days days of the cluster's history."""
+    return np.int64((reference_day(selected_cluster) - pd.Timedelta(days=window_days)).value)
+
+
+def transaction_rows(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> np.ndarray:
+    """Row numbers of the cluster's transactions at merchant_id (default: any) in the last window_days days (default: all).
+
+    Each is a contiguous slice of the date or merchant index found by binary search.
+    Raises KeyError for a merchant with no transactions in the cluster.
+    """
+    since = None if window_days is None else window_start(selected_cluster, window_days)
+    if merchant_id is not None:
+        return merchant_rows(load_merchant_index(selected_cluster), merchant_id, since)
+    index = load_date_index(selected_cluster)
+    return index.order if since is None else index.order[int(np.searchsorted(index.dates, since, side='left')):]
+
+
+@cached_by_files(lambda selected_cluster, merchant_id=None, window_days=None: transactions_source_files(selected_cluster))
+def load_slice_rfm(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> pd.DataFrame:
+    """RFM of the cluster's cardholders from their purchases at one merchant and/or in the last window_days days.
+
+    Recency counts back from recency_reference_day, so every merchant and window of a cluster
+    shares one reference day.
+    """
+    from helpers.rfm_pipeline import coded_partial_rfm, finish_rfm  # rfm_pipeline builds on the loaders this module serves
+    rows = transaction_rows(selected_cluster, merchant_id, window_days)
+    codes = load_transaction_codes(selected_cluster)
+    order = load_cardholder_order()  # After the codes, which may intern new ids
+    transactions = load_transactions(selected_cluster, columns=['transaction_date', 'transaction_amount']).take(rows)
+    return finish_rfm(coded_partial_rfm(order.rank[codes[rows]], transactions, order.sorted_ids), recency_reference_day(selected_cluster))
+
+
+def has_transactions(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> bool:
+    """Whether the merchant (default: any) has any transaction in the cluster within the window.
+
+    False for clusters without a transactions file, so the pages warn instead of raising.
+    """
+    if not os.path.exists(transactions_source_path(selected_cluster)):
+        return False
+    try:
+        return len(transaction_rows(selected_cluster, merchant_id, window_days)) > 0
+    except KeyError:
+        return False
+
+
+def window_label(window_days: int | None) -> str:
+    return ALL_HISTORY if window_days is None else f"Last {window_days} days"
+
+
+def select_window(key: str = "window_days", container=None) -> int | None:
+    """A date-window picker over WINDOW_DAYS; None keeps the whole history."""
+    import streamlit as st  # Only the pages need it
+
+    window_days = (container or st).selectbox("Date window", [ALL_HISTORY, *WINDOW_DAYS],
+                                              format_func=lambda option: window_label(None if option == ALL_HISTORY else option), key=key)
+    return None if window_days == ALL_HISTORY else window_days
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index each cluster by transaction date and time the common windows, cold and cached.")
+    parser.add_argument('--clusters', type=int, nargs='+', help="Clusters to index (default: all with transactions)")
+    parser.add_argument('--merchant', help="Only this merchant's transactions (see python -m helpers.merchants)")
+    args = parser.parse_args()
+
+    from helpers.aggregates import load_cardholder_aggregates  # aggregates builds on this module
+    for selected_cluster in args.clusters or available_clusters():
+        started = time.perf_counter()
+        index = load_date_index(selected_cluster)
+        print(f"Cluster {selected_cluster}: {len(index.order):,} transactions up to {reference_day(selected_cluster).date()} (exclusive), "
+              f"indexed in {time.perf_counter() - started:.3f} s")
+        for window_days in [*WINDOW_DAYS, None]:
+            timings = []
+            for _ in range(2):
+                started = time.perf_counter()
+                aggregates = load_cardholder_aggregates(selected_cluster, args.merchant, window_days)
+                timings.append(time.perf_counter() - started)
+            print(f"  {window_label(window_days):<16} {aggregates['Transaction_Count'].sum():>10,} transactions "
+                  f"{len(aggregates):>8,} cardholders  {timings[0]:.4f} s, cached {timings[1]:.4f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 import streamlit as st
 import pandas as pd
 import math
-
-# Base path for data files
-data_file_base_path = './Data/cluster_calculation/hashed/'
+from helpers.aggregates import load_cardholder_aggregates
+from helpers.cache import cached_by_files
+from helpers.data_store import load_rfm, transactions_source_files
+from helpers.ranking import load_ranked_customers, top_customers as top_ranked_customers
+from helpers.formulas import cashback_budget_targeting
+from helpers.export import download_customers
+from helpers.preview import paginated_dataframe
+from helpers.compute_metrics import NO_CASHBACK_WARNING
+from helpers.merchants import select_merchant
+from helpers.windows import has_transactions, recency_note, select_window
 
 def render():
     st.image("./Data/assets/logo.png", width=200)  # Add your company logo here
@@ -60,16 +67,19 @@ def render():
     if selected_cluster is None:
         return
 
-    data_file_path = f"{data_file_base_path}rfm_cluster_{selected_cluster}.csv"
-    
-    avg_order_rounded, avg_cashback_rounded, cardholder_count = get_man_values(selected_cluster)
-    df = pd.read_csv(data_file_path)
+    st.markdown(f"<h4>Selected Cluster: {cluster_names[selected_cluster]}</h4>", unsafe_allow_html=True)
+    merchant_id = select_merchant([selected_cluster])
+    window_days = select_window()
+    if not has_transactions(selected_cluster, merchant_id, window_days):
+        st.warning("No transactions match the selected merchant and date window in this cluster.")
+        return
+
+    avg_order_rounded, avg_cashback_rounded, cardholder_count = get_man_values(selected_cluster, merchant_id, window_days)
+    df = load_rfm(selected_cluster, merchant_id, window_days)
     mean_monetary = avg_order_rounded
     avg_cashback = avg_cashback_rounded
     num_users = cardholder_count
 
-    st.markdown(f"<h4>Selected Cluster: {cluster_names[selected_cluster]}</h4>", unsafe_allow_html=True)
-
     recency = math.ceil(df['Recency'].mean())
     frequency = math.ceil(df['Frequency'].mean())
     monetory = math.floor(df['Monetary'].mean())
@@ -78,18 +88,23 @@ def render():
         st.subheader(f"Cluster {cluster_names[selected_cluster]} Summary Statistics")
         st.write(f"Number of Users: {num_users}")
         st.write(f"Average Recency: {recency} days")
+        note = recency_note(selected_cluster, merchant_id, window_days)
+        if note:
+            st.caption(note)
         st.write(f"Average Frequency: {frequency} transactions")
         st.write(f"Average Order Value: {mean_monetary:.2f} ¥")
         st.write(f"Average Monetary Value: {monetory:.2f} ¥")
         st.write(f"Average Cashback per User: {avg_cashback:.2f} ¥")
 
+    if avg_cashback == 0:
+        st.warning(NO_CASHBACK_WARNING)
+        return
+
     def calculate_cashback_budget_and_customers(revenue_target):
-        potential_cashback_budget = avg_cashback * num_users
-        max_possible_revenue = mean_monetary * num_users
+        cashback_budget_needed, num_customers_to_target, potential_cashback_budget, max_possible_revenue = cashback_budget_targeting(
+            revenue_target, mean_monetary, avg_cashback, num_users)
         if revenue_target < potential_cashback_budget:
             return None, f"Error: The revenue target must be at least {math.floor(potential_cashback_budget)} ¥ to cover the minimum cashback budget."
-        num_customers_to_target = min(revenue_target / mean_monetary, num_users)
-        cashback_budget_needed = num_customers_to_target * avg_cashback
         if num_customers_to_target == num_users and revenue_target > max_possible_revenue:
             return None, f"Error: The revenue target of {revenue_target} ¥ exceeds the maximum possible revenue ({math.floor(max_possible_revenue)} ¥) that can be generated from this cluster."
         return cashback_budget_needed, num_customers_to_target
@@ -116,7 +131,7 @@ def render():
         st.session_state.calculated = False
         if not st.session_state.calculated:
             result, error = calculate_cashback_budget_and_customers(revenue_target)
-            if result:
+            if result is not None:
                 st.session_state.cashback_budget, st.session_state.num_customers = result, error
                 st.session_state.error = None
                 st.session_state.calculated = True
@@ -132,86 +147,77 @@ def render():
             st.success(f"**Cashback Budget Needed:** {math.floor(cashback_budget):,.0f} ¥")
             st.success(f"**Number of Customers to Target:** {math.ceil(num_customers):,.0f} customers")
             
-            df = pd.read_csv(data_file_path)
-            top_customers = df.head(math.ceil(num_customers))
-            top_customers = top_customers.reset_index(drop=True)
-
-            st.subheader("Top Customers Preview")
-            st.dataframe(top_customers)
-
-            st.download_button(
-                label="📥 Download Top Customer Data as CSV",
-                data=top_customers.to_csv(index=True).encode('utf-8'),
-                file_name=f'top_customers_cluster_{selected_cluster}.csv',
-                mime='text/csv'
-            )
+            render_top_customers(selected_cluster, num_customers, merchant_id, window_days)
             
             if st.checkbox("Show and Adjust Sliders"):
-                adjusted_num_customers = st.slider("Adjust the number of customers to target:",
-                                                min_value=1, max_value=int(math.ceil(num_customers)), value=int(math.ceil(num_customers)))
-                adjusted_cashback_budget = math.floor(adjusted_num_customers * avg_cashback)
-                adjusted_target_revenue = math.floor(adjusted_num_customers * mean_monetary)
-                st.success(f"**Adjusted Cashback Budget:** {adjusted_cashback_budget:,.0f} ¥")
-                st.success(f"**Adjusted Target Revenue:** {adjusted_target_revenue:,.0f} ¥")
-                
-                df_sorted = df.sort_values(by='Monetary', ascending=False)
-                top_customers = df_sorted.head(int(adjusted_num_customers))
-                top_customers = top_customers.reset_index(drop=True)
-
-                st.subheader("Adjusted Top Customers Preview")
-                st.dataframe(top_customers)
-                
-                st.download_button(
-                    label="Download Top Customer Data as CSV",
-                    data=top_customers.to_csv(index=True).encode('utf-8'),
-                    file_name=f'top_customers_cluster_{selected_cluster}.csv',
-                    mime='text/csv',
-                    key="download_selected"
-                )
+                render_customer_slider(selected_cluster, num_customers, avg_cashback, mean_monetary, merchant_id, window_days)
                 
                 st.markdown("---")
                 
-                adjusted_cashback_amount = st.slider("Adjust the cashback amount (total):",
-                                                    min_value=0.0, max_value=cashback_budget, value=cashback_budget)
-                final_num_customers = math.ceil(adjusted_cashback_amount / avg_cashback)
-                final_target_revenue = math.floor(final_num_customers * mean_monetary)
-                st.success(f"**Final Number of Customers to Target:**  {final_num_customers:.0f} customers")
-                st.success(f"**Final Adjusted Target Revenue:** {final_target_revenue:,.0f} ¥")
-                
-                df_sorted = df.sort_values('Monetary', ascending=False)
-                top_customers = df_sorted.head(int(final_num_customers))
-                top_customers = top_customers.reset_index(drop=True)
-                
-                st.subheader("Final Adjusted Top Customers Preview")
-                st.dataframe(top_customers)
-
-                st.download_button(
-                    label="Download Top Customer Data as CSV",
-                    data=top_customers.to_csv(index=True).encode('utf-8'),
-                    file_name=f'top_customers_cluster_{selected_cluster}.csv',
-                    mime='text/csv',
-                    key="button_cashback"
-                )
+                render_cashback_slider(selected_cluster, cashback_budget, avg_cashback, mean_monetary, merchant_id, window_days)
+    
+
+# Fragments: paging, exporting or moving a slider reruns only that section, not the page above it
+@st.fragment
+def render_top_customers(selected_cluster, num_customers, merchant_id=None, window_days=None):
+    df = load_rfm(selected_cluster, merchant_id, window_days)
+    top_customers = df.head(math.ceil(num_customers))
+    top_customers = top_customers.reset_index(drop=True)
+
+    st.subheader("Top Customers Preview")
+    paginated_dataframe(top_customers, key="preview_top")
+
+    download_customers("📥 Download Top Customer Data", selected_cluster, math.ceil(num_customers),
+                       f'top_customers_cluster_{selected_cluster}', key="download_top", source='rfm', merchant_id=merchant_id, window_days=window_days)
+
+
+@st.fragment
+def render_customer_slider(selected_cluster, num_customers, avg_cashback, mean_monetary, merchant_id=None, window_days=None):
+    ranked = load_ranked_customers(selected_cluster, merchant_id, window_days)
+    adjusted_num_customers = st.slider("Adjust the number of customers to target:",
+                                    min_value=1, max_value=int(math.ceil(num_customers)), value=int(math.ceil(num_customers)))
+    adjusted_cashback_budget = math.floor(adjusted_num_customers * avg_cashback)
+    adjusted_target_revenue = math.floor(adjusted_num_customers * mean_monetary)
+    st.success(f"**Adjusted Cashback Budget:** {adjusted_cashback_budget:,.0f} ¥")
+    st.success(f"**Adjusted Target Revenue:** {adjusted_target_revenue:,.0f} ¥")
     
+    top_customers = top_ranked_customers(ranked, int(adjusted_num_customers))
 
-def get_man_values(selected_cluster):
-    path = f'./Data/cluster_calculation/hashed/Full Dataset of Cluster {selected_cluster}.csv'
-    df = pd.read_csv(path)
+    st.subheader("Adjusted Top Customers Preview")
+    paginated_dataframe(top_customers, key="preview_selected")
+    
+    download_customers("Download Top Customer Data", selected_cluster, int(adjusted_num_customers),
+                       f'top_customers_cluster_{selected_cluster}', key="download_selected", merchant_id=merchant_id, window_days=window_days)
+
+
+@st.fragment
+def render_cashback_slider(selected_cluster, cashback_budget, avg_cashback, mean_monetary, merchant_id=None, window_days=None):
+    ranked = load_ranked_customers(selected_cluster, merchant_id, window_days)
+    adjusted_cashback_amount = st.slider("Adjust the cashback amount (total):",
+                                        min_value=0.0, max_value=cashback_budget, value=cashback_budget)
+    final_num_customers = math.ceil(adjusted_cashback_amount / avg_cashback)
+    final_target_revenue = math.floor(final_num_customers * mean_monetary)
+    st.success(f"**Final Number of Customers to Target:**  {final_num_customers:.0f} customers")
+    st.success(f"**Final Adjusted Target Revenue:** {final_target_revenue:,.0f} ¥")
+    
+    top_customers = top_ranked_customers(ranked, int(final_num_customers))
     
-    grouped = df.groupby('cardholder_id').agg(
-        Total_Transaction_Value=('transaction_amount', 'sum'),
-        Total_Cashback_Value=('cashback_amount', 'sum'),
-        Transaction_Count=('transaction_amount', 'count')
-    ).reset_index()
+    st.subheader("Final Adjusted Top Customers Preview")
+    paginated_dataframe(top_customers, key="preview_cashback")
+
+    download_customers("Download Top Customer Data", selected_cluster, int(final_num_customers),
+                       f'top_customers_cluster_{selected_cluster}', key="button_cashback", merchant_id=merchant_id, window_days=window_days)
+
 
-    grouped['Avg_Transaction_Value'] = grouped['Total_Transaction_Value'] / grouped['Transaction_Count']
-    grouped['Avg_Cashback_Value'] = grouped['Total_Cashback_Value'] / grouped['Transaction_Count']
+@cached_by_files(lambda selected_cluster, merchant_id=None, window_days=None: transactions_source_files(selected_cluster))
+def get_man_values(selected_cluster, merchant_id=None, window_days=None):
+    grouped = load_cardholder_aggregates(selected_cluster, merchant_id, window_days)
 
     avg_order = grouped['Avg_Transaction_Value'].mean()
     avg_cashback = grouped['Avg_Cashback_Value'].mean()
 
     avg_order_rounded = math.floor(avg_order)
     avg_cashback_rounded = math.floor(avg_cashback)
-    cardholder_count = grouped['cardholder_id'].nunique()
+    cardholder_count = len(grouped)
 
     return avg_order_rounded, avg_cashback_rounded, cardholder_count
\ No newline at end of file
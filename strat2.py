@@ -1,27 +1,24 @@
 import streamlit as st
 import pandas as pd
-from tabulate import tabulate
 import math
 import numpy as np
+from helpers.aggregates import load_cardholder_aggregates
+from helpers.ranking import load_net_value_index, select_for_revenue_target, max_net_value
+from helpers.formulas import average_order_targeting, whole_numbers
+from helpers.preview import paginated_dataframe
+from helpers.data_store import available_clusters
+from helpers.merchants import has_merchant, select_merchant
+from helpers.windows import has_transactions, select_window, window_label
 
 def calculate_targets(current_sales, percentage_increase):
     targets_need_to_achieve = current_sales * (1 + percentage_increase / 100)
     revenue_target = math.floor(targets_need_to_achieve)  # Floor the revenue target
     return targets_need_to_achieve, revenue_target
 
-def compute_metrics(df, current_sales, percentage_increase):
+def compute_metrics(grouped, current_sales, percentage_increase):
     targets_need_to_achieve = current_sales * (1 + percentage_increase / 100)
     revenue_target = math.floor(targets_need_to_achieve)  # Floor the revenue target
 
-    grouped = df.groupby('cardholder_id').agg(
-        Total_Transaction_Value=('transaction_amount', 'sum'),
-        Total_Cashback_Value=('cashback_amount', 'sum'),
-        Transaction_Count=('transaction_amount', 'count')
-    ).reset_index()
-
-    grouped['Avg_Transaction_Value'] = grouped['Total_Transaction_Value'] / grouped['Transaction_Count']
-    grouped['Avg_Cashback_Value'] = grouped['Total_Cashback_Value'] / grouped['Transaction_Count']
-
     avg_order = grouped['Avg_Transaction_Value'].mean()
     avg_cashback = grouped['Avg_Cashback_Value'].mean()
 
@@ -31,12 +28,8 @@ def compute_metrics(df, current_sales, percentage_increase):
     avg_cashback_rounded = math.floor(avg_cashback)  # Floor the average cashback value
     cashback_percentage_rounded = round(cashback_percentage, 2)
 
-    no_of_customers_to_target = revenue_target / (avg_order_rounded - avg_cashback_rounded)
-    no_of_customers_to_target_rounded = math.ceil(no_of_customers_to_target)  # Always round up
-
-    cashback_budget = no_of_customers_to_target_rounded * avg_cashback_rounded
-    target_achieve = no_of_customers_to_target_rounded * avg_order_rounded
-    profit = target_achieve - cashback_budget
+    no_of_customers_to_target_rounded, cashback_budget, target_achieve, profit = whole_numbers(
+        *average_order_targeting(revenue_target, avg_order, avg_cashback))  # Customers always rounded up
 
     sum_of_avg_transaction_values = grouped['Avg_Transaction_Value'].sum()
     p_condition = sum_of_avg_transaction_values < revenue_target
@@ -48,7 +41,7 @@ def compute_metrics(df, current_sales, percentage_increase):
     col1, col2 = st.columns(2)
     with col1:
         st.subheader("Data")
-        st.write(f"**No of Customers in Cluster:** {grouped['cardholder_id'].nunique()}")
+        st.write(f"**No of Customers in Cluster:** {len(grouped)}")
         st.write(f"**Avg Order:** {avg_order_rounded}")
         st.write(f"**Avg Cashback:** {avg_cashback_rounded}")
         st.write(f"**Cashback %:** {cashback_percentage_rounded}%")
@@ -71,7 +64,7 @@ def compute_metrics(df, current_sales, percentage_increase):
     top_customers = grouped.sort_values(by='Avg_Transaction_Value', ascending=False).head(no_of_customers_to_target_rounded)
 
     st.subheader("Selected Cardholders")
-    st.dataframe(top_customers[['cardholder_id', 'Avg_Transaction_Value', 'Avg_Cashback_Value']].reset_index(drop=True))        
+    paginated_dataframe(top_customers[['cardholder_id', 'Avg_Transaction_Value', 'Avg_Cashback_Value']].reset_index(drop=True), key="preview_estimate")
 
     sum_avg_transaction = math.floor(top_customers['Avg_Transaction_Value'].sum())  # Floor the sum of avg transaction values
     sum_avg_cashback = math.floor(top_customers['Avg_Cashback_Value'].sum())  # Floor the sum of avg cashback values
@@ -92,12 +85,39 @@ def compute_metrics(df, current_sales, percentage_increase):
     else:
         st.error(f"Sorry, we cannot achieve the target with the top {no_of_customers_to_target_rounded} customers based on highest Avg Transaction Value.")
 
+def compute_exact_selection(index, revenue_target):
+    selection = select_for_revenue_target(index, revenue_target)
+
+    if selection is None:
+        st.header("⚠️ Target Not Achievable")
+        st.error(f" **Problem:** The maximum achievable net revenue in this customer segment is **{math.floor(max_net_value(index)):,.0f} ¥**")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Data")
+        st.write(f"**Customers with Positive Net Value:** {len(index.cardholders):,}")
+        st.write(f"**Maximum Achievable Net Revenue:** {math.floor(max_net_value(index)):,.0f} ¥")
+    with col2:
+        st.subheader("Metrics Outputs")
+        st.write(f"**No of Customers to Target:** {selection.num_customers:,} (Exact)")
+        st.write(f"**Cashback Budget:** {math.floor(selection.cashback_budget):,.0f} ¥")
+        st.write(f"**Net Revenue from Selected:** `( Avg Transaction - Avg Cashback )` {math.floor(selection.net_value):,.0f} ¥")
+
+    st.success(f"The top {selection.num_customers:,} cardholders by net value are the smallest set that reaches the target of {revenue_target:,.0f} ¥.")
+
+    st.subheader("Selected Cardholders")
+    paginated_dataframe(selection.cardholders, key="preview_exact")
+
 def render():
     st.title("Cluster-Based Revenue Increase Strategy")
     st.markdown("This app analyzes transaction data to identify potential customer clusters for achieving revenue targets.")
 
     current_sales = st.sidebar.number_input("Enter Current Sales:", min_value=0, value=10000)
     percentage_increase = st.sidebar.number_input("Enter Percentage Increase:", min_value=0, max_value=100, value=20)
+    selection_mode = st.sidebar.radio("Customer Selection:", ["Estimate from Cluster Averages", "Exact Minimal Set"])
+    merchant_id = select_merchant(available_clusters(), container=st.sidebar)
+    window_days = select_window(container=st.sidebar)
 
     targets_need_to_achieve, revenue_target = calculate_targets(current_sales, percentage_increase)
 
@@ -111,7 +131,6 @@ def render():
     st.markdown("## Select the cluster")
 
     cluster_names = ['Loyal High Spenders', 'At-Risk Low Spenders', 'Top VIPs', 'New or Infrequent Shoppers', 'Occasional Bargain Seekers']
-    files = [f'./Data/cluster_calculation/hashed/Full Dataset of Cluster {i}.csv' for i in range(5)]
 
     st.markdown("""
         <style>
@@ -127,35 +146,43 @@ def render():
         </style>
         """, unsafe_allow_html=True)
 
-    selected_cluster = None
+    # Kept across reruns, so paging or sorting the previews below does not drop the results
+    selected_cluster = st.session_state.get('strat2_cluster')
     col1, col2, col3, col4, col5 = st.columns(5)
 
     with col1:
         if st.button('Loyal High Spenders'):
-            selected_cluster = cluster_names[0]
+            selected_cluster = st.session_state.strat2_cluster = cluster_names[0]
 
     with col2:
         if st.button('At-Risk Low Spenders'):
-            selected_cluster = cluster_names[1]
+            selected_cluster = st.session_state.strat2_cluster = cluster_names[1]
 
     with col3:
         if st.button('Top VIPs'):
-            selected_cluster = cluster_names[2]
+            selected_cluster = st.session_state.strat2_cluster = cluster_names[2]
 
     with col4:
         if st.button('New or Infrequent Shoppers'):
-            selected_cluster = cluster_names[3]
+            selected_cluster = st.session_state.strat2_cluster = cluster_names[3]
 
     with col5:
         if st.button('Occasional Bargain Seekers'):
-            selected_cluster = cluster_names[4]
+            selected_cluster = st.session_state.strat2_cluster = cluster_names[4]
 
     if selected_cluster:
         file_index = cluster_names.index(selected_cluster)
-        file = files[file_index]
 
         st.markdown(f"## Using {selected_cluster}")
-        df = pd.read_csv(file)
-        
-        compute_metrics(df, current_sales, percentage_increase)
+        if merchant_id is not None and not has_merchant(file_index, merchant_id):
+            st.warning(f"Merchant {merchant_id} has no transactions in this cluster.")
+            return
+        if not has_transactions(file_index, merchant_id, window_days):
+            st.warning(f"No matching transactions in this cluster in the {window_label(window_days).lower()}.")
+            return
+        if selection_mode == "Exact Minimal Set":
+            compute_exact_selection(load_net_value_index(file_index, merchant_id, window_days), revenue_target)
+        else:
+            grouped = load_cardholder_aggregates(file_index, merchant_id, window_days)
+            compute_metrics(grouped, current_sales, percentage_increase)
         st.markdown("---")
\ No newline at end of file
@@ -1,32 +1,24 @@
 import streamlit as st
 import pandas as pd
-from tabulate import tabulate
 import math
 import numpy as np
+from helpers.aggregates import load_cardholder_aggregates
+from helpers.intervals import load_interval_stats, average_transaction_duration, has_repeat_purchases
+from helpers.formulas import transaction_duration_targeting, whole_numbers
+from helpers.preview import paginated_dataframe
+from helpers.data_store import available_clusters
+from helpers.merchants import has_merchant, select_merchant
+from helpers.windows import has_transactions, select_window, window_label
 
 def calculate_targets(current_sales, percentage_increase):
     targets_need_to_achieve = current_sales * (1 + percentage_increase / 100)
     revenue_target = math.floor(targets_need_to_achieve)  # Floor the revenue target
     return targets_need_to_achieve, revenue_target
 
-def compute_metrics(df, current_sales, percentage_increase):
+def compute_metrics(grouped, intervals, current_sales, percentage_increase):
     revenue_target = math.floor(current_sales * (1 + percentage_increase / 100))  # Floor the revenue target
 
-    df['transaction_date'] = pd.to_datetime(df['transaction_date'])
-    df = df.sort_values(by=['cardholder_id', 'transaction_date'])
-    df['transaction_duration'] = df.groupby('cardholder_id')['transaction_date'].diff().dt.days
-    avg_duration_per_user = df.groupby('cardholder_id')['transaction_duration'].mean()
-
-    avg_transaction_duration = math.ceil(avg_duration_per_user.mean())  
-
-    grouped = df.groupby('cardholder_id').agg(
-        Total_Transaction_Value=('transaction_amount', 'sum'),
-        Total_Cashback_Value=('cashback_amount', 'sum'),
-        Transaction_Count=('transaction_amount', 'count')
-    ).reset_index()
-
-    grouped['Avg_Transaction_Value'] = grouped['Total_Transaction_Value'] / grouped['Transaction_Count']
-    grouped['Avg_Cashback_Value'] = grouped['Total_Cashback_Value'] / grouped['Transaction_Count']
+    avg_transaction_duration = average_transaction_duration(intervals)
 
     avg_order = grouped['Avg_Transaction_Value'].mean()
     avg_cashback = grouped['Avg_Cashback_Value'].mean()
@@ -41,13 +33,12 @@ def compute_metrics(df, current_sales, percentage_increase):
         st.error("Please choose another cluster or adjust the target.")
         return
 
-    no_of_customers_to_target = math.ceil(revenue_target / (avg_order - avg_cashback))
-    daily_revenue_per_customer = math.floor((avg_order - avg_cashback) / avg_transaction_duration)  # Floor the daily revenue per customer
-    total_daily_revenue = math.floor(no_of_customers_to_target * daily_revenue_per_customer)  # Floor the total daily revenue
-    days_to_achieve_target = math.ceil(revenue_target / total_daily_revenue)  # Ceil the days to achieve the target
+    # Customers and days are rounded up, daily revenues are floored
+    no_of_customers_to_target, daily_revenue_per_customer, total_daily_revenue, days_to_achieve_target = whole_numbers(
+        *transaction_duration_targeting(revenue_target, avg_order, avg_cashback, avg_transaction_duration))
 
     st.subheader("Data")
-    st.write(f"**No of Customers in Cluster:** {grouped['cardholder_id'].nunique():,}")
+    st.write(f"**No of Customers in Cluster:** {len(grouped):,}")
     st.write(f"**Avg Order:** {math.floor(avg_order):,} ¥")  # Floor the average order value
     st.write(f"**Avg Cashback:** {math.floor(avg_cashback):,} ¥")  # Floor the average cashback value
     st.write(f"**Cashback %:** {round(cashback_percentage)}%")  # Rounded to nearest whole number
@@ -67,7 +58,7 @@ def compute_metrics(df, current_sales, percentage_increase):
     top_customers = grouped.sort_values(by='Avg_Transaction_Value', ascending=False).head(no_of_customers_to_target)
 
     st.subheader("Selected Cardholders")
-    st.dataframe(top_customers[['cardholder_id', 'Avg_Transaction_Value', 'Avg_Cashback_Value']].reset_index(drop=True))
+    paginated_dataframe(top_customers[['cardholder_id', 'Avg_Transaction_Value', 'Avg_Cashback_Value']].reset_index(drop=True), key="preview_duration")
 
     sum_avg_transaction = math.floor(top_customers['Avg_Transaction_Value'].sum())  # Floor the sum of avg transaction values
     sum_avg_cashback = math.floor(top_customers['Avg_Cashback_Value'].sum())  # Floor the sum of avg cashback values
@@ -88,6 +79,8 @@ def render():
 
     current_sales = st.sidebar.number_input("Enter Current Sales:", min_value=0, value=10000)
     percentage_increase = st.sidebar.number_input("Enter Percentage Increase:", min_value=0, max_value=100, value=20)
+    merchant_id = select_merchant(available_clusters(), container=st.sidebar)
+    window_days = select_window(container=st.sidebar)
 
     targets_need_to_achieve, revenue_target = calculate_targets(current_sales, percentage_increase)
 
@@ -101,7 +94,6 @@ def render():
     st.markdown("## Select the cluster")
 
     cluster_names = ['Loyal High Spenders', 'At-Risk Low Spenders', 'Top VIPs', 'New or Infrequent Shoppers', 'Occasional Bargain Seekers']
-    files = [f'./Data/cluster_calculation/hashed/Full Dataset of Cluster {i}.csv' for i in range(5)]
 
     st.markdown("""
         <style>
@@ -117,35 +109,45 @@ def render():
         </style>
         """, unsafe_allow_html=True)
 
-    selected_cluster = None
+    # Kept across reruns, so paging or sorting the previews below does not drop the results
+    selected_cluster = st.session_state.get('strat3_cluster')
     col1, col2, col3, col4, col5 = st.columns(5)
 
     with col1:
         if st.button('Loyal High Spenders'):
-            selected_cluster = cluster_names[0]
+            selected_cluster = st.session_state.strat3_cluster = cluster_names[0]
 
     with col2:
         if st.button('At-Risk Low Spenders'):
-            selected_cluster = cluster_names[1]
+            selected_cluster = st.session_state.strat3_cluster = cluster_names[1]
 
     with col3:
         if st.button('Top VIPs'):
-            selected_cluster = cluster_names[2]
+            selected_cluster = st.session_state.strat3_cluster = cluster_names[2]
 
     with col4:
         if st.button('New or Infrequent Shoppers'):
-            selected_cluster = cluster_names[3]
+            selected_cluster = st.session_state.strat3_cluster = cluster_names[3]
 
     with col5:
         if st.button('Occasional Bargain Seekers'):
-            selected_cluster = cluster_names[4]
+            selected_cluster = st.session_state.strat3_cluster = cluster_names[4]
 
     if selected_cluster:
         file_index = cluster_names.index(selected_cluster)
-        file = files[file_index]
 
         st.markdown(f"## Using {selected_cluster}")
-        df = pd.read_csv(file)
-
-        compute_metrics(df, current_sales, percentage_increase)
+        if merchant_id is not None and not has_merchant(file_index, merchant_id):
+            st.warning(f"Merchant {merchant_id} has no transactions in this cluster.")
+            return
+        if not has_transactions(file_index, merchant_id, window_days):
+            st.warning(f"No matching transactions in this cluster in the {window_label(window_days).lower()}.")
+            return
+        grouped = load_cardholder_aggregates(file_index, merchant_id, window_days)
+        intervals = load_interval_stats(file_index, merchant_id, window_days)
+        if not has_repeat_purchases(intervals):
+            st.warning("No cardholder bought twice in this cluster at the selected merchant and date window, so there is no transaction duration to plan with.")
+            return
+
+        compute_metrics(grouped, intervals, current_sales, percentage_increase)
         st.markdown("---")
\ No newline at end of file
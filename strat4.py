@@ -2,40 +2,24 @@ import streamlit as st
 import pandas as pd
 import math
 import numpy as np
+from helpers.aggregates import load_cardholder_aggregates
+from helpers.intervals import load_interval_stats, average_transaction_duration, has_repeat_purchases
+from helpers.formulas import deadline_targeting, whole_numbers
+from helpers.preview import paginated_dataframe
+from helpers.data_store import available_clusters
+from helpers.merchants import has_merchant, select_merchant
+from helpers.windows import has_transactions, select_window, window_label
 
 def calculate_targets(current_sales, percentage_increase):
     revenue_target = math.floor(current_sales * (1 + percentage_increase / 100))  # Floor the revenue target
     return revenue_target
 
-def compute_metrics(df, current_sales, percentage_increase, required_days_to_achieve_target):
+def compute_metrics(grouped, intervals, current_sales, percentage_increase, required_days_to_achieve_target):
     # Calculate the new revenue target by increasing the current sales by the given percentage
     revenue_target = math.floor(current_sales * (1 + percentage_increase / 100))  # Floor the revenue target
 
-    # Convert transaction_date to datetime format if it's not already
-    df['transaction_date'] = pd.to_datetime(df['transaction_date'])
-
-    # Sort by cardholder_id and transaction_date
-    df = df.sort_values(by=['cardholder_id', 'transaction_date'])
-
-    # Calculate the difference in days between consecutive transactions for each user
-    df['transaction_duration'] = df.groupby('cardholder_id')['transaction_date'].diff().dt.days
-
-    # Calculate the average transaction duration for each user
-    avg_duration_per_user = df.groupby('cardholder_id')['transaction_duration'].mean()
-
-    # Calculate the overall average transaction duration for the cluster
-    avg_transaction_duration = math.ceil(avg_duration_per_user.mean())  # Ceil the average transaction duration
-
-    # Group by cardholder_id and calculate total transaction and cashback values
-    grouped = df.groupby('cardholder_id').agg(
-        Total_Transaction_Value=('transaction_amount', 'sum'),
-        Total_Cashback_Value=('cashback_amount', 'sum'),
-        Transaction_Count=('transaction_amount', 'count')
-    ).reset_index()
-
-    # Calculate average transaction value and cashback per user
-    grouped['Avg_Transaction_Value'] = grouped['Total_Transaction_Value'] / grouped['Transaction_Count']
-    grouped['Avg_Cashback_Value'] = grouped['Total_Cashback_Value'] / grouped['Transaction_Count']
+    # Calculate the overall average transaction duration for the cluster from the per-user mean gaps
+    avg_transaction_duration = average_transaction_duration(intervals)  # Ceil the average transaction duration
 
     avg_order = grouped['Avg_Transaction_Value'].mean()
     avg_cashback = grouped['Avg_Cashback_Value'].mean()
@@ -50,11 +34,11 @@ def compute_metrics(df, current_sales, percentage_increase, required_days_to_ach
         st.error("Please choose another cluster or adjust the target.")
         return
 
-    # Calculate Daily Revenue per Customer
-    daily_revenue_per_customer = math.floor((avg_order - avg_cashback) / avg_transaction_duration)  # Floor the daily revenue per customer
-
-    # Calculate the maximum possible revenue within the required days
-    max_possible_revenue_within_days = math.floor(daily_revenue_per_customer * required_days_to_achieve_target * len(grouped))  # Floor the maximum possible revenue within days
+    # Calculate Daily Revenue per Customer, the maximum possible revenue within the required days,
+    # the number of customers to target, their total daily revenue and the days to achieve the target
+    (daily_revenue_per_customer, max_possible_revenue_within_days, no_of_customers_to_target,
+     total_daily_revenue, days_to_achieve_target) = whole_numbers(*deadline_targeting(
+        revenue_target, avg_order, avg_cashback, avg_transaction_duration, required_days_to_achieve_target, len(grouped)))
 
     # Check if the revenue target can be achieved within the required days
     if max_possible_revenue_within_days < revenue_target:
@@ -63,14 +47,6 @@ def compute_metrics(df, current_sales, percentage_increase, required_days_to_ach
         st.error("Please choose another cluster or adjust the target.")
         return
 
-    # Calculate the number of customers to target to achieve the revenue target within the required days
-    no_of_customers_to_target = math.ceil(revenue_target / (daily_revenue_per_customer * required_days_to_achieve_target))
-
-    # Calculate Total Daily Revenue from All Targeted Customers
-    total_daily_revenue = math.floor(no_of_customers_to_target * daily_revenue_per_customer)  # Floor the total daily revenue
-
-    # Calculate Days to Achieve Target
-    days_to_achieve_target = math.ceil(revenue_target / total_daily_revenue)  # Ceil the days to achieve the target
     cashback_percentage = (avg_cashback / avg_order) * 100  
     # Custom CSS to style the metrics
     st.markdown("""
@@ -105,7 +81,7 @@ def compute_metrics(df, current_sales, percentage_increase, required_days_to_ach
         </div>
         """
     with st.expander(f"Summary Statistics of the cluster"):
-        st.write(f"**No of Customers in Cluster:** {grouped['cardholder_id'].nunique():,}")
+        st.write(f"**No of Customers in Cluster:** {len(grouped):,}")
         st.write(f"**Avg Order:** {math.floor(avg_order):,} ¥")  # Floor the average order value
         st.write(f"**Avg Cashback:** {math.floor(avg_cashback):,} ¥")  # Floor the average cashback value
         st.write(f"**Cashback %:** {round(cashback_percentage)}%")  # Rounded to nearest whole number
@@ -166,7 +142,7 @@ def compute_metrics(df, current_sales, percentage_increase, required_days_to_ach
     top_customers = grouped.sort_values(by='Avg_Transaction_Value', ascending=False).head(no_of_customers_to_target)
 
     st.subheader("Selected Cardholders")
-    st.dataframe(top_customers[['cardholder_id', 'Avg_Transaction_Value', 'Avg_Cashback_Value']].reset_index(drop=True))
+    paginated_dataframe(top_customers[['cardholder_id', 'Avg_Transaction_Value', 'Avg_Cashback_Value']].reset_index(drop=True), key="preview_deadline")
 
     sum_avg_transaction = math.floor(top_customers['Avg_Transaction_Value'].sum())  # Floor the sum of avg transaction values
     sum_avg_cashback = math.floor(top_customers['Avg_Cashback_Value'].sum())  # Floor the sum of avg cashback values
@@ -190,6 +166,8 @@ def render():
     current_sales = st.sidebar.number_input("Enter Current Sales:", min_value=0, value=10000)
     percentage_increase = st.sidebar.number_input("Enter Percentage Increase:", min_value=0, max_value=100, value=20)
     required_days_to_achieve_target = math.ceil(st.sidebar.number_input("Enter Days to Achieve Target:", min_value=1, value=10))  # Ceil the days to achieve target
+    merchant_id = select_merchant(available_clusters(), container=st.sidebar)
+    window_days = select_window(container=st.sidebar)
 
     # Calculate and display merchant inputs
     revenue_target = calculate_targets(current_sales, percentage_increase)
@@ -205,39 +183,48 @@ def render():
     st.markdown("## Select the cluster")
 
     cluster_names = ['Loyal High Spenders', 'At-Risk Low Spenders', 'Top VIPs', 'New or Infrequent Shoppers', 'Occasional Bargain Seekers']
-    files = [f'./Data/cluster_calculation/hashed/Full Dataset of Cluster {i}.csv' for i in range(5)]
 
-    selected_cluster = None
+    # Kept across reruns, so paging or sorting the previews below does not drop the results
+    selected_cluster = st.session_state.get('strat4_cluster')
     col1, col2, col3, col4, col5 = st.columns(5)
 
     with col1:
         if st.button('Loyal High Spenders'):
-            selected_cluster = cluster_names[0]
+            selected_cluster = st.session_state.strat4_cluster = cluster_names[0]
 
     with col2:
         if st.button('At-Risk Low Spenders'):
-            selected_cluster = cluster_names[1]
+            selected_cluster = st.session_state.strat4_cluster = cluster_names[1]
 
     with col3:
         if st.button('Top VIPs'):
-            selected_cluster = cluster_names[2]
+            selected_cluster = st.session_state.strat4_cluster = cluster_names[2]
 
     with col4:
         if st.button('New or Infrequent Shoppers'):
-            selected_cluster = cluster_names[3]
+            selected_cluster = st.session_state.strat4_cluster = cluster_names[3]
 
     with col5:
         if st.button('Occasional Bargain Seekers'):
-            selected_cluster = cluster_names[4]
+            selected_cluster = st.session_state.strat4_cluster = cluster_names[4]
 
     if selected_cluster:
         file_index = cluster_names.index(selected_cluster)
-        file = files[file_index]
 
         st.markdown(f"## Using {selected_cluster}")
-        df = pd.read_csv(file)
-
-        compute_metrics(df, current_sales, percentage_increase, required_days_to_achieve_target)
+        if merchant_id is not None and not has_merchant(file_index, merchant_id):
+            st.warning(f"Merchant {merchant_id} has no transactions in this cluster.")
+            return
+        if not has_transactions(file_index, merchant_id, window_days):
+            st.warning(f"No matching transactions in this cluster in the {window_label(window_days).lower()}.")
+            return
+        grouped = load_cardholder_aggregates(file_index, merchant_id, window_days)
+        intervals = load_interval_stats(file_index, merchant_id, window_days)
+        if not has_repeat_purchases(intervals):
+            st.warning("No cardholder bought twice in this cluster at the selected merchant and date window, so there is no transaction duration to plan with.")
+            return
+
+        compute_metrics(grouped, intervals, current_sales, percentage_increase, required_days_to_achieve_target)
         st.markdown("---")
 
 # Run the Streamlit app
@@ -2,35 +2,30 @@ import streamlit as st
 import pandas as pd
 import math
 from helpers.compute_metrics import custom_metric
-from helpers.compute_metrics import CLUSTER_NAMES
+from helpers.compute_metrics import CLUSTER_NAMES, NO_CASHBACK_WARNING
+from helpers.cache import cached_by_files
+from helpers.data_store import load_transactions, load_rfm, transactions_source_files, TRANSACTION_COLUMNS
+from helpers.aggregates import load_cardholder_aggregates
+from helpers.intervals import load_interval_stats, average_transaction_duration, has_repeat_purchases
+from helpers.ranking import load_ranked_customers, top_customers as top_ranked_customers
+from helpers.formulas import cashback_budget_targeting, transaction_duration_targeting, whole_numbers
+from helpers.export import download_customers
+from helpers.preview import paginated_dataframe
+from helpers.merchants import select_merchant
+from helpers.windows import has_transactions, recency_note, select_window
 
 
 
-# Constants
-DATA_FILE_BASE_PATH = './Data/cluster_calculation/hashed/'
-
-
-def load_data(selected_cluster):
-    data_file_path = f"{DATA_FILE_BASE_PATH}rfm_cluster_{selected_cluster}.csv"
-    return pd.read_csv(data_file_path)
+def load_data(selected_cluster, merchant_id=None, window_days=None):
+    return load_rfm(selected_cluster, merchant_id, window_days)
 
 def load_full_data(selected_cluster):
-    path = f'{DATA_FILE_BASE_PATH}Full Dataset of Cluster {selected_cluster}.csv'
-    return pd.read_csv(path)
+    return load_transactions(selected_cluster, columns=TRANSACTION_COLUMNS)
 
     
-def get_cluster_statistics(selected_cluster):
-    path = f'{DATA_FILE_BASE_PATH}Full Dataset of Cluster {selected_cluster}.csv'
-    df = pd.read_csv(path)
-    
-    grouped = df.groupby('cardholder_id').agg(
-        Total_Transaction_Value=('transaction_amount', 'sum'),
-        Total_Cashback_Value=('cashback_amount', 'sum'),
-        Transaction_Count=('transaction_amount', 'count')
-    ).reset_index()
-
-    grouped['Avg_Transaction_Value'] = grouped['Total_Transaction_Value'] / grouped['Transaction_Count']
-    grouped['Avg_Cashback_Value'] = grouped['Total_Cashback_Value'] / grouped['Transaction_Count']
+@cached_by_files(lambda selected_cluster, merchant_id=None, window_days=None: transactions_source_files(selected_cluster))
+def get_cluster_statistics(selected_cluster, merchant_id=None, window_days=None):
+    grouped = load_cardholder_aggregates(selected_cluster, merchant_id, window_days)
 
     avg_order = grouped['Avg_Transaction_Value'].mean()
     avg_cashback = grouped['Avg_Cashback_Value'].mean()
@@ -38,38 +33,31 @@ def get_cluster_statistics(selected_cluster):
     return {
     'avg_order': math.floor(avg_order),
         'avg_cashback': math.floor(avg_cashback),
-        'cardholder_count': grouped['cardholder_id'].nunique(), 
+        'cardholder_count': len(grouped), 
         'df': grouped
     }
 
 def calculate_cashback_budget_and_customers(revenue_target, avg_order, avg_cashback, num_users):
-    potential_cashback_budget = avg_cashback * num_users
-    max_possible_revenue = avg_order * num_users
+    cashback_budget_needed, num_customers_to_target, potential_cashback_budget, max_possible_revenue = cashback_budget_targeting(
+        revenue_target, avg_order, avg_cashback, num_users)
     
     if revenue_target < potential_cashback_budget:
         return None, f"Error: The revenue target must be at least {math.floor(potential_cashback_budget)} ¥ to cover the minimum cashback budget."
 
-    num_customers_to_target = min(revenue_target / avg_order, num_users)
-    cashback_budget_needed = num_customers_to_target * avg_cashback
-    
     if num_customers_to_target == num_users and revenue_target > max_possible_revenue:
         return None, f"Error: The revenue target of {revenue_target} ¥ exceeds the maximum possible revenue ({math.floor(max_possible_revenue)} ¥) that can be generated from this cluster."
+    if not has_repeat_purchases(load_interval_stats(st.session_state.selected_cluster, st.session_state.get('selected_merchant'), st.session_state.get('selected_window'))):
+        return None, "Error: No cardholder bought twice in this cluster at the selected merchant and date window, so there is no transaction duration to plan with."
     days_to_achieve_target, no_of_customers_to_target, avg_transaction_duration, total_daily_revenue = calculate_days_to_achieve_target( revenue_target, avg_order, avg_cashback)
     return cashback_budget_needed, num_customers_to_target, days_to_achieve_target, no_of_customers_to_target
  
 def calculate_days_to_achieve_target( revenue_target, avg_order, avg_cashback):
-    df = load_full_data(st.session_state.selected_cluster)
-    df['transaction_date'] = pd.to_datetime(df['transaction_date'])
-    df = df.sort_values(by=['cardholder_id', 'transaction_date'])
-    df['transaction_duration'] = df.groupby('cardholder_id')['transaction_date'].diff().dt.days
-    avg_duration_per_user = df.groupby('cardholder_id')['transaction_duration'].mean()
+    intervals = load_interval_stats(st.session_state.selected_cluster, st.session_state.get('selected_merchant'), st.session_state.get('selected_window'))
 
-    avg_transaction_duration = math.ceil(avg_duration_per_user.mean()) 
+    avg_transaction_duration = average_transaction_duration(intervals)
 
-    no_of_customers_to_target = math.ceil(revenue_target / (avg_order - avg_cashback))
-    daily_revenue_per_customer = math.floor((avg_order - avg_cashback) / avg_transaction_duration)  
-    total_daily_revenue = math.floor(no_of_customers_to_target * daily_revenue_per_customer)  
-    days_to_achieve_target = math.ceil(revenue_target / total_daily_revenue) 
+    no_of_customers_to_target, daily_revenue_per_customer, total_daily_revenue, days_to_achieve_target = whole_numbers(
+        *transaction_duration_targeting(revenue_target, avg_order, avg_cashback, avg_transaction_duration))
 
     return days_to_achieve_target, no_of_customers_to_target, avg_transaction_duration, total_daily_revenue
 
@@ -82,7 +70,7 @@ def display_cluster_summary(cluster_stats, df):
     st.write(f"Average Order Value: {cluster_stats['avg_order']:.2f} ¥")
     st.write(f"Average Cashback per User: {cluster_stats['avg_cashback']:.2f} ¥")
 
-def display_results(revenue_target, cashback_budget, num_customers,days_to_achieve_target,df, prefix=""):
+def display_results(revenue_target, cashback_budget, num_customers,days_to_achieve_target,ranked, prefix=""):
     st.write(f"**To achieve a revenue target of** {math.floor(revenue_target):,.0f} ¥:")
     col1, col2 = st.columns(2)
     with col1:
@@ -91,28 +79,21 @@ def display_results(revenue_target, cashback_budget, num_customers,days_to_achie
     with col2:
         st.markdown(custom_metric(label=f"{prefix}Number of Customers to Target", value=f"{math.ceil(num_customers):,.0f} customers"), unsafe_allow_html=True)
 
-    top_customers = df.sort_values('Monetary', ascending=False).head(math.ceil(num_customers)).reset_index(drop=True)
+    top_customers = top_ranked_customers(ranked, math.ceil(num_customers))
     
     st.subheader(f"{prefix}Top Customers Preview")
-    st.dataframe(top_customers)
+    paginated_dataframe(top_customers, key=f"preview_{prefix.lower()}")
     
-    st.download_button(
-        label=f"📥 Download {prefix}Top Customer Data as CSV",
-        data=top_customers.to_csv(index=True).encode('utf-8'),
-        file_name=f'{prefix.lower()}top_customers_cluster_{st.session_state.selected_cluster}.csv',
-        mime='text/csv',
-        key=f"download_{prefix.lower()}"
-    )
-
-def render_sliders_and_results(avg_cashback, avg_order, initial_num_customers, initial_cashback_budget, days_to_achieve_target, df):
-    if 'adjusted_num_customers' not in st.session_state:
-        st.session_state.adjusted_num_customers = int(math.ceil(initial_num_customers))
-    if 'adjusted_cashback_amount' not in st.session_state:
-        st.session_state.adjusted_cashback_amount = initial_cashback_budget
+    download_customers(f"📥 Download {prefix}Top Customer Data", st.session_state.selected_cluster, math.ceil(num_customers),
+                       f'{prefix.lower()}top_customers_cluster_{st.session_state.selected_cluster}', key=f"download_{prefix.lower()}",
+                       merchant_id=st.session_state.get('selected_merchant'), window_days=st.session_state.get('selected_window'))
 
-    st.markdown("---")
-    st.subheader("Adjust Parameters")
+@st.fragment
+def render_initial_results(revenue_target, cashback_budget, num_customers, days_to_achieve_target, ranked):
+    display_results(revenue_target, cashback_budget, num_customers, days_to_achieve_target, ranked, prefix="Initial ")
 
+@st.fragment
+def render_customer_slider(avg_cashback, avg_order, initial_num_customers, days_to_achieve_target, ranked):
     adjusted_num_customers = st.slider(
         "Adjust the number of customers to target:",
         min_value=1,
@@ -126,10 +107,10 @@ def render_sliders_and_results(avg_cashback, avg_order, initial_num_customers, i
     adjusted_cashback_budget = math.floor(adjusted_num_customers * avg_cashback)
     adjusted_target_revenue = math.floor(adjusted_num_customers * avg_order)
 
-    display_results(adjusted_target_revenue, adjusted_cashback_budget, adjusted_num_customers, days_to_achieve_target, df, prefix="Adjusted ")
-
-    st.markdown("---")
+    display_results(adjusted_target_revenue, adjusted_cashback_budget, adjusted_num_customers, days_to_achieve_target, ranked, prefix="Adjusted ")
 
+@st.fragment
+def render_cashback_slider(avg_cashback, avg_order, initial_cashback_budget, days_to_achieve_target, ranked):
     adjusted_cashback_amount = st.slider(
         "Adjust the cashback amount (total):",
         min_value=0.0,
@@ -142,7 +123,28 @@ def render_sliders_and_results(avg_cashback, avg_order, initial_num_customers, i
     final_num_customers = math.ceil(adjusted_cashback_amount / avg_cashback)
     final_target_revenue = math.floor(final_num_customers * avg_order)
 
-    display_results(final_target_revenue, adjusted_cashback_amount, final_num_customers, days_to_achieve_target, df, prefix="Final ")
+    display_results(final_target_revenue, adjusted_cashback_amount, final_num_customers, days_to_achieve_target, ranked, prefix="Final ")
+
+def reset_sliders():
+    for key in ('adjusted_num_customers', 'adjusted_cashback_amount', 'slider_num_customers', 'slider_cashback_amount'):
+        if key in st.session_state:
+            del st.session_state[key]
+
+def render_sliders_and_results(avg_cashback, avg_order, initial_num_customers, initial_cashback_budget, days_to_achieve_target, ranked):
+    # Each slider is a fragment: moving it reruns its own results instead of the whole page
+    if 'adjusted_num_customers' not in st.session_state:
+        st.session_state.adjusted_num_customers = int(math.ceil(initial_num_customers))
+    if 'adjusted_cashback_amount' not in st.session_state:
+        st.session_state.adjusted_cashback_amount = initial_cashback_budget
+
+    st.markdown("---")
+    st.subheader("Adjust Parameters")
+
+    render_customer_slider(avg_cashback, avg_order, initial_num_customers, days_to_achieve_target, ranked)
+
+    st.markdown("---")
+
+    render_cashback_slider(avg_cashback, avg_order, initial_cashback_budget, days_to_achieve_target, ranked)
 
 def render():
     st.image("./Data/assets/logo.png", width=200)
@@ -174,21 +176,36 @@ def render():
                 st.session_state.selected_cluster = i
                 st.session_state.revenue_target = 1000000  # Reset revenue target when cluster changes
                 st.session_state.calculation_done = False
-                if 'adjusted_num_customers' in st.session_state:
-                    del st.session_state.adjusted_num_customers
-                if 'adjusted_cashback_amount' in st.session_state:
-                    del st.session_state.adjusted_cashback_amount
+                reset_sliders()
 
     if st.session_state.selected_cluster is None:
         return
 
     st.markdown(f"<h4>Selected Cluster: {CLUSTER_NAMES[st.session_state.selected_cluster]}</h4>", unsafe_allow_html=True)
+    st.session_state.selected_merchant = select_merchant([st.session_state.selected_cluster])
+    st.session_state.selected_window = select_window()
+    # Slider positions belong to one merchant and window; a new selection starts them over
+    selection = (st.session_state.selected_merchant, st.session_state.selected_window)
+    if st.session_state.get('slider_selection') != selection:
+        st.session_state.slider_selection = selection
+        reset_sliders()
+    if not has_transactions(st.session_state.selected_cluster, st.session_state.selected_merchant, st.session_state.selected_window):
+        st.warning("No transactions match the selected merchant and date window in this cluster.")
+        return
 
-    df = load_data(st.session_state.selected_cluster)
-    cluster_stats = get_cluster_statistics(st.session_state.selected_cluster)
+    df = load_data(st.session_state.selected_cluster, st.session_state.selected_merchant, st.session_state.selected_window)
+    cluster_stats = get_cluster_statistics(st.session_state.selected_cluster, st.session_state.selected_merchant, st.session_state.selected_window)
+    ranked = load_ranked_customers(st.session_state.selected_cluster, st.session_state.selected_merchant, st.session_state.selected_window)
 
     with st.expander("Summary Statistics of the cluster"):
         display_cluster_summary(cluster_stats, df)
+        note = recency_note(st.session_state.selected_cluster, st.session_state.selected_merchant, st.session_state.selected_window)
+        if note:
+            st.caption(note)
+
+    if cluster_stats['avg_cashback'] == 0:
+        st.warning(NO_CASHBACK_WARNING)
+        return
 
     st.markdown("---")
     st.session_state.revenue_target = st.number_input("Enter your Revenue Target (in ¥):", min_value=0, step=10000, value=st.session_state.revenue_target)
@@ -199,14 +216,14 @@ def render():
         cashback_budget_needed, num_customers_to_target, days_to_achieve_target, no_of_customers_to_target= result
         print('different num of customers: ', num_customers_to_target)
         print('different num of customers 2: ', no_of_customers_to_target)
-        display_results(st.session_state.revenue_target, cashback_budget_needed, num_customers_to_target, days_to_achieve_target, df, prefix="Initial ")
+        render_initial_results(st.session_state.revenue_target, cashback_budget_needed, num_customers_to_target, days_to_achieve_target, ranked)
         st.session_state.calculation_done = True
     else:
         st.error(result[1])
         st.session_state.calculation_done = False
 
     if st.session_state.calculation_done:
-        render_sliders_and_results(cluster_stats['avg_cashback'], cluster_stats['avg_order'], num_customers_to_target, cashback_budget_needed, days_to_achieve_target, df=df)
+        render_sliders_and_results(cluster_stats['avg_cashback'], cluster_stats['avg_order'], num_customers_to_target, cashback_budget_needed, days_to_achieve_target, ranked=ranked)
 
 # if __name__ == "__main__":
 #     render()
\ No newline at end of file
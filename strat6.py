@@ -1,37 +1,33 @@
 import streamlit as st
 import pandas as pd
 import math
-from helpers.compute_metrics import custom_metric, CLUSTER_NAMES
+from helpers.compute_metrics import custom_metric, CLUSTER_NAMES, NO_CASHBACK_WARNING
+from helpers.cache import cached_by_files
+from helpers.data_store import load_transactions, load_rfm, transactions_source_files, TRANSACTION_COLUMNS
+from helpers.aggregates import load_cardholder_aggregates
+from helpers.intervals import load_interval_stats, average_transaction_duration, has_repeat_purchases
+from helpers.ranking import RankedCustomers, load_ranked_customers, top_customers as top_ranked_customers
+from helpers.formulas import cashback_budget_targeting, transaction_duration_targeting, whole_numbers
+from helpers.export import download_customers
+from helpers.preview import paginated_dataframe
+from helpers.merchants import select_merchant
+from helpers.windows import has_transactions, recency_note, select_window
 
-# Constants
-DATA_FILE_BASE_PATH = './Data/cluster_calculation/hashed/'
 
-
-def load_data(selected_cluster: int) -> pd.DataFrame:
-    """Load cluster-specific data."""
-    data_file_path = f"{DATA_FILE_BASE_PATH}rfm_cluster_{selected_cluster}.csv"
-    return pd.read_csv(data_file_path)
+def load_data(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> pd.DataFrame:
+    """Load cluster-specific data, or the cluster's data at one merchant and/or in a date window."""
+    return load_rfm(selected_cluster, merchant_id, window_days)
 
 
 def load_full_data(selected_cluster: int) -> pd.DataFrame:
     """Load the full dataset for the selected cluster."""
-    path = f'{DATA_FILE_BASE_PATH}Full Dataset of Cluster {selected_cluster}.csv'
-    return pd.read_csv(path)
-
+    return load_transactions(selected_cluster, columns=TRANSACTION_COLUMNS)
 
-def get_cluster_statistics(selected_cluster: int) -> dict:
-    """Get statistical data (avg order, cashback, and count) for the selected cluster."""
-    df = load_full_data(selected_cluster)
-    
-    # Group by cardholder_id to calculate statistics
-    grouped = df.groupby('cardholder_id').agg(
-        Total_Transaction_Value=('transaction_amount', 'sum'),
-        Total_Cashback_Value=('cashback_amount', 'sum'),
-        Transaction_Count=('transaction_amount', 'count')
-    ).reset_index()
 
-    grouped['Avg_Transaction_Value'] = grouped['Total_Transaction_Value'] / grouped['Transaction_Count']
-    grouped['Avg_Cashback_Value'] = grouped['Total_Cashback_Value'] / grouped['Transaction_Count']
+@cached_by_files(lambda selected_cluster, merchant_id=None, window_days=None: transactions_source_files(selected_cluster))
+def get_cluster_statistics(selected_cluster: int, merchant_id: str | None = None, window_days: int | None = None) -> dict:
+    """Get statistical data (avg order, cashback, and count) for the selected cluster or one of its merchants and date windows, once per data file."""
+    grouped = load_cardholder_aggregates(selected_cluster, merchant_id, window_days)
 
     # Calculate mean values
     avg_order = grouped['Avg_Transaction_Value'].mean()
@@ -40,28 +36,29 @@ def get_cluster_statistics(selected_cluster: int) -> dict:
     return {
         'avg_order': math.floor(avg_order),
         'avg_cashback': math.floor(avg_cashback),
-        'cardholder_count': grouped['cardholder_id'].nunique(), 
+        'cardholder_count': len(grouped), 
         'df': grouped
     }
 
 
 def calculate_cashback_budget_and_customers(revenue_target: float, avg_order: float, avg_cashback: float, num_users: int):
     """Calculate cashback budget, number of customers to target, and potential errors."""
-    potential_cashback_budget = avg_cashback * num_users
-    max_possible_revenue = avg_order * num_users
+    # Calculate the number of customers needed to reach the target
+    cashback_budget_needed, num_customers_to_target, potential_cashback_budget, max_possible_revenue = cashback_budget_targeting(
+        revenue_target, avg_order, avg_cashback, num_users)
 
     # Ensure the revenue target is feasible
     if revenue_target < potential_cashback_budget:
         return None, f"Error: The revenue target must be at least {math.floor(potential_cashback_budget)} ¥ to cover the minimum cashback budget."
 
-    # Calculate the number of customers needed to reach the target
-    num_customers_to_target = min(revenue_target / avg_order, num_users)
-    cashback_budget_needed = num_customers_to_target * avg_cashback
-
     # Error handling for exceeding max possible revenue
     if num_customers_to_target == num_users and revenue_target > max_possible_revenue:
         return None, f"Error: The revenue target of {revenue_target} ¥ exceeds the maximum possible revenue ({math.floor(max_possible_revenue)} ¥) for this cluster."
 
+    # A merchant's customers, or a short window, may have no repeat purchase at all
+    if not has_repeat_purchases(load_interval_stats(st.session_state.selected_cluster, st.session_state.get('selected_merchant'), st.session_state.get('selected_window'))):
+        return None, "Error: No cardholder bought twice in this cluster at the selected merchant and date window, so there is no transaction duration to plan with."
+
     # Additional metrics
     days_to_achieve_target, no_of_customers_to_target, avg_transaction_duration, total_daily_revenue = calculate_days_to_achieve_target(
         revenue_target, avg_order, avg_cashback)
@@ -71,18 +68,12 @@ def calculate_cashback_budget_and_customers(revenue_target: float, avg_order: fl
 
 def calculate_days_to_achieve_target(revenue_target: float, avg_order: float, avg_cashback: float):
     """Calculate the number of days to achieve the revenue target based on transactions."""
-    df = load_full_data(st.session_state.selected_cluster)
-    df['transaction_date'] = pd.to_datetime(df['transaction_date'])
-    df = df.sort_values(by=['cardholder_id', 'transaction_date'])
-    df['transaction_duration'] = df.groupby('cardholder_id')['transaction_date'].diff().dt.days
-    avg_duration_per_user = df.groupby('cardholder_id')['transaction_duration'].mean()
+    intervals = load_interval_stats(st.session_state.selected_cluster, st.session_state.get('selected_merchant'), st.session_state.get('selected_window'))
 
     # Calculate average transaction duration and daily revenue metrics
-    avg_transaction_duration = math.ceil(avg_duration_per_user.mean()) 
-    no_of_customers_to_target = math.ceil(revenue_target / (avg_order - avg_cashback))
-    daily_revenue_per_customer = math.floor((avg_order - avg_cashback) / avg_transaction_duration)  
-    total_daily_revenue = math.floor(no_of_customers_to_target * daily_revenue_per_customer)  
-    days_to_achieve_target = math.ceil(revenue_target / total_daily_revenue) 
+    avg_transaction_duration = average_transaction_duration(intervals)
+    no_of_customers_to_target, daily_revenue_per_customer, total_daily_revenue, days_to_achieve_target = whole_numbers(
+        *transaction_duration_targeting(revenue_target, avg_order, avg_cashback, avg_transaction_duration))
 
     return days_to_achieve_target, no_of_customers_to_target, avg_transaction_duration, total_daily_revenue
 
@@ -98,7 +89,7 @@ def display_cluster_summary(cluster_stats: dict, df: pd.DataFrame):
     st.write(f"Average Cashback per User: {cluster_stats['avg_cashback']:.2f} ¥")
 
 
-def display_results(revenue_target: float, cashback_budget: float, num_customers: int, days_to_achieve_target: int, df: pd.DataFrame, prefix: str = ""):
+def display_results(revenue_target: float, cashback_budget: float, num_customers: int, days_to_achieve_target: int, ranked: RankedCustomers, prefix: str = ""):
     """Display the result of the calculations."""
     st.write(f"**To achieve a revenue target of** {math.floor(revenue_target):,.0f} ¥:")
     
@@ -109,31 +100,25 @@ def display_results(revenue_target: float, cashback_budget: float, num_customers
     with col2:
         st.markdown(custom_metric(label=f"{prefix}Number of Customers to Target", value=f"{math.ceil(num_customers):,.0f} customers"), unsafe_allow_html=True)
 
-    top_customers = df.sort_values('Monetary', ascending=False).head(math.ceil(num_customers)).reset_index(drop=True)
+    top_customers = top_ranked_customers(ranked, math.ceil(num_customers))
     
     st.subheader(f"{prefix}Top Customers Preview")
-    st.dataframe(top_customers)
+    paginated_dataframe(top_customers, key=f"preview_{prefix.lower()}")
     
-    st.download_button(
-        label=f"📥 Download {prefix}Top Customer Data as CSV",
-        data=top_customers.to_csv(index=True).encode('utf-8'),
-        file_name=f'{prefix.lower()}top_customers_cluster_{st.session_state.selected_cluster}.csv',
-        mime='text/csv',
-        key=f"download_{prefix.lower()}"
-    )
+    download_customers(f"📥 Download {prefix}Top Customer Data", st.session_state.selected_cluster, math.ceil(num_customers),
+                       f'{prefix.lower()}top_customers_cluster_{st.session_state.selected_cluster}', key=f"download_{prefix.lower()}",
+                       merchant_id=st.session_state.get('selected_merchant'), window_days=st.session_state.get('selected_window'))
 
 
-def render_sliders_and_results(avg_cashback: float, avg_order: float, initial_num_customers: int, initial_cashback_budget: float, days_to_achieve_target: int, df: pd.DataFrame):
-    """Render sliders to adjust customer targeting and display the results."""
-    if 'adjusted_num_customers' not in st.session_state:
-        st.session_state.adjusted_num_customers = int(math.ceil(initial_num_customers))
-    if 'adjusted_cashback_amount' not in st.session_state:
-        st.session_state.adjusted_cashback_amount = initial_cashback_budget
+@st.fragment
+def render_initial_results(revenue_target: float, cashback_budget: float, num_customers: int, days_to_achieve_target: int, ranked: RankedCustomers):
+    """The results for the entered target; paging or exporting them reruns only this section."""
+    display_results(revenue_target, cashback_budget, num_customers, days_to_achieve_target, ranked, prefix="Initial ")
 
-    st.markdown("---")
-    st.subheader("Adjust Parameters")
 
-    # Slider for adjusting the number of customers
+@st.fragment
+def render_customer_slider(avg_cashback: float, avg_order: float, initial_num_customers: int, days_to_achieve_target: int, ranked: RankedCustomers):
+    """Slider for the number of customers and its results, rerun on their own when the slider moves."""
     adjusted_num_customers = st.slider(
         "Adjust the number of customers to target:",
         min_value=1,
@@ -146,12 +131,13 @@ def render_sliders_and_results(avg_cashback: float, avg_order: float, initial_nu
     # Adjust cashback and revenue based on the selected number of customers
     adjusted_cashback_budget = math.floor(adjusted_num_customers * avg_cashback)
     adjusted_target_revenue = math.floor(adjusted_num_customers * avg_order)
-    
-    display_results(adjusted_target_revenue, adjusted_cashback_budget, adjusted_num_customers, days_to_achieve_target, df, prefix="Adjusted ")
 
-    st.markdown("---")
+    display_results(adjusted_target_revenue, adjusted_cashback_budget, adjusted_num_customers, days_to_achieve_target, ranked, prefix="Adjusted ")
 
-    # Slider for adjusting the cashback amount
+
+@st.fragment
+def render_cashback_slider(avg_cashback: float, avg_order: float, initial_cashback_budget: float, days_to_achieve_target: int, ranked: RankedCustomers):
+    """Slider for the total cashback and its results, rerun on their own when the slider moves."""
     adjusted_cashback_amount = st.slider(
         "Adjust the cashback amount (total):",
         min_value=0.0,
@@ -165,9 +151,34 @@ def render_sliders_and_results(avg_cashback: float, avg_order: float, initial_nu
     final_num_customers = math.ceil(adjusted_cashback_amount / avg_cashback)
     final_target_revenue = math.floor(final_num_customers * avg_order)
 
-    display_results(final_target_revenue, adjusted_cashback_amount, final_num_customers
+    display_results(final_target_revenue, adjusted_cashback_amount, final_num_customers, days_to_achieve_target, ranked, prefix="Final ")
+
 
-, days_to_achieve_target, df, prefix="Final ")
+def reset_sliders():
+    """Forget the adjusted customers and cashback and both slider widgets, so they restart from the new results."""
+    for key in ('adjusted_num_customers', 'adjusted_cashback_amount', 'slider_num_customers', 'slider_cashback_amount'):
+        if key in st.session_state:
+            del st.session_state[key]
+
+
+def render_sliders_and_results(avg_cashback: float, avg_order: float, initial_num_customers: int, initial_cashback_budget: float, days_to_achieve_target: int, ranked: RankedCustomers):
+    """Render sliders to adjust customer targeting and display the results.
+
+    Each slider lives in its own fragment, so moving it reruns only its results, not the page.
+    """
+    if 'adjusted_num_customers' not in st.session_state:
+        st.session_state.adjusted_num_customers = int(math.ceil(initial_num_customers))
+    if 'adjusted_cashback_amount' not in st.session_state:
+        st.session_state.adjusted_cashback_amount = initial_cashback_budget
+
+    st.markdown("---")
+    st.subheader("Adjust Parameters")
+
+    render_customer_slider(avg_cashback, avg_order, initial_num_customers, days_to_achieve_target, ranked)
+
+    st.markdown("---")
+
+    render_cashback_slider(avg_cashback, avg_order, initial_cashback_budget, days_to_achieve_target, ranked)
 
 
 def render():
@@ -201,21 +212,36 @@ def render():
                 st.session_state.selected_cluster = i
                 st.session_state.revenue_target = 1000000  # Reset revenue target when cluster changes
                 st.session_state.calculation_done = False
-                if 'adjusted_num_customers' in st.session_state:
-                    del st.session_state.adjusted_num_customers
-                if 'adjusted_cashback_amount' in st.session_state:
-                    del st.session_state.adjusted_cashback_amount
+                reset_sliders()
 
     if st.session_state.selected_cluster is None:
         return
 
     st.markdown(f"<h4>Selected Cluster: {CLUSTER_NAMES[st.session_state.selected_cluster]}</h4>", unsafe_allow_html=True)
+    st.session_state.selected_merchant = select_merchant([st.session_state.selected_cluster])
+    st.session_state.selected_window = select_window()
+    # Slider positions belong to one merchant and window; a new selection starts them over
+    selection = (st.session_state.selected_merchant, st.session_state.selected_window)
+    if st.session_state.get('slider_selection') != selection:
+        st.session_state.slider_selection = selection
+        reset_sliders()
+    if not has_transactions(st.session_state.selected_cluster, st.session_state.selected_merchant, st.session_state.selected_window):
+        st.warning("No transactions match the selected merchant and date window in this cluster.")
+        return
 
-    df = load_data(st.session_state.selected_cluster)
-    cluster_stats = get_cluster_statistics(st.session_state.selected_cluster)
+    df = load_data(st.session_state.selected_cluster, st.session_state.selected_merchant, st.session_state.selected_window)
+    cluster_stats = get_cluster_statistics(st.session_state.selected_cluster, st.session_state.selected_merchant, st.session_state.selected_window)
+    ranked = load_ranked_customers(st.session_state.selected_cluster, st.session_state.selected_merchant, st.session_state.selected_window)
 
     with st.expander("Summary Statistics of the cluster"):
         display_cluster_summary(cluster_stats, df)
+        note = recency_note(st.session_state.selected_cluster, st.session_state.selected_merchant, st.session_state.selected_window)
+        if note:
+            st.caption(note)
+
+    if cluster_stats['avg_cashback'] == 0:
+        st.warning(NO_CASHBACK_WARNING)
+        return
 
     st.markdown("---")
     st.session_state.revenue_target = st.number_input("Enter your Revenue Target (in ¥):", min_value=0, step=10000, value=st.session_state.revenue_target)
@@ -224,14 +250,14 @@ def render():
 
     if isinstance(result[0], float):
         cashback_budget_needed, num_customers_to_target, days_to_achieve_target, no_of_customers_to_target = result
-        display_results(st.session_state.revenue_target, cashback_budget_needed, num_customers_to_target, days_to_achieve_target, df, prefix="Initial ")
+        render_initial_results(st.session_state.revenue_target, cashback_budget_needed, num_customers_to_target, days_to_achieve_target, ranked)
         st.session_state.calculation_done = True
     else:
         st.error(result[1])
         st.session_state.calculation_done = False
 
     if st.session_state.calculation_done:
-        render_sliders_and_results(cluster_stats['avg_cashback'], cluster_stats['avg_order'], num_customers_to_target, cashback_budget_needed, days_to_achieve_target, df)
+        render_sliders_and_results(cluster_stats['avg_cashback'], cluster_stats['avg_order'], num_customers_to_target, cashback_budget_needed, days_to_achieve_target, ranked)
 
 # Uncomment the line below to run the app in a Streamlit environment.
 # if __name__ == "__main__":
@@ -0,0 +1,46 @@
+import streamlit as st
+import math
+from helpers.compute_metrics import custom_metric, CLUSTER_NAMES
+from helpers.optimizer import load_cashback_pool, allocate_budget, allocation_by_cluster
+from helpers.preview import paginated_dataframe
+from helpers.windows import select_window
+
+
+def display_allocation(pool, cashback_budget: float):
+    """Show who the budget is spent on, overall and per cluster."""
+    allocation = allocate_budget(pool, cashback_budget)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.markdown(custom_metric(label="Customers to Target", value=f"{len(allocation.cardholders):,} customers"), unsafe_allow_html=True)
+    with col2:
+        st.markdown(custom_metric(label="Cashback Budget Used", value=f"{math.floor(allocation.cashback_budget):,.0f} ¥"), unsafe_allow_html=True)
+    with col3:
+        st.markdown(custom_metric(label="Expected Net Revenue", value=f"{math.floor(allocation.net_value):,.0f} ¥"), unsafe_allow_html=True)
+
+    if len(allocation.cardholders) == len(pool.cardholders):
+        st.warning(f"The budget covers every cardholder with a positive net value; only {math.floor(allocation.cashback_budget):,.0f} ¥ of it is needed.")
+
+    st.subheader("Allocation by Cluster")
+    by_cluster = allocation_by_cluster(allocation)
+    by_cluster.index = [CLUSTER_NAMES[selected_cluster] for selected_cluster in by_cluster.index]
+    st.dataframe(by_cluster.round(0))
+
+    st.subheader("Selected Cardholders")
+    paginated_dataframe(allocation.cardholders, key="preview_global")
+
+
+def render():
+    st.image("./Data/assets/logo.png", width=200)
+    st.title("Global Cashback Budget Optimizer")
+    st.markdown("Spend one cashback budget across all clusters on the cardholders with the highest expected net revenue "
+                "`( Avg Transaction - Avg Cashback )` per yen of cashback.")
+
+    pool = load_cashback_pool(window_days=select_window())
+    if len(pool.cardholders) == 0:
+        st.error("No cardholders with a positive net value were found in any cluster.")
+        return
+
+    st.markdown("---")
+    cashback_budget = st.number_input("Enter your total Cashback Budget (in ¥):", min_value=0, step=10000, value=100000)
+    display_allocation(pool, cashback_budget)
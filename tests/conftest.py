@@ -0,0 +1,41 @@
+import os
+import sys
+import shutil
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)  # The helpers package lives at the repository root, with no installed package
+
+from helpers.cache import clear_caches
+from helpers.data_store import DATA_FILE_BASE_PATH
+
+
+def copy_shipped_data(root):
+    """Copy the shipped CSVs under root; converted stores, indexes and logs are built by the code under test."""
+    shutil.copytree(os.path.join(REPO_ROOT, DATA_FILE_BASE_PATH), os.path.join(root, DATA_FILE_BASE_PATH))
+
+
+@pytest.fixture(scope='session')
+def shipped_data_root(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('shipped'))
+    copy_shipped_data(root)
+    return root
+
+
+@pytest.fixture
+def shipped_data(shipped_data_root, monkeypatch):
+    """Run in a copy of the shipped data shared by the tests that only read it (indexes may be written beside it)."""
+    monkeypatch.chdir(shipped_data_root)
+    clear_caches()
+    yield shipped_data_root
+    clear_caches()
+
+
+@pytest.fixture
+def data_copy(tmp_path, monkeypatch):
+    """Run in a private copy of the shipped data, for tests that ingest into it."""
+    copy_shipped_data(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    clear_caches()
+    yield str(tmp_path)
+    clear_caches()
@@ -0,0 +1,168 @@
+"""Incremental ingestion against recomputing everything from the appended CSVs."""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from helpers import ingest
+from helpers.cache import clear_caches
+from helpers.data_store import (
+    RFM_REFERENCE_DATE,
+    TRANSACTION_COLUMNS,
+    convert_cluster_dataset,
+    convert_full_dataset,
+    convert_full_dataset_feather,
+    full_dataset_csv_path,
+    load_rfm,
+    load_transactions,
+    part_paths,
+    read_transactions_csv,
+    rfm_csv_path,
+    transactions_source_path,
+)
+from helpers.aggregates import build_cardholder_aggregates, load_cardholder_aggregates
+from helpers.intervals import build_interval_stats, load_interval_stats
+
+CLUSTERS = [1, 2]
+
+
+def build_stores(store: str):
+    """Convert the clusters' CSVs into the store readers should use; 'csv' keeps the CSVs only."""
+    for selected_cluster in CLUSTERS:
+        if store == 'feather':
+            convert_full_dataset_feather(selected_cluster)
+        elif store == 'parquet':
+            convert_full_dataset(selected_cluster)
+        elif store == 'dataset':
+            convert_cluster_dataset(selected_cluster)
+
+
+def write_batches(directory: str) -> list:
+    """Two batches: one after every cardholder's history, with new cardholders, in two clusters;
+    one with rows inside the history of cluster 1, as Parquet."""
+    first, second = [], None
+    for selected_cluster in CLUSTERS:
+        df = read_transactions_csv(full_dataset_csv_path(selected_cluster))
+        rows = df.tail(30).copy()
+        rows['transaction_date'] += pd.Timedelta(days=5)
+        rows.loc[rows.index[:3], 'cardholder_id'] = [f'new-{selected_cluster}-{i}' for i in range(3)]
+        first.append(rows)
+        if selected_cluster == 1:
+            second = df.sample(40, random_state=0)
+            second['transaction_date'] -= pd.Timedelta(days=2)
+    paths = [os.path.join(directory, 'first.csv'), os.path.join(directory, 'second.parquet')]
+    pd.concat(first).to_csv(paths[0], index=False)
+    second.to_parquet(paths[1], index=False)
+    return paths
+
+
+@pytest.fixture
+def shipped_rfm(data_copy):
+    return {selected_cluster: pd.read_csv(rfm_csv_path(selected_cluster)) for selected_cluster in CLUSTERS}
+
+
+@pytest.fixture
+def batches(data_copy, tmp_path_factory):
+    return write_batches(str(tmp_path_factory.mktemp('batches')))
+
+
+def assert_matches_recompute(selected_cluster: int, shipped_rfm: pd.DataFrame, batch_rows: pd.DataFrame):
+    """Every loader agrees with the same figures computed from the whole appended CSV."""
+    clear_caches()
+    history = read_transactions_csv(full_dataset_csv_path(selected_cluster))
+    pd.testing.assert_frame_equal(load_transactions(selected_cluster, TRANSACTION_COLUMNS), history[TRANSACTION_COLUMNS], check_dtype=False)
+    pd.testing.assert_frame_equal(load_cardholder_aggregates(selected_cluster), build_cardholder_aggregates(history), rtol=1e-12)
+
+    expected = build_interval_stats(history['cardholder_id'].to_numpy(), history['transaction_date'].to_numpy())
+    stats = load_interval_stats(selected_cluster)
+    for field in expected._fields:
+        np.testing.assert_array_equal(getattr(stats, field), getattr(expected, field))
+    state = ingest.load_fresh_state(selected_cluster)
+    np.testing.assert_array_equal(state['Gap_Count'], expected.gap_count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.testing.assert_allclose(state['Gap_Days_Sum'] / state['Gap_Count'], expected.mean_gap_days, rtol=1e-12)
+
+    reference = ingest.reference_date(selected_cluster, ingest.read_ingest_log())
+    rfm = shipped_rfm.set_index('cardholder_id')
+    rfm['Recency'] += (reference - RFM_REFERENCE_DATE).days
+    touched = batch_rows.groupby('cardholder_id')['transaction_amount'].agg(['count', 'sum'])
+    rfm = rfm.reindex(rfm.index.union(touched.index)).fillna({'Recency': 0, 'Frequency': 0, 'Monetary': 0.0})
+    rfm.loc[touched.index, 'Frequency'] += touched['count']
+    rfm.loc[touched.index, 'Monetary'] += touched['sum']
+    last = history.groupby('cardholder_id')['transaction_date'].max().loc[touched.index]
+    rfm.loc[touched.index, 'Recency'] = (reference - last.dt.normalize()).dt.days
+    actual = load_rfm(selected_cluster).set_index('cardholder_id').sort_index()
+    pd.testing.assert_frame_equal(actual, rfm.sort_index(), check_dtype=False, rtol=1e-12)
+
+
+def batch_rows(paths: list, selected_cluster: int) -> pd.DataFrame:
+    rows = pd.concat([ingest.read_batch(path) for path in paths])
+    return rows[rows['Cluster'] == selected_cluster]
+
+
+@pytest.mark.parametrize('store', ['feather', 'dataset', 'parquet', 'csv'])
+def test_ingest_matches_recompute(data_copy, shipped_rfm, batches, store):
+    build_stores(store)
+    sources = {selected_cluster: transactions_source_path(selected_cluster) for selected_cluster in CLUSTERS}
+    for path in batches:
+        assert ingest.ingest_batch(path)['status'] == 'applied'
+    for selected_cluster in CLUSTERS:
+        assert transactions_source_path(selected_cluster) == sources[selected_cluster]
+        if store != 'csv':
+            assert part_paths(sources[selected_cluster])
+        assert_matches_recompute(selected_cluster, shipped_rfm[selected_cluster], batch_rows(batches, selected_cluster))
+
+
+def test_ingesting_a_batch_again_is_a_no_op(data_copy, batches):
+    build_stores('feather')
+    ingest.ingest_batch(batches[0])
+    sizes = {selected_cluster: os.path.getsize(full_dataset_csv_path(selected_cluster)) for selected_cluster in CLUSTERS}
+    assert ingest.ingest_batch(batches[0])['status'] == 'skipped'
+    assert sizes == {selected_cluster: os.path.getsize(full_dataset_csv_path(selected_cluster)) for selected_cluster in CLUSTERS}
+    assert [entry['status'] for entry in ingest.read_ingest_log()] == ['started', 'applied']
+
+
+@pytest.mark.parametrize('failing', ['write_part', 'write_rfm_part'])
+def test_interrupted_batch_is_rolled_back(data_copy, shipped_rfm, batches, monkeypatch, failing):
+    build_stores('feather')
+    ingest.ingest_batch(batches[0])
+    source = transactions_source_path(1)
+    rows = len(load_transactions(1))
+
+    def interrupted(*args, **kwargs):
+        raise RuntimeError("interrupted")
+
+    # Both fail after the CSV append, so there is something to undo
+    with monkeypatch.context() as patch, pytest.raises(RuntimeError):
+        patch.setattr(ingest, failing, interrupted)
+        ingest.ingest_batch(batches[1])
+    ingest.roll_back_interrupted(ingest.read_ingest_log())
+
+    clear_caches()
+    assert transactions_source_path(1) == source
+    assert len(load_transactions(1)) == rows
+    assert ingest.has_fresh_state(1)
+    assert ingest.ingest_batch(batches[1])['status'] == 'applied'
+    assert_matches_recompute(1, shipped_rfm[1], batch_rows(batches, 1))
+
+
+def test_compact_folds_the_parts_in(data_copy, shipped_rfm, batches):
+    build_stores('feather')
+    for path in batches:
+        ingest.ingest_batch(path)
+    for selected_cluster in CLUSTERS:
+        ingest.compact(selected_cluster)
+        assert not part_paths(transactions_source_path(selected_cluster))
+        assert not part_paths(ingest.cardholder_state_path(selected_cluster))
+        assert not part_paths(rfm_csv_path(selected_cluster))
+        assert_matches_recompute(selected_cluster, shipped_rfm[selected_cluster], batch_rows(batches, selected_cluster))
+
+
+def test_rebuilding_a_store_drops_its_parts(data_copy, batches):
+    build_stores('feather')
+    ingest.ingest_batch(batches[0])
+    assert part_paths(transactions_source_path(1))
+    convert_full_dataset_feather(1)
+    assert not part_paths(transactions_source_path(1))
+    clear_caches()
+    pd.testing.assert_frame_equal(load_transactions(1, TRANSACTION_COLUMNS),
+                                  read_transactions_csv(full_dataset_csv_path(1), TRANSACTION_COLUMNS), check_dtype=False)
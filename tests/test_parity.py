@@ -0,0 +1,89 @@
+"""The indexed, coded and streaming loaders against plain groupbys over the same transactions."""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from helpers.data_store import full_dataset_csv_path, load_transactions
+from helpers.aggregates import build_cardholder_aggregates, load_cardholder_aggregates
+from helpers.intervals import build_interval_stats, load_interval_stats
+from helpers.merchants import load_merchant_index, normalize_merchant_id
+from helpers.rfm_pipeline import compute_rfm
+from helpers.streaming import stream_statistics
+from helpers.windows import WINDOW_DAYS, load_slice_rfm, recency_reference_day, transaction_rows
+
+CLUSTERS = range(5)
+
+
+def require_transactions(selected_cluster: int):
+    if not os.path.exists(full_dataset_csv_path(selected_cluster)):
+        pytest.skip(f"no transactions shipped for cluster {selected_cluster}")
+
+
+def slices(selected_cluster: int) -> list:
+    """The whole cluster, each window, a few merchants, and a merchant within a window."""
+    merchants = list(load_merchant_index(selected_cluster).merchants['merchant_id'][:3])
+    return [(None, None), *[(None, window_days) for window_days in WINDOW_DAYS], *[(merchant_id, None) for merchant_id in merchants],
+            (merchants[0], 30)]
+
+
+def slice_transactions(selected_cluster: int, merchant_id, window_days) -> pd.DataFrame:
+    """The slice's rows picked by masks over the whole table, without any index."""
+    df = load_transactions(selected_cluster)
+    keep = np.ones(len(df), dtype=bool)
+    if merchant_id is not None:
+        keep &= df['merchant_id'].map(normalize_merchant_id).to_numpy() == merchant_id
+    if window_days is not None:
+        since = df['transaction_date'].max().normalize() + pd.Timedelta(days=1) - pd.Timedelta(days=window_days)
+        keep &= (df['transaction_date'] >= since).to_numpy()
+    return df[keep].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('selected_cluster', CLUSTERS)
+def test_slice_rows_match_masks(shipped_data, selected_cluster):
+    require_transactions(selected_cluster)
+    df = load_transactions(selected_cluster)
+    for merchant_id, window_days in slices(selected_cluster):
+        expected = slice_transactions(selected_cluster, merchant_id, window_days)
+        rows = np.sort(transaction_rows(selected_cluster, merchant_id, window_days))
+        pd.testing.assert_frame_equal(df.take(rows).reset_index(drop=True), expected)
+
+
+@pytest.mark.parametrize('selected_cluster', CLUSTERS)
+def test_slice_aggregates_match_groupby(shipped_data, selected_cluster):
+    require_transactions(selected_cluster)
+    for merchant_id, window_days in slices(selected_cluster):
+        expected = build_cardholder_aggregates(slice_transactions(selected_cluster, merchant_id, window_days))
+        pd.testing.assert_frame_equal(load_cardholder_aggregates(selected_cluster, merchant_id, window_days), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize('selected_cluster', CLUSTERS)
+def test_slice_intervals_match_groupby(shipped_data, selected_cluster):
+    require_transactions(selected_cluster)
+    for merchant_id, window_days in slices(selected_cluster):
+        df = slice_transactions(selected_cluster, merchant_id, window_days)
+        expected = build_interval_stats(df['cardholder_id'].to_numpy(), df['transaction_date'].to_numpy())
+        stats = load_interval_stats(selected_cluster, merchant_id, window_days)
+        for field in expected._fields:
+            np.testing.assert_array_equal(getattr(stats, field), getattr(expected, field))
+
+
+@pytest.mark.parametrize('selected_cluster', CLUSTERS)
+def test_slice_rfm_matches_compute_rfm(shipped_data, selected_cluster):
+    require_transactions(selected_cluster)
+    for merchant_id, window_days in slices(selected_cluster)[1:]:
+        expected = compute_rfm(slice_transactions(selected_cluster, merchant_id, window_days), recency_reference_day(selected_cluster))
+        pd.testing.assert_frame_equal(load_slice_rfm(selected_cluster, merchant_id, window_days), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize('selected_cluster', CLUSTERS)
+def test_streaming_matches_in_memory(shipped_data, selected_cluster):
+    require_transactions(selected_cluster)
+    # Small chunks and spill memory, so chunk boundaries, out-of-order cardholders and split spill partitions all occur
+    stats = stream_statistics(selected_cluster, chunk_rows=5_000, memory_bytes=16 << 10)
+    df = load_transactions(selected_cluster)
+    expected = build_cardholder_aggregates(df)
+    expected_intervals = build_interval_stats(df['cardholder_id'].to_numpy(), df['transaction_date'].to_numpy())
+    pd.testing.assert_frame_equal(stats.aggregates[expected.columns], expected, rtol=1e-12)
+    np.testing.assert_array_equal(stats.intervals.cardholder_ids, expected_intervals.cardholder_ids)
+    np.testing.assert_array_equal(stats.intervals.gap_count, expected_intervals.gap_count)
+    np.testing.assert_allclose(stats.intervals.mean_gap_days, expected_intervals.mean_gap_days, rtol=1e-12)